@@ -44,9 +44,38 @@ class EnvironmentConfig:
             'SUPABASE_SERVICE_ROLE_KEY',
             required=self.ENVIRONMENT == 'production'
         )
+        # Supabase（PostgREST）接続プール設定
+        self.SUPABASE_POOL_SIZE = self._validate_int('SUPABASE_POOL_SIZE', 20)
+        self.SUPABASE_POOL_KEEPALIVE = self._validate_int('SUPABASE_POOL_KEEPALIVE', 10)
         
         # Webhook設定
         self.WEBHOOK_HANDLER_PATH = '/webhook'
+
+        # リマインダー設定（polling: 1分ごとのポーリング, timer: 予定時刻までスリープ）
+        self.REMINDER_SCHEDULER_MODE = os.getenv('REMINDER_SCHEDULER_MODE', 'polling')
+        if self.REMINDER_SCHEDULER_MODE not in ('polling', 'timer'):
+            raise ValueError(f"Invalid REMINDER_SCHEDULER_MODE value: {self.REMINDER_SCHEDULER_MODE}")
+
+        # 友だち全員にbroadcastするトリガーの種類（カンマ区切り）。既定は空で、イベント参加者へのmulticastのみ
+        # broadcastはチャネルの送信数を友だち全員分消費し、送信回数の制限も厳しいため明示的に有効にする
+        self.LINE_BROADCAST_TRIGGERS = tuple(
+            condition.strip()
+            for condition in os.getenv('LINE_BROADCAST_TRIGGERS', '').split(',')
+            if condition.strip()
+        )
+        for condition in self.LINE_BROADCAST_TRIGGERS:
+            if condition not in ('event_created', 'event_updated', 'event_cancelled'):
+                raise ValueError(f"Invalid LINE_BROADCAST_TRIGGERS value: {condition}")
+
+        # Webhookの重複排除（memory: プロセス内のみ、table: webhook_eventsテーブルでレプリカ間も判定）
+        self.WEBHOOK_DEDUP_STORE = os.getenv('WEBHOOK_DEDUP_STORE', 'memory')
+        if self.WEBHOOK_DEDUP_STORE not in ('memory', 'table'):
+            raise ValueError(f"Invalid WEBHOOK_DEDUP_STORE value: {self.WEBHOOK_DEDUP_STORE}")
+
+        # イベント検索（memory: プロセス内の2-gramインデックス、database: search_events関数）
+        self.EVENT_SEARCH_STORE = os.getenv('EVENT_SEARCH_STORE', 'memory')
+        if self.EVENT_SEARCH_STORE not in ('memory', 'database'):
+            raise ValueError(f"Invalid EVENT_SEARCH_STORE value: {self.EVENT_SEARCH_STORE}")
         
         # 環境別の設定
         self._load_environment_specific_settings()
@@ -73,6 +102,15 @@ class EnvironmentConfig:
         
         return value
 
+    def _validate_int(self, var_name: str, default: int) -> int:
+        """正の整数値の検証"""
+        value = os.getenv(var_name)
+        if value is None:
+            return default
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError(f"Invalid integer value for {var_name}: {value}")
+        return int(value)
+
     def _validate_url(self, var_name: str, required: bool = False) -> Optional[str]:
         """URLの検証"""
         value = os.getenv(var_name)
@@ -147,7 +185,13 @@ class EnvironmentConfig:
             'RETRY_ATTEMPTS': self.RETRY_ATTEMPTS,
             'RETRY_DELAY': self.RETRY_DELAY,
             'CONNECTION_TIMEOUT': self.CONNECTION_TIMEOUT,
-            'WEBHOOK_HANDLER_PATH': self.WEBHOOK_HANDLER_PATH
+            'SUPABASE_POOL_SIZE': self.SUPABASE_POOL_SIZE,
+            'SUPABASE_POOL_KEEPALIVE': self.SUPABASE_POOL_KEEPALIVE,
+            'WEBHOOK_HANDLER_PATH': self.WEBHOOK_HANDLER_PATH,
+            'REMINDER_SCHEDULER_MODE': self.REMINDER_SCHEDULER_MODE,
+            'LINE_BROADCAST_TRIGGERS': list(self.LINE_BROADCAST_TRIGGERS),
+            'WEBHOOK_DEDUP_STORE': self.WEBHOOK_DEDUP_STORE,
+            'EVENT_SEARCH_STORE': self.EVENT_SEARCH_STORE
         }
         
         if self.DEBUG:
@@ -171,7 +215,13 @@ LINE_USER_ID = config.LINE_USER_ID
 SUPABASE_URL = config.SUPABASE_URL
 SUPABASE_ANON_KEY = config.SUPABASE_ANON_KEY
 SUPABASE_SERVICE_ROLE_KEY = config.SUPABASE_SERVICE_ROLE_KEY
+SUPABASE_POOL_SIZE = config.SUPABASE_POOL_SIZE
+SUPABASE_POOL_KEEPALIVE = config.SUPABASE_POOL_KEEPALIVE
 WEBHOOK_HANDLER_PATH = config.WEBHOOK_HANDLER_PATH
+REMINDER_SCHEDULER_MODE = config.REMINDER_SCHEDULER_MODE
+LINE_BROADCAST_TRIGGERS = config.LINE_BROADCAST_TRIGGERS
+WEBHOOK_DEDUP_STORE = config.WEBHOOK_DEDUP_STORE
+EVENT_SEARCH_STORE = config.EVENT_SEARCH_STORE
 DEBUG = config.DEBUG
 ENVIRONMENT = config.ENVIRONMENT
 LOG_LEVEL = config.LOG_LEVEL
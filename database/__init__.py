@@ -0,0 +1,6 @@
+# Database package initialization
+from .repository import Repository, create_repository
+from .cache import UpcomingEventsCache, EventPage, CursorStore, EventRecordCache, upcoming_events_cache, event_record_cache
+from .search import EventSearchIndex
+
+__all__ = ['Repository', 'create_repository', 'UpcomingEventsCache', 'EventPage', 'CursorStore', 'EventRecordCache', 'upcoming_events_cache', 'event_record_cache', 'EventSearchIndex']
\ No newline at end of file
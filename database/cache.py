@@ -0,0 +1,231 @@
+import bisect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from .repository import Repository, Row
+
+logger = logging.getLogger(__name__)
+
+# 一覧用にメモリに読み込む開始前イベント数の上限（超えた分のページはDBから取得）
+MAX_CACHED_EVENTS = 1000
+# キャッシュの有効期間（秒）。別プロセスでのイベント変更はこの間隔で反映される
+DEFAULT_TTL_SECONDS = 60
+# ページ送りの位置を保持するユーザー数の上限
+MAX_CURSOR_USERS = 10000
+# 外部イベントIDごとにキャッシュするイベント行の上限
+MAX_CACHED_RECORDS = 2048
+# イベント行の有効期間（秒）。同じプロセスのDiscord Botでの変更は即座に破棄される
+RECORD_TTL_SECONDS = 300
+# 存在しないイベントIDの有効期間（秒）。別プロセスで作成されたイベントはこの期間内に参照できる
+NEGATIVE_TTL_SECONDS = 30
+
+# キーセットページネーションの位置（開始日時, イベントの内部ID）
+Cursor = Tuple[datetime, str]
+
+
+def parse_start_date(event: Row) -> datetime:
+    """イベントの開始日時"""
+    return datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
+
+
+def event_key(event: Row) -> Cursor:
+    """一覧の並び順（開始日時, 内部ID）のキー"""
+    return parse_start_date(event), event['id']
+
+
+@dataclass
+class EventPage:
+    """一覧の1ページ分"""
+    events: List[Row]
+    total: int
+    # 次のページの位置（最後のページならNone）
+    next_cursor: Optional[Cursor] = None
+
+
+class UpcomingEventsCache:
+    """開始前の予定済みイベント一覧のリードスルーキャッシュ
+
+    開始日時順の一覧をメモリに保持し、ページはスライスで返す。
+    Discordのイベントリスナーからinvalidateされるほか、TTLで期限切れになる。
+    LINE BotとDiscord Botは別スレッドのイベントループで動くため、読み込みには呼び出し側のリポジトリを使う。
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_events: int = MAX_CACHED_EVENTS):
+        self.ttl_seconds = ttl_seconds
+        self.max_events = max_events
+        # (開始日時順のイベント, 各イベントのキー, 読み込み時の総件数)。別スレッドから参照されるため1つの属性で入れ替える
+        self._snapshot: Optional[Tuple[List[Row], List[Cursor], int]] = None
+        self._loaded_at = 0.0
+        # 読み込み中に無効化された場合に古い一覧を保存しないための世代番号
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """一覧を破棄（次回の参照でDBから読み込む）"""
+        self._version += 1
+        self._snapshot = None
+
+    def clear(self):
+        self.invalidate()
+        self.hits = 0
+        self.misses = 0
+
+    async def _load(self, repository: Repository) -> Tuple[List[Row], List[Cursor], int]:
+        version = self._version
+        events = await repository.list_upcoming_events(limit=self.max_events)
+        # 上限まで読み込んだ場合のみ総件数を数える（以降は開始したイベント分を差し引いて推定する）
+        total = await repository.count_upcoming_events() if len(events) >= self.max_events else len(events)
+        snapshot = (events, [event_key(event) for event in events], total)
+        if version == self._version:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        return snapshot
+
+    async def _current(self, repository: Repository) -> Tuple[List[Row], List[Cursor], int]:
+        """開始前のイベント・キー・総件数（読み込み後に開始したイベントは除外）"""
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self.misses += 1
+            snapshot = await self._load(repository)
+        else:
+            self.hits += 1
+        events, keys, total = snapshot
+        first = bisect.bisect_left(keys, (datetime.now(timezone.utc), ''))
+        return events[first:], keys[first:], total - first
+
+    async def get_events(self, repository: Repository) -> List[Row]:
+        """開始前のイベント一覧（開始日時順）"""
+        events, _, _ = await self._current(repository)
+        return events
+
+    async def get_page(
+        self,
+        repository: Repository,
+        limit: int,
+        offset: int = 0,
+        after: Optional[Cursor] = None
+    ) -> EventPage:
+        """ページ分のイベント（afterを指定した場合はその位置の次から）"""
+        events, keys, total = await self._current(repository)
+        start = bisect.bisect_right(keys, after) if after else offset
+        if total <= len(events) or start + limit <= len(events):
+            page = events[start:start + limit]
+            has_next = start + len(page) < total
+        else:
+            # キャッシュの範囲外はDBからキーセットで取得
+            if after is None and start >= len(keys) > 0:
+                after, offset = keys[-1], start - len(keys)
+            elif after is not None:
+                offset = 0
+            page = await repository.list_upcoming_events(limit=limit, after=after, offset=offset)
+            has_next = len(page) == limit
+        next_cursor = event_key(page[-1]) if page and has_next else None
+        return EventPage(events=page, total=total, next_cursor=next_cursor)
+
+
+class CursorStore:
+    """ユーザーごとの一覧のページ送り位置（LRU）"""
+
+    def __init__(self, max_users: int = MAX_CURSOR_USERS):
+        self.max_users = max_users
+        self._cursors: 'OrderedDict[str, Tuple[Optional[Cursor], int]]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[Optional[Cursor], int]]:
+        """次のページの位置と次のページ番号"""
+        position = self._cursors.get(key)
+        if position is not None:
+            self._cursors.move_to_end(key)
+        return position
+
+    def set(self, key: str, cursor: Optional[Cursor], page: int):
+        self._cursors[key] = (cursor, page)
+        self._cursors.move_to_end(key)
+        while len(self._cursors) > self.max_users:
+            self._cursors.popitem(last=False)
+
+    def clear(self):
+        self._cursors.clear()
+
+
+class EventRecordCache:
+    """外部イベントID（DiscordのイベントID）ごとのイベント行のリードスルーキャッシュ
+
+    存在しないイベントIDも短い期間だけ記録する。LINE BotとDiscord Botのスレッドから参照されるためロックで保護する。
+    """
+
+    def __init__(
+        self,
+        max_records: int = MAX_CACHED_RECORDS,
+        ttl_seconds: float = RECORD_TTL_SECONDS,
+        negative_ttl_seconds: float = NEGATIVE_TTL_SECONDS
+    ):
+        self.max_records = max_records
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # 外部イベントID -> (記録した時刻, イベント行またはNone)
+        self._records: 'OrderedDict[str, Tuple[float, Optional[Row]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # 読み込み中に無効化された場合に古い行を保存しないための世代番号
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def peek(self, event_id: str) -> Tuple[bool, Optional[Row]]:
+        """キャッシュの参照のみ行い、(記録の有無, イベント行またはNone)を返す"""
+        with self._lock:
+            entry = self._records.get(event_id)
+            if entry is not None:
+                ttl = self.ttl_seconds if entry[1] is not None else self.negative_ttl_seconds
+                if time.monotonic() - entry[0] <= ttl:
+                    self._records.move_to_end(event_id)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._records[event_id]
+            self.misses += 1
+            return False, None
+
+    async def get(self, repository: Repository, event_id: str) -> Optional[Row]:
+        """イベント行の取得（存在しない場合はNone）"""
+        hit, event = self.peek(event_id)
+        if hit:
+            return event
+
+        version = self._version
+        event = await repository.get_event(event_id)
+        if version == self._version:
+            self.set(event_id, event)
+        return event
+
+    def set(self, event_id: str, event: Optional[Row]):
+        """イベント行の記録（Noneは存在しないイベントとして記録）"""
+        with self._lock:
+            self._records[event_id] = (time.monotonic(), event)
+            self._records.move_to_end(event_id)
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+
+    def invalidate(self, event_id: str):
+        """イベント行を破棄（Discordでイベントが変更されたときに呼び出す）"""
+        with self._lock:
+            self._version += 1
+            self._records.pop(event_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._records.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# LINE BotとDiscord Botで共有するキャッシュ
+upcoming_events_cache = UpcomingEventsCache()
+event_record_cache = EventRecordCache()
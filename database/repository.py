@@ -0,0 +1,336 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from config.settings import (
+    SUPABASE_URL,
+    SUPABASE_ANON_KEY,
+    SUPABASE_POOL_SIZE,
+    SUPABASE_POOL_KEEPALIVE,
+    CONNECTION_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# 取得した1行分のデータ
+Row = Dict[str, Any]
+
+# 接続プールの既定値（通常はconfig.settingsの値を使う）
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_KEEPALIVE = 10
+DEFAULT_TIMEOUT = 5  # seconds
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """接続数を制限したhttpxのコネクションプールを使うPostgRESTクライアント"""
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        headers: Dict[str, str],
+        timeout: Union[int, float, httpx.Timeout] = DEFAULT_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        # create_sessionは親クラスの__init__から呼ばれるため先に設定する
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=max_keepalive)
+        self.transport = transport
+        super().__init__(base_url, headers=headers, timeout=timeout)
+
+    def create_session(
+        self,
+        base_url: str,
+        headers: Dict[str, str],
+        timeout: Union[int, float, httpx.Timeout]
+    ) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=self.limits,
+            transport=self.transport
+        )
+
+
+class Repository:
+    """events・users・participants・reminders・triggersへの非同期アクセス
+
+    LINE Bot・Discord Bot・リマインダーで共通して使い、同時実行数は接続プールで制限する。
+    """
+
+    def __init__(self, client: AsyncPostgrestClient):
+        self.client = client
+
+    async def close(self):
+        """接続プールを閉じる"""
+        await self.client.aclose()
+
+    async def ping(self):
+        """接続確認"""
+        await self.client.from_('events').select('id').limit(1).execute()
+
+    # イベント
+
+    async def get_event(self, event_id: str) -> Optional[Row]:
+        """外部イベントID（DiscordのイベントID）でイベントを取得"""
+        result = await self.client.from_('events').select('*').eq('event_id', event_id).execute()
+        return result.data[0] if result.data else None
+
+    async def list_events_by_event_ids(self, event_ids: List[str], columns: str = '*') -> List[Row]:
+        """外部イベントIDの一覧に一致するイベントをまとめて取得"""
+        if not event_ids:
+            return []
+        result = await self.client.from_('events').select(columns).in_('event_id', event_ids).execute()
+        return result.data
+
+    async def list_upcoming_events(
+        self,
+        limit: int = 5,
+        after: Optional[Tuple[datetime, str]] = None,
+        offset: int = 0
+    ) -> List[Row]:
+        """開始前の予定済みイベントを（開始日時, 内部ID）順に取得（afterを指定した場合はその位置の次から）"""
+        builder = self.client.from_('events')\
+            .select('*')\
+            .eq('status', 'scheduled')\
+            .gte('start_date', _now())
+        if after:
+            # キーセットページネーション（読み飛ばす行をDBに数えさせない）
+            start_date, event_uuid = after[0].isoformat(), after[1]
+            builder.params = builder.params.add(
+                'or', f'(start_date.gt."{start_date}",and(start_date.eq."{start_date}",id.gt."{event_uuid}"))'
+            )
+        # 同じ開始日時のイベントも一意に並ぶよう内部IDを第2キーにする（orderは1つのパラメータにまとめる）
+        builder.params = builder.params.add('order', 'start_date.asc,id.asc')
+        # postgrest-pyのrangeは終端を含まない
+        result = await builder.range(offset, offset + limit).execute()
+        return result.data
+
+    async def count_upcoming_events(self) -> int:
+        """開始前の予定済みイベントの件数"""
+        result = await self.client.from_('events')\
+            .select('id', count='exact')\
+            .eq('status', 'scheduled')\
+            .gte('start_date', _now())\
+            .limit(1)\
+            .execute()
+        return result.count or 0
+
+    async def search_events(self, query: str, limit: int = 10) -> List[Row]:
+        """名前・説明・場所の部分一致でイベントを検索（n-gramインデックスを使うsearch_events関数で順位付けして件数を制限）"""
+        result = await self.client.rpc('search_events', {'p_query': query, 'p_limit': limit}).execute()
+        return list(result.data or [])
+
+    async def upsert_events(self, events: List[Row]) -> List[Row]:
+        """外部イベントIDをキーにイベントをまとめて作成・更新"""
+        result = await self.client.from_('events').upsert(events, on_conflict='event_id').execute()
+        return result.data
+
+    # 参加者
+
+    async def join_event(
+        self,
+        event_id: str,
+        line_user_id: str,
+        display_name: Optional[str] = None,
+        user_uuid: Optional[str] = None
+    ) -> Row:
+        """ユーザー作成・各種チェック・参加登録を1回のRPCで実行し、ステータスとイベントを返す（user_uuidを渡すとユーザーの検索を省略）"""
+        result = await self.client.rpc('join_event', {
+            'p_event_id': event_id,
+            'p_line_user_id': line_user_id,
+            'p_display_name': display_name,
+            'p_user_id': user_uuid
+        }).execute()
+        return result.data
+
+    async def cancel_participation(self, event_id: str, line_user_id: str, user_uuid: Optional[str] = None) -> Row:
+        """参加登録の削除・参加者数の集計・ステータス更新を1回のRPCで実行し、ステータスと参加者数を返す（user_uuidを渡すとユーザーの検索を省略）"""
+        result = await self.client.rpc('cancel_participation', {
+            'p_event_id': event_id,
+            'p_line_user_id': line_user_id,
+            'p_user_id': user_uuid
+        }).execute()
+        return result.data
+
+    async def list_participant_line_ids(self, event_uuid: str) -> List[str]:
+        """イベント参加者（キャンセル待ちを除く）のLINEユーザーID一覧"""
+        result = await self.client.from_('participants')\
+            .select('users(line_user_id)')\
+            .eq('event_id', event_uuid)\
+            .eq('status', 'registered')\
+            .execute()
+        return [
+            participant['users']['line_user_id']
+            for participant in result.data
+            if participant['users'] and participant['users']['line_user_id']
+        ]
+
+    async def count_participants(self, event_uuid: str) -> int:
+        """イベントの参加者数（トリガーで更新されるevent_participant_countsを読む）"""
+        result = await self.client.from_('event_participant_counts')\
+            .select('participant_count')\
+            .eq('event_id', event_uuid)\
+            .execute()
+        return result.data[0]['participant_count'] if result.data else 0
+
+    async def list_participant_names(self, event_uuid: str, limit: int = 20, offset: int = 0) -> List[str]:
+        """イベント参加者（キャンセル待ちを除く）の名前一覧（登録順に1ページ分）"""
+        builder = self.client.from_('participants')\
+            .select('users(name)')\
+            .eq('event_id', event_uuid)\
+            .eq('status', 'registered')
+        builder.params = builder.params.add('order', 'registered_at.asc,id.asc')
+        result = await builder.range(offset, offset + limit).execute()
+        return [p['users']['name'] for p in result.data if p['users']]
+
+    # リマインダー
+
+    async def claim_due_reminders(
+        self,
+        worker_id: str,
+        batch_size: int,
+        lease_seconds: int,
+        lookahead_seconds: int
+    ) -> List[Row]:
+        """期限の来たリマインダーをワーカーにリースして取得"""
+        result = await self.client.rpc('claim_due_reminders', {
+            'p_worker_id': worker_id,
+            'p_batch_size': batch_size,
+            'p_lease_seconds': lease_seconds,
+            'p_lookahead_seconds': lookahead_seconds
+        }).execute()
+        return list(result.data or [])
+
+    async def mark_reminders_sent(self, reminder_ids: Iterable[str], worker_id: str):
+        """ワーカーがリース中のリマインダーを送信済みとしてまとめてマーク"""
+        await self.client.from_('reminders')\
+            .update({'sent_at': _now(), 'lease_expires_at': None})\
+            .in_('id', list(reminder_ids))\
+            .eq('claimed_by', worker_id)\
+            .execute()
+
+    async def mark_reminders_failed(self, reminder_ids: Iterable[str], worker_id: str):
+        """再試行の上限に達したリマインダーを失敗としてマーク（以降は割り当てない）"""
+        await self.client.from_('reminders')\
+            .update({'failed_at': _now(), 'lease_expires_at': None})\
+            .in_('id', list(reminder_ids))\
+            .eq('claimed_by', worker_id)\
+            .execute()
+
+    async def release_reminders(self, reminder_ids: Iterable[str], worker_id: str):
+        """ワーカーがリース中のリマインダーのリースを解放"""
+        await self.client.from_('reminders')\
+            .update({'claimed_by': None, 'lease_expires_at': None})\
+            .in_('id', list(reminder_ids))\
+            .eq('claimed_by', worker_id)\
+            .execute()
+
+    async def list_pending_reminders(self, until: datetime) -> List[Row]:
+        """指定日時までに予定された未送信リマインダー（予定済みイベントのみ）"""
+        result = await self.client.from_('reminders')\
+            .select('id, scheduled_at, events!inner(event_id, status)')\
+            .is_('sent_at', 'null')\
+            .is_('failed_at', 'null')\
+            .eq('events.status', 'scheduled')\
+            .lte('scheduled_at', until.isoformat())\
+            .execute()
+        return result.data
+
+    async def list_event_reminders(self, event_id: str) -> List[Row]:
+        """外部イベントIDに紐づく未送信リマインダー"""
+        result = await self.client.from_('reminders')\
+            .select('id, scheduled_at, events!inner(event_id, status)')\
+            .is_('sent_at', 'null')\
+            .is_('failed_at', 'null')\
+            .eq('events.event_id', event_id)\
+            .execute()
+        return result.data
+
+    # トリガー
+
+    async def create_triggers(self, triggers: List[Row]) -> List[Row]:
+        """LINE通知用トリガーをまとめて作成"""
+        result = await self.client.from_('triggers').insert(triggers).execute()
+        return result.data
+
+    async def acquire_trigger_outbox(self, consumer: str, owner: str, lease_seconds: int) -> Optional[Row]:
+        """トリガーのアウトボックスのリースを取得し、読み進める位置を返す（他のワーカーがリース中ならNone）"""
+        result = await self.client.rpc('acquire_trigger_outbox', {
+            'p_consumer': consumer,
+            'p_owner': owner,
+            'p_lease_seconds': lease_seconds
+        }).execute()
+        return result.data[0] if result.data else None
+
+    async def list_triggers_after(
+        self,
+        created_at: str,
+        trigger_id: str,
+        limit: int,
+        until: datetime
+    ) -> List[Row]:
+        """(作成日時, ID)が指定位置より後で、until以前に作成されたトリガーを作成順に取得"""
+        builder = self.client.from_('triggers')\
+            .select('id,event_id,trigger_condition,message_content,created_at')\
+            .lte('created_at', until.isoformat())
+        builder.params = builder.params.add(
+            'or', f'(created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{trigger_id}"))'
+        )
+        builder.params = builder.params.add('order', 'created_at.asc,id.asc')
+        result = await builder.limit(limit).execute()
+        return result.data
+
+    async def advance_trigger_outbox(self, consumer: str, owner: str, created_at: str, trigger_id: str) -> bool:
+        """アウトボックスを配信済みのトリガーまで読み進める（リースを失っていればFalse）"""
+        result = await self.client.rpc('advance_trigger_outbox', {
+            'p_consumer': consumer,
+            'p_owner': owner,
+            'p_created_at': created_at,
+            'p_trigger_id': trigger_id
+        }).execute()
+        return bool(result.data)
+
+    # Webhookイベント
+
+    async def claim_webhook_event(self, webhook_event_id: str, ttl_seconds: int) -> bool:
+        """Webhookイベントを処理済みとして記録（既に記録済みならFalse）"""
+        result = await self.client.rpc('claim_webhook_event', {
+            'p_webhook_event_id': webhook_event_id,
+            'p_ttl_seconds': ttl_seconds
+        }).execute()
+        return bool(result.data)
+
+    async def purge_webhook_events(self, ttl_seconds: int) -> int:
+        """保持期間を過ぎたWebhookイベントの記録を削除"""
+        result = await self.client.rpc('purge_webhook_events', {'p_ttl_seconds': ttl_seconds}).execute()
+        return result.data or 0
+
+
+def _now() -> str:
+    """現在時刻（UTC）のISO形式"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def create_repository(
+    url: Optional[str] = None,
+    key: Optional[str] = None,
+    pool_size: Optional[int] = None,
+    max_keepalive: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> Repository:
+    """設定値からリポジトリを作成"""
+    key = key or str(SUPABASE_ANON_KEY)
+    headers = dict(DEFAULT_POSTGREST_CLIENT_HEADERS, apikey=key, Authorization=f'Bearer {key}')
+    client = PooledPostgrestClient(
+        f"{url or SUPABASE_URL}/rest/v1",
+        headers=headers,
+        timeout=timeout if timeout is not None else CONNECTION_TIMEOUT,
+        pool_size=pool_size or SUPABASE_POOL_SIZE,
+        max_keepalive=max_keepalive or SUPABASE_POOL_KEEPALIVE
+    )
+    return Repository(client)
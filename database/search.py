@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set
+from config.settings import EVENT_SEARCH_STORE
+from .repository import Repository, Row
+from .cache import parse_start_date, event_key
+
+logger = logging.getLogger(__name__)
+
+# 検索結果の既定件数と上限（search_events関数と同じ）
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+# 一致した項目ごとの重み（search_events関数と同じ）
+SEARCH_WEIGHTS = (('name', 3), ('location', 2), ('description', 1))
+# インデックス構築時に1回で読み込むイベント数
+INDEX_LOAD_BATCH_SIZE = 500
+# イベントリスナーで更新されないプロセス（LINE Bot単体など）でインデックスを読み直す間隔（秒）
+DEFAULT_INDEX_TTL_SECONDS = 60
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """検索用の正規化（全角・半角の統一と小文字化）"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def split_terms(query: str) -> List[str]:
+    """空白区切りの検索語句"""
+    return normalize_text(query).split()
+
+
+def ngrams(text: str) -> Set[str]:
+    """文字の1-gramと2-gram（日本語は分かち書きせずに部分一致できる）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def score_event(event: Row, terms: List[str]) -> int:
+    """一致した項目の重みの合計"""
+    fields = [(normalize_text(event.get(field)), weight) for field, weight in SEARCH_WEIGHTS]
+    return sum(weight for term in terms for text, weight in fields if term in text)
+
+
+class EventSearchIndex:
+    """イベントの名前・説明・場所の2-gram転置インデックス
+
+    search_events関数（DB側のn-gramインデックス）と同じ条件・順位付けでメモリ上を検索する。
+    イベントは外部イベントID（DiscordのイベントID）で管理する。
+    Discord Botのイベントリスナー（別スレッド）から更新されるため、読み書きはロックで保護する。
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_INDEX_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # イベントリスナーで随時更新されている場合はTrue（TTLでの読み直しが不要）
+        self.live = False
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()
+        self._events: Dict[str, Row] = {}
+        self._texts: Dict[str, str] = {}
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    @property
+    def ready(self) -> bool:
+        """検索に使える状態か（構築済みで、随時更新されているかTTL内）"""
+        if self._loaded_at is None:
+            return False
+        return self.live or time.monotonic() - self._loaded_at <= self.ttl_seconds
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._texts.clear()
+            self._postings.clear()
+            self._loaded_at = None
+            self.live = False
+
+    def build(self, events: Iterable[Row]):
+        """インデックスの作り直し"""
+        with self._lock:
+            self._events.clear()
+            self._texts.clear()
+            self._postings.clear()
+            for event in events:
+                self.add(event)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Built event search index with {len(self._events)} events")
+
+    async def load(self, repository: Repository, batch_size: int = INDEX_LOAD_BATCH_SIZE):
+        """開始前の予定済みイベントをすべて読み込んでインデックスを作り直す"""
+        events: List[Row] = []
+        after = None
+        while True:
+            batch = await repository.list_upcoming_events(limit=batch_size, after=after)
+            events.extend(batch)
+            if len(batch) < batch_size:
+                break
+            after = event_key(batch[-1])
+        self.build(events)
+
+    async def ensure_loaded(self, repository: Repository):
+        """未構築またはTTL切れの場合のみ読み込む"""
+        if not self.ready:
+            await self.load(repository)
+
+    def update(self, event_id: str, event: Optional[Row]):
+        """イベント変更の反映（予定済みなら追加・置き換え、それ以外は削除）"""
+        if event and event.get('status') == 'scheduled':
+            self.add(event)
+        else:
+            self.remove(event_id)
+
+    def add(self, event: Row):
+        """イベントの追加（登録済みなら置き換え）"""
+        with self._lock:
+            self._add(event)
+
+    def _add(self, event: Row):
+        event_id = event['event_id']
+        self._remove(event_id)
+        text = normalize_text(' '.join(event.get(field) or '' for field, _ in SEARCH_WEIGHTS))
+        self._events[event_id] = event
+        self._texts[event_id] = text
+        for gram in ngrams(text):
+            self._postings[gram].add(event_id)
+
+    def remove(self, event_id: str):
+        """イベントの削除"""
+        with self._lock:
+            self._remove(event_id)
+
+    def _remove(self, event_id: str):
+        text = self._texts.pop(event_id, None)
+        if text is None:
+            return
+        del self._events[event_id]
+        for gram in ngrams(text):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(event_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def _candidates(self, term: str) -> Set[str]:
+        """語句の2-gramをすべて含むイベント（部分一致の候補）"""
+        grams = ngrams(term) if len(term) < 2 else {term[i:i + 2] for i in range(len(term) - 1)}
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0]) if postings else set()
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return {event_id for event_id in candidates if term in self._texts[event_id]}
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT, now: Optional[datetime] = None) -> List[Row]:
+        """開始前の予定済みイベントを検索し、順位の高い順に返す"""
+        terms = split_terms(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            # 長い（候補の少ない）語句から絞り込む
+            matched: Optional[Set[str]] = None
+            for term in sorted(terms, key=len, reverse=True):
+                candidates = self._candidates(term)
+                matched = candidates if matched is None else matched & candidates
+                if not matched:
+                    return []
+            events = [self._events[event_id] for event_id in matched]
+
+        now = now or datetime.now(timezone.utc)
+        events = [
+            event for event in events
+            if event.get('status') == 'scheduled' and parse_start_date(event) >= now
+        ]
+        events.sort(key=lambda event: (-score_event(event, terms), parse_start_date(event), event.get('id') or ''))
+        return events[:max(1, min(limit, MAX_SEARCH_LIMIT))]
+
+
+async def search_upcoming_events(repository: Repository, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Row]:
+    """開始前のイベントの検索（EVENT_SEARCH_STORE=memoryならメモリ上のインデックス、使えなければDB）"""
+    if EVENT_SEARCH_STORE == 'memory':
+        try:
+            await event_search_index.ensure_loaded(repository)
+            return event_search_index.search(query, limit)
+        except Exception as e:
+            logger.warning(f"Event search index unavailable, searching database: {e}")
+    return await repository.search_events(query, limit=limit)
+
+
+# LINE BotとDiscord Botで共有するインデックス
+event_search_index = EventSearchIndex()
@@ -3,15 +3,17 @@ from discord.ext import commands, tasks
 import sys
 import os
 import asyncio
-from typing import Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
 from textwrap import shorten
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.settings import DISCORD_TOKEN, SUPABASE_URL, SUPABASE_ANON_KEY
-from supabase import create_client, Client
-from postgrest import APIError
+from config.settings import DISCORD_TOKEN, SUPABASE_URL, EVENT_SEARCH_STORE
+from database.repository import create_repository
+from database.cache import upcoming_events_cache, event_record_cache, CursorStore
+from database.search import DEFAULT_SEARCH_LIMIT, event_search_index, search_upcoming_events
+from discord_bot.sync import EventSyncBuffer, scheduled_event_data, scheduled_event_status
+from discord_bot.reconcile import reconcile_scheduled_events
 
 # ロギングの設定
 logging.basicConfig(
@@ -30,20 +32,65 @@ intents.guild_scheduled_events = True
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # seconds
 
+# !eventinfoで表示する参加者名の上限
+PARTICIPANT_PREVIEW_LIMIT = 20
+# !participantsの1ページの参加者数
+PARTICIPANTS_PER_PAGE = 20
+# 埋め込みのフィールドの文字数の上限（Discordの制限）
+EMBED_FIELD_MAX_LENGTH = 1024
+
+def format_participant_names(names, total: int, max_length: int = EMBED_FIELD_MAX_LENGTH) -> str:
+    """参加者名を上限の文字数に収まるように改行でつなぐ（表示しきれない人数は末尾にまとめる）"""
+    # 末尾の「…他N人」の分を空けておく
+    budget = max_length - len(f"…他{total}人") - 1
+    lines = []
+    for name in names:
+        if sum(len(line) + 1 for line in lines) + len(name) > budget:
+            break
+        lines.append(name)
+    if total > len(lines):
+        lines.append(f"…他{total - len(lines)}人")
+    return '\n'.join(lines)
+
 class EventBot(commands.Bot):
     def __init__(self):
         super().__init__(command_prefix='!', intents=intents)
-        self.supabase = None
+        self.repository = None
         self.reconnect_task = None
+        self.event_change_listeners = []
+        # イベントが変更されたら一覧キャッシュを破棄する
+        self.add_event_change_listener(lambda event_id: upcoming_events_cache.invalidate())
+        self.add_event_change_listener(event_record_cache.invalidate)
+        # 予定イベントの変更はまとめてDBに書き込む
+        self.event_sync = EventSyncBuffer(lambda: self.repository, self.on_events_synced)
+
+    def add_event_change_listener(self, listener):
+        """イベント変更時に呼び出すコールバックの登録（引数はDiscordのイベントID）"""
+        self.event_change_listeners.append(listener)
+
+    def on_events_synced(self, rows):
+        """DBに書き込んだイベントの反映（検索インデックスの更新と変更通知）"""
+        for row in rows:
+            event_search_index.update(row['event_id'], row)
+            self.notify_event_changed(row['event_id'])
+
+    def notify_event_changed(self, event_id: str):
+        """登録されたコールバックへのイベント変更通知"""
+        for listener in self.event_change_listeners:
+            try:
+                listener(event_id)
+            except Exception as e:
+                logger.error(f"Error notifying event change for {event_id}: {e}")
 
     async def setup_supabase(self):
         """Supabaseクライアントの初期化（再試行あり）"""
         for attempt in range(MAX_RETRIES):
             try:
                 logger.info(f"Connecting to Supabase at {SUPABASE_URL} (attempt {attempt + 1})")
-                self.supabase = create_client(str(SUPABASE_URL), str(SUPABASE_ANON_KEY))
+                if self.repository is None:
+                    self.repository = create_repository()
                 # 接続テスト
-                await asyncio.to_thread(lambda: self.supabase.table('events').select('count', count='exact').execute())
+                await self.repository.ping()
                 logger.info("Supabase connection established")
                 return True
             except Exception as e:
@@ -59,24 +106,57 @@ class EventBot(commands.Bot):
         logger.info("Setting up bot...")
         if await self.setup_supabase():
             await self.add_cog(EventCommands(self))
+            await self.reconcile_events()
+            if EVENT_SEARCH_STORE == 'memory':
+                await self.setup_search_index()
             self.check_connection.start()
         else:
             logger.error("Failed to initialize Supabase connection")
             await self.close()
 
+    async def reconcile_events(self):
+        """停止中に変更された予定イベントの同期（ゲートウェイ接続前に実行し、リスナーの変更と競合させない）"""
+        try:
+            result = await reconcile_scheduled_events(self, self.repository)
+            self.on_events_synced(result.rows)
+        except Exception as e:
+            logger.error(f"Failed to reconcile scheduled events: {e}")
+
+    async def setup_search_index(self):
+        """検索インデックスの構築（以降はイベントリスナーで随時更新する）"""
+        try:
+            await event_search_index.load(self.repository)
+            event_search_index.live = True
+        except Exception as e:
+            logger.error(f"Failed to build event search index: {e}")
+
     @tasks.loop(minutes=5)
     async def check_connection(self):
         """定期的な接続チェックとリトライ"""
         try:
-            await asyncio.to_thread(lambda: self.supabase.table('events').select('count', count='exact').execute())
+            await self.repository.ping()
         except Exception as e:
             logger.error(f"Connection check failed: {e}")
             await self.setup_supabase()
 
+    async def close(self):
+        """Bot終了時に未書き込みの変更を書き込み、接続プールを閉じる"""
+        try:
+            await self.event_sync.close()
+        except Exception as e:
+            logger.error(f"Error flushing scheduled event changes: {e}")
+        await super().close()
+        if self.repository:
+            await self.repository.close()
+            self.repository = None
+
 class EventCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.events_per_page = 5
+        self.participants_per_page = PARTICIPANTS_PER_PAGE
+        # チャンネル・ユーザーごとのイベント一覧の次のページの位置
+        self.event_list_cursors = CursorStore()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -85,118 +165,70 @@ class EventCommands(commands.Cog):
 
     @commands.Cog.listener()
     async def on_scheduled_event_create(self, event):
-        """イベント作成時の処理"""
+        """イベント作成時の処理（DBへの書き込みはまとめて行う）"""
         try:
-            async with asyncio.Lock():
-                # イベントデータの作成
-                event_data = {
-                    'event_id': str(event.id),
-                    'name': event.name,
-                    'description': event.description or "説明なし",
-                    'start_date': event.start_time.isoformat(),
-                    'end_date': event.end_time.isoformat() if event.end_time else None,
-                    'location': event.location or "場所未定",
-                    'status': 'scheduled',
-                    'created_by': str(event.creator.id)
-                }
-                
-                # Supabaseにイベントを保存
-                result = await asyncio.to_thread(
-                    lambda: self.bot.supabase.table('events').insert(event_data).execute()
-                )
-                logger.info(f"Event created: {event.name}")
-
-                # トリガーの作成（LINE通知用）
-                trigger_data = {
-                    'event_id': result.data[0]['id'],
-                    'trigger_condition': 'event_created',
-                    'message_content': f'新しいイベントが作成されました！\n\n{event.name}\n開始: {event.start_time}\n場所: {event.location or "場所未定"}'
-                }
-                await asyncio.to_thread(
-                    lambda: self.bot.supabase.table('triggers').insert(trigger_data).execute()
-                )
-                
+            self.bot.event_sync.add(
+                scheduled_event_data(event, 'scheduled'),
+                ('event_created', f'新しいイベントが作成されました！\n\n{event.name}\n開始: {event.start_time}\n場所: {event.location or "場所未定"}')
+            )
+            logger.info(f"Event created: {event.name}")
+
         except Exception as e:
             logger.error(f"Error handling event creation: {e}")
 
     @commands.Cog.listener()
     async def on_scheduled_event_update(self, before, after):
-        """イベント更新時の処理"""
+        """イベント更新時の処理（DBへの書き込みはまとめて行う）"""
         try:
-            async with asyncio.Lock():
-                event_data = {
-                    'name': after.name,
-                    'description': after.description or "説明なし",
-                    'start_date': after.start_time.isoformat(),
-                    'end_date': after.end_time.isoformat() if after.end_time else None,
-                    'location': after.location or "場所未定",
-                    'status': 'scheduled' if after.status == discord.EventStatus.scheduled else 'cancelled'
-                }
-                
-                await asyncio.to_thread(
-                    lambda: self.bot.supabase.table('events')
-                        .update(event_data)
-                        .eq('event_id', str(after.id))
-                        .execute()
-                )
-                logger.info(f"Event updated: {after.name}")
-
-                # トリガーの作成（LINE通知用）
-                trigger_data = {
-                    'event_id': str(after.id),
-                    'trigger_condition': 'event_updated',
-                    'message_content': f'イベントが更新されました！\n\n{after.name}\n開始: {after.start_time}\n場所: {after.location or "場所未定"}'
-                }
-                await asyncio.to_thread(
-                    lambda: self.bot.supabase.table('triggers').insert(trigger_data).execute()
-                )
+            self.bot.event_sync.add(
+                scheduled_event_data(after, scheduled_event_status(after)),
+                ('event_updated', f'イベントが更新されました！\n\n{after.name}\n開始: {after.start_time}\n場所: {after.location or "場所未定"}')
+            )
+            logger.info(f"Event updated: {after.name}")
 
         except Exception as e:
             logger.error(f"Error handling event update: {e}")
 
     @commands.Cog.listener()
     async def on_scheduled_event_delete(self, event):
-        """イベント削除時の処理"""
+        """イベント削除時の処理（DBへの書き込みはまとめて行う）"""
         try:
-            async with asyncio.Lock():
-                await asyncio.to_thread(
-                    lambda: self.bot.supabase.table('events')
-                        .update({'status': 'cancelled'})
-                        .eq('event_id', str(event.id))
-                        .execute()
-                )
-                logger.info(f"Event cancelled: {event.name}")
-
-                # トリガーの作成（LINE通知用）
-                trigger_data = {
-                    'event_id': str(event.id),
-                    'trigger_condition': 'event_cancelled',
-                    'message_content': f'イベントがキャンセルされました。\n\n{event.name}'
-                }
-                await asyncio.to_thread(
-                    lambda: self.bot.supabase.table('triggers').insert(trigger_data).execute()
-                )
+            self.bot.event_sync.add(
+                scheduled_event_data(event, 'cancelled'),
+                ('event_cancelled', f'イベントがキャンセルされました。\n\n{event.name}')
+            )
+            logger.info(f"Event cancelled: {event.name}")
 
         except Exception as e:
             logger.error(f"Error handling event deletion: {e}")
 
     @commands.command(name='events')
-    async def list_events(self, ctx, page: int = 1):
-        """登録されているイベントの一覧表示（ページネーション対応）"""
+    async def list_events(self, ctx, page: str = '1'):
+        """登録されているイベントの一覧表示（!events next で前回の続きをキーセットで取得）"""
         try:
-            # 現在時刻以降のイベントのみを取得
-            current_time = datetime.utcnow().isoformat() + 'Z'
-            result = await asyncio.to_thread(
-                lambda: self.bot.supabase.table('events')
-                    .select('*')
-                    .eq('status', 'scheduled')
-                    .gte('start_date', current_time)
-                    .order('start_date', desc=False)
-                    .range((page-1)*self.events_per_page, page*self.events_per_page)
-                    .execute()
+            cursor_key = f'{ctx.channel.id}:{ctx.author.id}'
+            after = None
+            if str(page).lower() == 'next':
+                position = self.event_list_cursors.get(cursor_key)
+                if not position or position[0] is None:
+                    await ctx.send("これ以上のイベントはありません。")
+                    return
+                after, page = position
+            elif not str(page).isdigit() or int(page) < 1:
+                await ctx.send("ページ番号は1以上の数値か next を指定してください。")
+                return
+            page = int(page)
+
+            # 現在時刻以降のイベントのみを取得（通常はキャッシュから返す）
+            result = await upcoming_events_cache.get_page(
+                self.bot.repository,
+                self.events_per_page,
+                offset=(page-1)*self.events_per_page,
+                after=after
             )
-            
-            if not result.data:
+            events = result.events
+
+            if not events:
                 await ctx.send("現在予定されているイベントはありません。")
                 return
 
@@ -205,7 +237,7 @@ class EventCommands(commands.Cog):
                 color=discord.Color.blue()
             )
 
-            for event in result.data:
+            for event in events:
                 start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
                 description = shorten(event['description'], width=100, placeholder="...")
                 embed.add_field(
@@ -216,18 +248,16 @@ class EventCommands(commands.Cog):
                     inline=False
                 )
 
-            # ページネーション情報の追加
-            total_count = await asyncio.to_thread(
-                lambda: self.bot.supabase.table('events')
-                    .select('count', count='exact')
-                    .eq('status', 'scheduled')
-                    .gte('start_date', current_time)
-                    .execute()
-            )
-            total_pages = -(-total_count.count // self.events_per_page)  # 切り上げ除算
+            # ページネーション情報の追加（総件数はキャッシュの推定値）
+            total_pages = max(-(-result.total // self.events_per_page), page)  # 切り上げ除算
 
             if total_pages > 1:
-                embed.set_footer(text=f"ページ {page}/{total_pages} (!events <ページ番号> でページを切り替え)")
+                footer = f"ページ {page}/{total_pages} (!events <ページ番号> でページを切り替え"
+                if result.next_cursor:
+                    footer += "、!events next で次のページ"
+                embed.set_footer(text=footer + ")")
+
+            self.event_list_cursors.set(cursor_key, result.next_cursor, page + 1)
 
             await ctx.send(embed=embed)
 
@@ -239,18 +269,13 @@ class EventCommands(commands.Cog):
     async def event_info(self, ctx, event_id: str):
         """特定のイベントの詳細情報表示"""
         try:
-            result = await asyncio.to_thread(
-                lambda: self.bot.supabase.table('events')
-                    .select('*')
-                    .eq('event_id', event_id)
-                    .execute()
-            )
-            
-            if not result.data:
+            # 同じイベントの参照は通常キャッシュから返す（存在しないIDも短時間記録する）
+            event = await event_record_cache.get(self.bot.repository, event_id)
+
+            if not event:
                 await ctx.send("指定されたイベントは見つかりませんでした。")
                 return
 
-            event = result.data[0]
             embed = discord.Embed(
                 title=event['name'],
                 description=event['description'],
@@ -267,22 +292,19 @@ class EventCommands(commands.Cog):
             embed.add_field(name="場所", value=event['location'], inline=True)
             embed.add_field(name="ステータス", value=event['status'], inline=True)
 
-            # 参加者情報の取得
-            participants = await asyncio.to_thread(
-                lambda: self.bot.supabase.table('participants')
-                    .select('users(name)')
-                    .eq('event_id', event['id'])
-                    .execute()
+            # 参加者数は件数のみ取得し、名前は先頭の一部のみ取得する
+            participant_count, participant_names = await asyncio.gather(
+                self.bot.repository.count_participants(event['id']),
+                self.bot.repository.list_participant_names(event['id'], limit=PARTICIPANT_PREVIEW_LIMIT)
             )
 
-            participant_count = len(participants.data)
-            participant_names = [p['users']['name'] for p in participants.data]
-            
             embed.add_field(
                 name=f"参加者 ({participant_count}人)",
-                value='\n'.join(participant_names) if participant_names else "まだ参加者はいません",
+                value=format_participant_names(participant_names, participant_count) if participant_count else "まだ参加者はいません",
                 inline=False
             )
+            if participant_count > len(participant_names):
+                embed.set_footer(text=f"!participants {event_id} で参加者の一覧を表示")
 
             await ctx.send(embed=embed)
 
@@ -290,23 +312,54 @@ class EventCommands(commands.Cog):
             logger.error(f"Error getting event info: {e}")
             await ctx.send("イベント情報の取得中にエラーが発生しました。")
 
+    @commands.command(name='participants')
+    async def list_participants(self, ctx, event_id: str, page: str = '1'):
+        """イベント参加者の一覧表示（登録順にページ単位で取得）"""
+        try:
+            if not str(page).isdigit() or int(page) < 1:
+                await ctx.send("ページ番号は1以上の数値を指定してください。")
+                return
+            page = int(page)
+
+            event = await event_record_cache.get(self.bot.repository, event_id)
+            if not event:
+                await ctx.send("指定されたイベントは見つかりませんでした。")
+                return
+
+            offset = (page-1)*self.participants_per_page
+            participant_count, participant_names = await asyncio.gather(
+                self.bot.repository.count_participants(event['id']),
+                self.bot.repository.list_participant_names(event['id'], limit=self.participants_per_page, offset=offset)
+            )
+
+            if not participant_names:
+                await ctx.send("このページに参加者はいません。" if participant_count else "まだ参加者はいません。")
+                return
+
+            embed = discord.Embed(
+                title=f"{event['name']} の参加者 ({participant_count}人)",
+                description='\n'.join(f"{offset + i + 1}. {name}" for i, name in enumerate(participant_names)),
+                color=discord.Color.green()
+            )
+
+            total_pages = -(-participant_count // self.participants_per_page)  # 切り上げ除算
+            if total_pages > 1:
+                embed.set_footer(text=f"ページ {page}/{total_pages} (!participants {event_id} <ページ番号> でページを切り替え)")
+
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            logger.error(f"Error listing participants: {e}")
+            await ctx.send("参加者の取得中にエラーが発生しました。")
+
     @commands.command(name='search')
     async def search_events(self, ctx, *, query: str):
         """イベントの検索"""
         try:
-            # 現在時刻以降のイベントから検索
-            current_time = datetime.utcnow().isoformat() + 'Z'
-            result = await asyncio.to_thread(
-                lambda: self.bot.supabase.table('events')
-                    .select('*')
-                    .eq('status', 'scheduled')
-                    .gte('start_date', current_time)
-                    .or_(f'name.ilike.%{query}%,description.ilike.%{query}%,location.ilike.%{query}%')
-                    .order('start_date', desc=False)
-                    .execute()
-            )
+            # 現在時刻以降のイベントから一致度の高い順に検索（通常はメモリ上のインデックスから返す）
+            events = await search_upcoming_events(self.bot.repository, query, limit=DEFAULT_SEARCH_LIMIT)
 
-            if not result.data:
+            if not events:
                 await ctx.send(f"「{query}」に一致するイベントは見つかりませんでした。")
                 return
 
@@ -315,7 +368,7 @@ class EventCommands(commands.Cog):
                 color=discord.Color.blue()
             )
 
-            for event in result.data:
+            for event in events:
                 start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
                 description = shorten(event['description'], width=100, placeholder="...")
                 embed.add_field(
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Tuple
+import discord
+from database.repository import Repository, Row
+from database.cache import event_key
+from discord_bot.sync import scheduled_event_data, scheduled_event_status
+
+logger = logging.getLogger(__name__)
+
+# 同時に予定イベントを取得するギルド数
+GUILD_FETCH_CONCURRENCY = 10
+# 既存のイベントを1回の問い合わせで読み込むevent_idの数（URLの長さの制限）
+LOOKUP_CHUNK_SIZE = 200
+# 1回のupsertで書き込むイベント数
+UPSERT_CHUNK_SIZE = 500
+# DBの予定済みイベントを読み込む際の1回の件数
+SCHEDULED_PAGE_SIZE = 1000
+# 差分を比較する項目
+SYNC_FIELDS = ('name', 'description', 'start_date', 'end_date', 'location', 'status', 'created_by')
+# 既存のイベントの読み込みで取得する列
+LOOKUP_COLUMNS = ','.join(('id', 'event_id') + SYNC_FIELDS)
+
+
+@dataclass
+class ReconcileResult:
+    """起動時の同期結果"""
+    guilds: int = 0
+    failed_guilds: int = 0
+    discord_events: int = 0
+    created: int = 0
+    updated: int = 0
+    cancelled: int = 0
+    unchanged: int = 0
+    elapsed: float = 0.0
+    rows: List[Row] = field(default_factory=list)
+
+
+def _normalize(name: str, value):
+    """比較用の値（日時は表記の違いを無視し、DB側で変わるpendingは予定済みと同じとみなす）"""
+    if value and name in ('start_date', 'end_date'):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if name == 'status' and value == 'pending':
+        return 'scheduled'
+    return value
+
+
+def is_changed(existing: Row, data: Row) -> bool:
+    """DBの行とDiscordの予定イベントの差分の有無"""
+    return any(_normalize(name, existing.get(name)) != _normalize(name, data.get(name)) for name in SYNC_FIELDS)
+
+
+def keep_database_status(existing: Row, data: Row) -> Row:
+    """参加者0人でpendingになったイベントは、Discordでキャンセルされない限りpendingのまま更新する"""
+    if existing.get('status') == 'pending' and data.get('status') == 'scheduled':
+        return dict(data, status='pending')
+    return data
+
+
+async def fetch_guild_events(bot: discord.Client) -> Tuple[Dict[str, Row], int, int]:
+    """全ギルドの予定イベント（event_idごとの行データ）と、ギルド数・取得に失敗したギルド数"""
+    guilds = [guild async for guild in bot.fetch_guilds(limit=None)]
+    semaphore = asyncio.Semaphore(GUILD_FETCH_CONCURRENCY)
+
+    async def fetch(guild):
+        async with semaphore:
+            return await guild.fetch_scheduled_events()
+
+    results = await asyncio.gather(*(fetch(guild) for guild in guilds), return_exceptions=True)
+    events: Dict[str, Row] = {}
+    failed = 0
+    for guild, result in zip(guilds, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error(f"Failed to fetch scheduled events for guild {guild.id}: {result}")
+            continue
+        for event in result:
+            events[str(event.id)] = scheduled_event_data(event, scheduled_event_status(event))
+    return events, len(guilds), failed
+
+
+async def load_existing_events(repository: Repository, event_ids: List[str]) -> Dict[str, Row]:
+    """event_idに一致するDBの行（チャンクごとの問い合わせを並行して実行）"""
+    chunks = [event_ids[i:i + LOOKUP_CHUNK_SIZE] for i in range(0, len(event_ids), LOOKUP_CHUNK_SIZE)]
+    results = await asyncio.gather(*(
+        repository.list_events_by_event_ids(chunk, columns=LOOKUP_COLUMNS) for chunk in chunks
+    ))
+    return {row['event_id']: row for rows in results for row in rows}
+
+
+async def load_scheduled_events(repository: Repository) -> List[Row]:
+    """DB上の開始前の予定済みイベント"""
+    events: List[Row] = []
+    after = None
+    while True:
+        page = await repository.list_upcoming_events(limit=SCHEDULED_PAGE_SIZE, after=after)
+        events.extend(page)
+        if len(page) < SCHEDULED_PAGE_SIZE:
+            return events
+        after = event_key(page[-1])
+
+
+async def reconcile_scheduled_events(bot: discord.Client, repository: Repository) -> ReconcileResult:
+    """Botの停止中に作成・変更・削除された予定イベントをDBに反映する
+
+    全ギルドの予定イベントとDBの行をevent_idで突き合わせ、差分のある行だけを一括upsertする。
+    Discordにない予定済みイベントは、全ギルドの取得に成功した場合のみキャンセル扱いにする。
+    """
+    started = time.monotonic()
+    result = ReconcileResult()
+
+    discord_events, result.guilds, result.failed_guilds = await fetch_guild_events(bot)
+    result.discord_events = len(discord_events)
+    existing = await load_existing_events(repository, list(discord_events))
+
+    changes: List[Row] = []
+    for event_id, data in discord_events.items():
+        row = existing.get(event_id)
+        if row is None:
+            result.created += 1
+            changes.append(data)
+        elif is_changed(row, data):
+            result.updated += 1
+            changes.append(keep_database_status(row, data))
+        else:
+            result.unchanged += 1
+
+    if result.failed_guilds == 0:
+        for row in await load_scheduled_events(repository):
+            if row['event_id'] not in discord_events:
+                changes.append(dict({name: row.get(name) for name in SYNC_FIELDS}, event_id=row['event_id'], status='cancelled'))
+                result.cancelled += 1
+
+    for i in range(0, len(changes), UPSERT_CHUNK_SIZE):
+        result.rows.extend(await repository.upsert_events(changes[i:i + UPSERT_CHUNK_SIZE]))
+
+    result.elapsed = time.monotonic() - started
+    logger.info(
+        f"Reconciled {result.discord_events} scheduled events from {result.guilds} guilds in {result.elapsed:.2f}s "
+        f"(created: {result.created}, updated: {result.updated}, cancelled: {result.cancelled}, "
+        f"unchanged: {result.unchanged}, failed guilds: {result.failed_guilds})"
+    )
+    return result
@@ -0,0 +1,198 @@
+import asyncio
+import contextlib
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import discord
+from database.repository import Repository, Row
+
+logger = logging.getLogger(__name__)
+
+# 最初の変更から書き込みまでの待ち時間（秒）。この間の同じイベントへの変更は1件にまとめる
+DEFAULT_FLUSH_DELAY = 2.0
+# 未書き込みのイベントがこの件数に達したら待たずに書き込む
+DEFAULT_MAX_PENDING = 200
+# 書き込みに失敗した場合の再試行までの待ち時間（秒）
+RETRY_DELAY = 5.0
+
+
+def scheduled_event_status(event) -> str:
+    """Discordの予定イベントのステータスに対応するeventsテーブルのステータス"""
+    return 'scheduled' if event.status == discord.EventStatus.scheduled else 'cancelled'
+
+
+def scheduled_event_data(event, status: str) -> Row:
+    """Discordの予定イベントからeventsテーブルの1行分のデータを作成"""
+    return {
+        'event_id': str(event.id),
+        'name': event.name,
+        'description': event.description or "説明なし",
+        'start_date': event.start_time.isoformat(),
+        'end_date': event.end_time.isoformat() if event.end_time else None,
+        'location': event.location or "場所未定",
+        'status': status,
+        'created_by': str(event.creator_id) if event.creator_id else None
+    }
+
+
+@dataclass
+class PendingEventChange:
+    """書き込み待ちのイベントの変更"""
+    data: Row
+    # LINE通知用トリガー（条件, メッセージ）
+    trigger: Optional[Tuple[str, str]] = None
+
+    def merge(self, data: Row, trigger: Optional[Tuple[str, str]]):
+        """後から来た変更をまとめる"""
+        self.data.update(data)
+        if trigger is None:
+            return
+        pending = self.trigger[0] if self.trigger else None
+        if pending == 'event_created' and trigger[0] == 'event_updated':
+            # 作成の通知前に更新された場合は、最新の内容で作成を通知する
+            self.trigger = ('event_created', trigger[1])
+        elif pending == 'event_created' and trigger[0] == 'event_cancelled':
+            # 通知前に取り消されたイベントは通知しない
+            self.trigger = None
+        else:
+            self.trigger = trigger
+
+
+class EventSyncBuffer:
+    """Discordの予定イベント変更の書き込みバッファ（write-behind）
+
+    短い間隔内の同じイベントへの変更を1件にまとめ、イベントはevent_idでの一括upsert、
+    トリガーは一括insertで書き込む。書き込み後にon_syncedへ書き込んだ行を渡す。
+    """
+
+    def __init__(
+        self,
+        get_repository: Callable[[], Optional[Repository]],
+        on_synced: Optional[Callable[[List[Row]], None]] = None,
+        flush_delay: float = DEFAULT_FLUSH_DELAY,
+        max_pending: int = DEFAULT_MAX_PENDING
+    ):
+        self.get_repository = get_repository
+        self.on_synced = on_synced
+        self.flush_delay = flush_delay
+        self.max_pending = max_pending
+        self._pending: Dict[str, PendingEventChange] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.received = 0
+        self.written_events = 0
+        self.written_triggers = 0
+        self.flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, data: Row, trigger: Optional[Tuple[str, str]] = None):
+        """イベントの変更を追加（同じイベントの未書き込みの変更とまとめる）"""
+        self.received += 1
+        self._merge(data['event_id'], data, trigger)
+        if len(self._pending) >= self.max_pending:
+            self._schedule(0)
+        else:
+            self._schedule(self.flush_delay)
+
+    def _merge(self, event_id: str, data: Row, trigger: Optional[Tuple[str, str]]):
+        change = self._pending.get(event_id)
+        if change is None:
+            self._pending[event_id] = PendingEventChange(dict(data), trigger)
+        else:
+            change.merge(data, trigger)
+
+    def _schedule(self, delay: float):
+        """書き込みの予約（予約済みなら、より早い場合のみ予約し直す）"""
+        if self._flush_task and not self._flush_task.done():
+            if delay > 0:
+                return
+            self._flush_task.cancel()
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error syncing scheduled events, retrying in {RETRY_DELAY}s: {e}")
+            self._schedule(RETRY_DELAY)
+
+    async def flush(self):
+        """未書き込みの変更をまとめて書き込む"""
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            repository = self.get_repository()
+            try:
+                if repository is None:
+                    raise RuntimeError("Repository is not available")
+                rows = await repository.upsert_events([change.data for change in pending.values()])
+            except Exception:
+                self._requeue(pending)
+                raise
+
+            # トリガーはイベントの内部IDを参照する
+            event_uuids = {row['event_id']: row['id'] for row in rows}
+            triggers = [
+                {
+                    'event_id': event_uuids[event_id],
+                    'trigger_condition': change.trigger[0],
+                    'message_content': change.trigger[1]
+                }
+                for event_id, change in pending.items()
+                if change.trigger and event_id in event_uuids
+            ]
+            trigger_error = None
+            try:
+                if triggers:
+                    await repository.create_triggers(triggers)
+            except Exception as e:
+                # イベントは書き込み済みのため、トリガーのある変更だけを戻して次の書き込みで再試行する
+                logger.error(f"Error creating triggers for {len(triggers)} events: {e}")
+                trigger_error = e
+                self._requeue({
+                    event_id: change for event_id, change in pending.items()
+                    if change.trigger and event_id in event_uuids
+                })
+                triggers = []
+
+            self.flushes += 1
+            self.written_events += len(rows)
+            self.written_triggers += len(triggers)
+            logger.info(f"Synced {len(rows)} scheduled events and {len(triggers)} triggers")
+
+        if self.on_synced:
+            self.on_synced(rows)
+        if trigger_error is not None:
+            raise trigger_error
+
+    def _requeue(self, changes: Dict[str, PendingEventChange]):
+        """書き込めなかった変更を、その後の変更より前の状態として戻す"""
+        newer, self._pending = self._pending, {}
+        for event_id, change in changes.items():
+            self._merge(event_id, change.data, change.trigger)
+        for event_id, change in newer.items():
+            self._merge(event_id, change.data, change.trigger)
+
+    async def close(self):
+        """予約を取り消して残りの変更を書き込む"""
+        task, self._flush_task = self._flush_task, None
+        if task and not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pending': self.pending,
+            'received': self.received,
+            'written_events': self.written_events,
+            'written_triggers': self.written_triggers,
+            'flushes': self.flushes
+        }
@@ -1,10 +1,10 @@
 from fastapi import FastAPI, Request, HTTPException
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookParser
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage,
     TemplateSendMessage, ButtonsTemplate, PostbackAction,
-    PostbackEvent
+    PostbackEvent, FollowEvent, UnfollowEvent
 )
 import sys
 import os
@@ -19,11 +19,19 @@ from config.settings import (
     LINE_CHANNEL_ACCESS_TOKEN,
     LINE_CHANNEL_SECRET,
     WEBHOOK_HANDLER_PATH,
-    SUPABASE_URL,
-    SUPABASE_ANON_KEY
+    WEBHOOK_DEDUP_STORE,
+    SUPABASE_URL
 )
-from supabase import create_client, Client
 from postgrest import APIError
+from database.repository import Repository, create_repository
+from database.cache import upcoming_events_cache, event_record_cache, CursorStore
+from database.search import DEFAULT_SEARCH_LIMIT, event_search_index, search_upcoming_events
+from reminder.recipients import recipient_cache
+from line_bot.dispatcher import LineDispatcher
+from line_bot.client import AsyncLineClient
+from line_bot.event_queue import WebhookEventQueue
+from line_bot.dedup import WebhookEventDeduplicator
+from line_bot.users import line_user_cache
 
 # ロギングの設定
 logging.basicConfig(
@@ -34,25 +42,26 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# LINE Bot API設定
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+# LINE Bot API設定（非同期クライアント、レート制限と再試行はディスパッチャーが担う）
+line_bot_api = LineDispatcher(AsyncLineClient(LINE_CHANNEL_ACCESS_TOKEN))
+parser = WebhookParser(LINE_CHANNEL_SECRET)
 
 # Supabase接続の再試行設定
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # seconds
 
-async def get_supabase_client() -> Optional[Client]:
-    """Supabaseクライアントの取得（再試行あり）"""
+async def get_repository() -> Repository:
+    """Supabaseリポジトリの取得（再試行あり）"""
     for attempt in range(MAX_RETRIES):
+        repository = create_repository()
         try:
             logger.info(f"Connecting to Supabase at {SUPABASE_URL} (attempt {attempt + 1})")
-            supabase: Client = create_client(str(SUPABASE_URL), str(SUPABASE_ANON_KEY))
             # 接続テスト
-            await asyncio.to_thread(lambda: supabase.table('events').select('count', count='exact').execute())
+            await repository.ping()
             logger.info("Supabase connection established")
-            return supabase
+            return repository
         except Exception as e:
+            await repository.close()
             if attempt < MAX_RETRIES - 1:
                 logger.warning(f"Failed to connect to Supabase (attempt {attempt + 1}): {e}")
                 await asyncio.sleep(RETRY_DELAY * (attempt + 1))
@@ -60,14 +69,25 @@ async def get_supabase_client() -> Optional[Client]:
                 logger.error(f"Failed to connect to Supabase after {MAX_RETRIES} attempts: {e}")
                 raise
 
-# Supabase初期化
-supabase: Optional[Client] = None
+# Supabase初期化（接続プールはLINE Botのイベントループで共有する）
+repository: Optional[Repository] = None
 
 @app.on_event("startup")
 async def startup_event():
     """アプリケーション起動時の初期化"""
-    global supabase
-    supabase = await get_supabase_client()
+    global repository
+    repository = await get_repository()
+    if WEBHOOK_DEDUP_STORE == 'table':
+        webhook_dedup.store = repository
+    webhook_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """アプリケーション終了時の後処理"""
+    await webhook_queue.stop()
+    await line_bot_api.close()
+    if repository:
+        await repository.close()
 
 @app.post(WEBHOOK_HANDLER_PATH)
 async def webhook(request: Request):
@@ -77,31 +97,70 @@ async def webhook(request: Request):
     body_decode = body.decode('utf-8')
 
     try:
-        await asyncio.to_thread(handler.handle, body_decode, signature)
+        events = parser.parse(body_decode, signature)
     except InvalidSignatureError:
         logger.error("Invalid signature error")
         raise HTTPException(status_code=400, detail="Invalid signature")
     except Exception as e:
         logger.error(f"Webhook handling error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
-    
+
+    # 再送されたイベントはDBやLINE APIを呼ぶ前に捨てる
+    events = webhook_dedup.filter_new(events)
+
+    # イベントの処理はワーカーに任せてすぐに応答する（キューが満杯の場合はLINEの再送に任せる）
+    try:
+        webhook_queue.put_events(events)
+    except asyncio.QueueFull:
+        logger.warning(f"Webhook queue is full, rejecting {len(events)} events")
+        raise HTTPException(status_code=503, detail="Service busy")
+    webhook_dedup.mark_all(events)
+
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
+@app.get("/metrics/webhook")
+async def webhook_metrics():
+    """Webhookキューの深さとレイテンシ"""
+    return dict(webhook_queue.stats(), duplicates=webhook_dedup.duplicates)
+
+async def dispatch_event(event):
+    """Webhookイベントを対応するハンドラーに振り分け"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        await handle_message(event)
+    elif isinstance(event, PostbackEvent):
+        await handle_postback(event)
+    elif isinstance(event, FollowEvent):
+        await handle_follow(event)
+    elif isinstance(event, UnfollowEvent):
+        handle_unfollow(event)
+
+async def process_event(event):
+    """キューから取り出したイベントの処理（他のレプリカで処理済みなら捨てる）"""
+    if await webhook_dedup.claim(event):
+        await dispatch_event(event)
+
+# Webhookイベントの重複排除とバックグラウンド処理
+webhook_dedup = WebhookEventDeduplicator()
+webhook_queue = WebhookEventQueue(process_event)
+
 async def handle_message(event):
     """メッセージイベントの処理"""
     try:
         text = event.message.text.lower()
         
         if text == 'events':
-            await show_event_list(event.reply_token)
+            await show_event_list(event.reply_token, event.source.user_id)
+        elif text == 'events next':
+            await show_event_list(event.reply_token, event.source.user_id, next_page=True)
         elif text.startswith('join '):
             event_id = text.split(' ')[1]
             await handle_event_join(event.reply_token, event_id, event.source.user_id)
+        elif text.startswith('search '):
+            await show_search_results(event.reply_token, event.message.text[len('search '):].strip())
         else:
             await line_bot_api.reply_message(
                 event.reply_token,
-                TextSendMessage(text="以下のコマンドが使用できます：\n- events: イベント一覧の表示\n- join [イベントID]: イベントへの参加")
+                TextSendMessage(text="以下のコマンドが使用できます：\n- events: イベント一覧の表示\n- events next: 次のページの表示\n- search [キーワード]: イベントの検索\n- join [イベントID]: イベントへの参加")
             )
     
     except Exception as e:
@@ -111,7 +170,6 @@ async def handle_message(event):
             TextSendMessage(text="申し訳ありません。エラーが発生しました。")
         )
 
-@handler.add(PostbackEvent)
 async def handle_postback(event):
     """ポストバックイベントの処理"""
     try:
@@ -130,30 +188,51 @@ async def handle_postback(event):
             TextSendMessage(text="申し訳ありません。エラーが発生しました。")
         )
 
-async def show_event_list(reply_token, page: int = 1, per_page: int = 5):
-    """イベント一覧の表示（ページネーション対応）"""
+async def handle_follow(event):
+    """友だち追加の処理（参加時に取得せずに済むようプロフィールを先に取得しておく）"""
+    user_id = event.source.user_id
+    line_user_cache.invalidate(user_id)
     try:
-        # 現在時刻以降のイベントのみを取得
-        current_time = datetime.now(timezone.utc).isoformat()
-        query = supabase.table('events')\
-            .select('*')\
-            .eq('status', 'scheduled')\
-            .gte('start_date', current_time)\
-            .order('start_date', desc=False)\
-            .range((page-1)*per_page, page*per_page)
-        
-        result = await asyncio.to_thread(lambda: query.execute())
-        
-        if not result.data:
+        profile = await line_bot_api.get_profile(user_id)
+        line_user_cache.set(user_id, display_name=profile.display_name)
+    except Exception as e:
+        logger.error(f"Error prefetching profile for {user_id}: {e}")
+
+def handle_unfollow(event):
+    """ブロックの処理（キャッシュしたユーザー情報を破棄）"""
+    line_user_cache.invalidate(event.source.user_id)
+
+# ユーザーごとのイベント一覧の次のページの位置
+event_list_cursors = CursorStore()
+
+async def show_event_list(reply_token, user_id: Optional[str] = None, next_page: bool = False, per_page: int = 5):
+    """イベント一覧の表示（'events next'は前回表示した位置の続きからキーセットで取得）"""
+    try:
+        after, page = None, 1
+        if next_page:
+            position = event_list_cursors.get(user_id) if user_id else None
+            if not position or position[0] is None:
+                await line_bot_api.reply_message(
+                    reply_token,
+                    TextSendMessage(text="これ以上のイベントはありません。'events' で最初のページを表示します。")
+                )
+                return
+            after, page = position
+
+        # 現在時刻以降のイベントのみを取得（通常はキャッシュから返す）
+        result = await upcoming_events_cache.get_page(repository, per_page, after=after)
+        events = result.events
+
+        if not events:
             await line_bot_api.reply_message(
                 reply_token,
-                TextSendMessage(text="現在予定されているイベントはありません。")
+                TextSendMessage(text="これ以上のイベントはありません。" if next_page else "現在予定されているイベントはありません。")
             )
             return
 
         # イベント一覧の作成
         events_text = "📅 予定されているイベント:\n\n"
-        for event in result.data:
+        for event in events:
             start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
             events_text += f"🎉 {event['name']}\n"
             events_text += f"📅 {start_time.strftime('%Y-%m-%d %H:%M')}\n"
@@ -163,21 +242,17 @@ async def show_event_list(reply_token, page: int = 1, per_page: int = 5):
             events_text += f"ℹ️ {description}\n"
             events_text += f"参加するには: join {event['event_id']}\n\n"
 
-        # ページネーション情報
-        total_count = await asyncio.to_thread(
-            lambda: supabase.table('events')
-                .select('count', count='exact')
-                .eq('status', 'scheduled')
-                .gte('start_date', current_time)
-                .execute()
-        )
-        total_pages = -(-total_count.count // per_page)  # 切り上げ除算
+        # ページネーション情報（総件数はキャッシュの推定値）
+        total_pages = max(-(-result.total // per_page), page)  # 切り上げ除算
 
         if total_pages > 1:
             events_text += f"\nページ {page}/{total_pages}"
-            if page < total_pages:
+            if result.next_cursor:
                 events_text += "\n次のページを見るには 'events next' と入力してください。"
 
+        if user_id:
+            event_list_cursors.set(user_id, result.next_cursor, page + 1)
+
         await line_bot_api.reply_message(
             reply_token,
             TextSendMessage(text=events_text)
@@ -190,77 +265,105 @@ async def show_event_list(reply_token, page: int = 1, per_page: int = 5):
             TextSendMessage(text="イベント一覧の取得中にエラーが発生しました。")
         )
 
-async def handle_event_join(reply_token, event_id, user_id):
-    """イベント参加処理（トランザクション対応）"""
+async def show_search_results(reply_token, query: str):
+    """イベントの検索結果の表示"""
     try:
-        # イベントの存在確認
-        event_result = await asyncio.to_thread(
-            lambda: supabase.table('events').select('*').eq('event_id', event_id).execute()
-        )
-        
-        if not event_result.data:
+        # 現在時刻以降のイベントから一致度の高い順に検索（通常はメモリ上のインデックスから返す）
+        events = await search_upcoming_events(repository, query, limit=DEFAULT_SEARCH_LIMIT) if query else []
+
+        if not events:
             await line_bot_api.reply_message(
                 reply_token,
-                TextSendMessage(text="指定されたイベントは見つかりませんでした。")
+                TextSendMessage(text=f"「{query}」に一致するイベントは見つかりませんでした。")
             )
             return
 
-        event = event_result.data[0]
+        results_text = f"🔍 検索結果: {query}\n\n"
+        for event in events:
+            start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
+            results_text += f"🎉 {event['name']}\n"
+            results_text += f"📅 {start_time.strftime('%Y-%m-%d %H:%M')}\n"
+            results_text += f"📍 {event['location']}\n"
+            results_text += f"参加するには: join {event['event_id']}\n\n"
+
+        await line_bot_api.reply_message(
+            reply_token,
+            TextSendMessage(text=results_text.rstrip())
+        )
 
-        # イベントの開催時期チェック
-        start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
-        if start_time < datetime.now(timezone.utc):
+    except Exception as e:
+        logger.error(f"Error searching events: {e}")
+        await line_bot_api.reply_message(
+            reply_token,
+            TextSendMessage(text="イベントの検索中にエラーが発生しました。")
+        )
+
+# join_eventの結果ステータスごとの応答メッセージ
+JOIN_STATUS_MESSAGES = {
+    'event_not_found': "指定されたイベントは見つかりませんでした。",
+    'event_started': "このイベントは既に開始されているか終了しています。",
+    'already_registered': "既にこのイベントに参加登録されています。",
+    'already_waitlisted': "既にこのイベントのキャンセル待ちに登録されています。"
+}
+
+def remember_event(event_id: str, result):
+    """RPCがロックして読んだイベント行をキャッシュに反映"""
+    if result['status'] == 'event_not_found':
+        event_record_cache.set(event_id, None)
+    elif result.get('event'):
+        event_record_cache.set(event_id, result['event'])
+
+async def handle_event_join(reply_token, event_id, user_id):
+    """イベント参加処理（join_event関数で1トランザクション）"""
+    try:
+        # 存在しないイベントはDBに問い合わせずに応答する
+        # 開始済みかどうかは別プロセスでの日時の変更を反映するため、join_eventが現在の行で判定する
+        if event_record_cache.peek(event_id) == (True, None):
             await line_bot_api.reply_message(
                 reply_token,
-                TextSendMessage(text="このイベントは既に開始されているか終了しています。")
+                TextSendMessage(text=JOIN_STATUS_MESSAGES['event_not_found'])
             )
             return
 
-        # トランザクション開始
-        async with asyncio.Lock():
-            # 重複参加チェック
-            existing_participant = await asyncio.to_thread(
-                lambda: supabase.table('participants')
-                    .select('*')
-                    .eq('event_id', event['id'])
-                    .eq('user_id', user_id)
-                    .execute()
-            )
-
-            if existing_participant.data:
-                await line_bot_api.reply_message(
-                    reply_token,
-                    TextSendMessage(text="既にこのイベントに参加登録されています。")
-                )
-                return
+        # キャッシュしたユーザーIDと表示名があればDBでの検索とプロフィールの取得を省略する
+        cached = line_user_cache.get(user_id)
+        result = await repository.join_event(
+            event_id,
+            user_id,
+            cached.display_name if cached else None,
+            user_uuid=cached.user_uuid if cached else None
+        )
 
-            # ユーザー情報の取得または作成
-            user_result = await asyncio.to_thread(
-                lambda: supabase.table('users').select('*').eq('line_user_id', user_id).execute()
+        # 未登録ユーザーで表示名が未取得の場合のみLINEプロファイルを取得して再実行
+        if result['status'] == 'profile_required':
+            profile = await line_bot_api.get_profile(user_id)
+            line_user_cache.set(user_id, display_name=profile.display_name)
+            result = await repository.join_event(event_id, user_id, profile.display_name)
+
+        if result.get('user_id'):
+            line_user_cache.set(user_id, user_uuid=result['user_id'])
+        remember_event(event_id, result)
+
+        status = result['status']
+        if status == 'waitlisted':
+            # 定員に達しているためキャンセル待ちに登録された
+            message = f"イベント「{result['event']['name']}」は定員に達しているため、キャンセル待ちに登録しました"
+            message += f"（{result['waitlist_position']}番目）。\n参加が確定したらお知らせします。"
+            await line_bot_api.reply_message(
+                reply_token,
+                TextSendMessage(text=message)
             )
-            
-            if not user_result.data:
-                # LINEプロファイルの取得
-                profile = await asyncio.to_thread(lambda: line_bot_api.get_profile(user_id))
-                user_data = {
-                    'line_user_id': user_id,
-                    'name': profile.display_name
-                }
-                user_result = await asyncio.to_thread(
-                    lambda: supabase.table('users').insert(user_data).execute()
-                )
-
-            user = user_result.data[0]
-
-            # 参加登録
-            participant_data = {
-                'event_id': event['id'],
-                'user_id': user['id'],
-                'status': 'registered'
-            }
-            await asyncio.to_thread(
-                lambda: supabase.table('participants').insert(participant_data).execute()
+            return
+        if status != 'joined':
+            await line_bot_api.reply_message(
+                reply_token,
+                TextSendMessage(text=JOIN_STATUS_MESSAGES.get(status, "イベントへの参加処理中にエラーが発生しました。"))
             )
+            return
+
+        event = result['event']
+        recipient_cache.invalidate(event['id'])
+        start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
 
         # 参加確認メッセージの送信
         message = f"イベント「{event['name']}」への参加登録が完了しました！\n\n"
@@ -274,6 +377,8 @@ async def handle_event_join(reply_token, event_id, user_id):
 
     except APIError as e:
         logger.error(f"Supabase API error: {e}")
+        # キャッシュしたユーザーIDが古い可能性があるため破棄する
+        line_user_cache.invalidate(user_id)
         await line_bot_api.reply_message(
             reply_token,
             TextSendMessage(text="データベース処理中にエラーが発生しました。")
@@ -285,88 +390,64 @@ async def handle_event_join(reply_token, event_id, user_id):
             TextSendMessage(text="イベントへの参加処理中にエラーが発生しました。")
         )
 
+# cancel_participationの結果ステータスごとの応答メッセージ
+CANCEL_STATUS_MESSAGES = {
+    'event_not_found': "指定されたイベントは見つかりませんでした。",
+    'user_not_found': "ユーザー情報が見つかりませんでした。",
+    'not_registered': "このイベントへの参加登録が見つかりませんでした。"
+}
+
 async def handle_event_cancel(reply_token, event_id, user_id):
-    """イベント参加キャンセル処理"""
+    """イベント参加キャンセル処理（cancel_participation関数で1トランザクション）"""
     try:
-        # イベントの存在確認
-        event_result = await asyncio.to_thread(
-            lambda: supabase.table('events').select('*').eq('event_id', event_id).execute()
-        )
-        
-        if not event_result.data:
+        # 存在しないイベントはDBに問い合わせずに応答する
+        if event_record_cache.peek(event_id) == (True, None):
             await line_bot_api.reply_message(
                 reply_token,
-                TextSendMessage(text="指定されたイベントは見つかりませんでした。")
+                TextSendMessage(text=CANCEL_STATUS_MESSAGES['event_not_found'])
             )
             return
 
-        event = event_result.data[0]
-
-        # ユーザー情報の取得
-        user_result = await asyncio.to_thread(
-            lambda: supabase.table('users').select('*').eq('line_user_id', user_id).execute()
+        cached = line_user_cache.get(user_id)
+        result = await repository.cancel_participation(
+            event_id,
+            user_id,
+            user_uuid=cached.user_uuid if cached else None
         )
 
-        if not user_result.data:
-            await line_bot_api.reply_message(
-                reply_token,
-                TextSendMessage(text="ユーザー情報が見つかりませんでした。")
-            )
-            return
-
-        user = user_result.data[0]
+        if result.get('user_id'):
+            line_user_cache.set(user_id, user_uuid=result['user_id'])
+        remember_event(event_id, result)
 
-        # 参加登録の確認と削除
-        participant_result = await asyncio.to_thread(
-            lambda: supabase.table('participants')
-                .select('*')
-                .eq('event_id', event['id'])
-                .eq('user_id', user['id'])
-                .execute()
-        )
-
-        if not participant_result.data:
+        status = result['status']
+        if status != 'cancelled':
             await line_bot_api.reply_message(
                 reply_token,
-                TextSendMessage(text="このイベントへの参加登録が見つかりませんでした。")
+                TextSendMessage(text=CANCEL_STATUS_MESSAGES.get(status, "イベントのキャンセル処理中にエラーが発生しました。"))
             )
             return
 
-        # トランザクション開始
-        async with asyncio.Lock():
-            # 参加登録の削除
-            await asyncio.to_thread(
-                lambda: supabase.table('participants')
-                    .delete()
-                    .eq('event_id', event['id'])
-                    .eq('user_id', user['id'])
-                    .execute()
-            )
-
-            # 参加者数の確認
-            participants_count = await asyncio.to_thread(
-                lambda: supabase.table('participants')
-                    .select('count', count='exact')
-                    .eq('event_id', event['id'])
-                    .execute()
-            )
-
-            # 参加者が0人になった場合、イベントのステータスを更新
-            if participants_count.count == 0:
-                await asyncio.to_thread(
-                    lambda: supabase.table('events')
-                        .update({'status': 'pending'})
-                        .eq('id', event['id'])
-                        .execute()
-                )
+        event = result['event']
+        recipient_cache.invalidate(event['id'])
+        # 参加者が0人になったイベントはpendingになり一覧・検索結果から外れる
+        if result['participant_count'] == 0:
+            upcoming_events_cache.invalidate()
+            event_search_index.update(event_id, event)
 
         # キャンセル確認メッセージの送信
-        message = f"イベント「{event['name']}」の参加をキャンセルしました。"
+        if result.get('was_waitlisted'):
+            message = f"イベント「{event['name']}」のキャンセル待ちを取り消しました。"
+        else:
+            message = f"イベント「{event['name']}」の参加をキャンセルしました。"
         await line_bot_api.reply_message(
             reply_token,
             TextSendMessage(text=message)
         )
 
+        # キャンセル待ちから繰り上がったユーザーへの通知
+        if result.get('promoted_line_user_id'):
+            await notify_promoted(result['promoted_line_user_id'], event)
+
     except APIError as e:
         logger.error(f"Supabase API error: {e}")
         await line_bot_api.reply_message(
@@ -380,6 +461,17 @@ async def handle_event_cancel(reply_token, event_id, user_id):
             TextSendMessage(text="イベントのキャンセル処理中にエラーが発生しました。")
         )
 
+async def notify_promoted(line_user_id: str, event):
+    """キャンセル待ちから参加に繰り上がったユーザーへの通知（失敗してもキャンセル処理には影響させない）"""
+    try:
+        start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
+        message = f"キャンセルが出たため、イベント「{event['name']}」への参加が確定しました！\n\n"
+        message += f"📅 開始: {start_time.strftime('%Y-%m-%d %H:%M')}\n"
+        message += f"📍 場所: {event['location']}"
+        await line_bot_api.push_message(line_user_id, TextSendMessage(text=message))
+    except Exception as e:
+        logger.error(f"Error notifying promoted user {line_user_id}: {e}")
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
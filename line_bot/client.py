@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import warnings
+from typing import Dict, Tuple
+import aiohttp
+from linebot import AsyncLineBotApi
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient
+
+logger = logging.getLogger(__name__)
+
+# コネクションプールの設定
+POOL_SIZE = 100
+KEEPALIVE_TIMEOUT = 60  # seconds
+REQUEST_TIMEOUT = 10  # seconds
+
+
+class AsyncLineClient:
+    """aiohttpのコネクションプールを共有する非同期LINE Messaging APIクライアント
+
+    セッションはイベントループごとに作成する（LINE Botとリマインダーが別スレッドのループで動くため）。
+    """
+
+    def __init__(
+        self,
+        channel_access_token: str,
+        pool_size: int = POOL_SIZE,
+        keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+        timeout: float = REQUEST_TIMEOUT
+    ):
+        self.channel_access_token = channel_access_token
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._clients: Dict[asyncio.AbstractEventLoop, Tuple[aiohttp.ClientSession, AsyncLineBotApi]] = {}
+
+    def _api(self) -> AsyncLineBotApi:
+        """実行中のイベントループ用のAPIクライアントの取得（初回はセッションを作成）"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client[0].closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                api = AsyncLineBotApi(
+                    self.channel_access_token,
+                    AiohttpAsyncHttpClient(session, timeout=self.timeout)
+                )
+            client = (session, api)
+            self._clients[loop] = client
+        return client[1]
+
+    async def reply_message(self, reply_token, messages, **kwargs):
+        """応答メッセージの送信"""
+        return await self._api().reply_message(reply_token, messages, **kwargs)
+
+    async def push_message(self, to, messages, **kwargs):
+        """プッシュメッセージの送信"""
+        return await self._api().push_message(to, messages, **kwargs)
+
+    async def multicast(self, to, messages, **kwargs):
+        """複数ユーザーへのメッセージ送信"""
+        return await self._api().multicast(to, messages, **kwargs)
+
+    async def broadcast(self, messages, **kwargs):
+        """友だち全員へのメッセージ送信"""
+        return await self._api().broadcast(messages, **kwargs)
+
+    async def get_profile(self, user_id, **kwargs):
+        """プロフィールの取得"""
+        return await self._api().get_profile(user_id, **kwargs)
+
+    async def close(self):
+        """実行中のイベントループのセッションを閉じる"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client and not client[0].closed:
+            await client[0].close()
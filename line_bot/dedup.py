@@ -0,0 +1,109 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence
+from database.repository import Repository
+
+logger = logging.getLogger(__name__)
+
+# プロセス内で記録するWebhookイベントIDの上限
+DEFAULT_MAX_ENTRIES = 10000
+# 記録の保持期間（秒）。LINEの再送はこの期間内に届く前提
+DEFAULT_TTL_SECONDS = 86400
+# テーブルの古い記録を削除する間隔（秒）
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class WebhookEventDeduplicator:
+    """webhookEventIdによるWebhookイベントの重複排除
+
+    プロセス内のLRU+TTLキャッシュで再送をO(1)で捨てる。
+    storeを設定した場合は複数レプリカ間でもテーブルで重複を判定する。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        store: Optional[Repository] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._seen: 'OrderedDict[str, float]' = OrderedDict()
+        self._last_purge: Optional[float] = None
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def is_duplicate(self, webhook_event_id: Optional[str]) -> bool:
+        """このプロセスで受信済みのイベントか"""
+        if not webhook_event_id:
+            return False
+        expires_at = self._seen.get(webhook_event_id)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._seen[webhook_event_id]
+            return False
+        return True
+
+    def mark(self, webhook_event_id: Optional[str]):
+        """受信済みとして記録（上限を超えた場合は最も古い記録から削除）"""
+        if not webhook_event_id:
+            return
+        self._seen[webhook_event_id] = time.monotonic() + self.ttl_seconds
+        self._seen.move_to_end(webhook_event_id)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+    def filter_new(self, events: Sequence[Any]) -> List[Any]:
+        """受信済み（同じリクエスト内の重複を含む）のイベントを除外
+
+        記録はしないため、キューへの追加に成功した後にmark_allを呼ぶ。
+        """
+        new_events = []
+        batch_ids = set()
+        for event in events:
+            webhook_event_id = getattr(event, 'webhook_event_id', None)
+            if self.is_duplicate(webhook_event_id) or (webhook_event_id and webhook_event_id in batch_ids):
+                self.duplicates += 1
+                logger.info(f"Dropping duplicate webhook event {webhook_event_id}")
+                continue
+            if webhook_event_id:
+                batch_ids.add(webhook_event_id)
+            new_events.append(event)
+        return new_events
+
+    def mark_all(self, events: Sequence[Any]):
+        """イベントをまとめて受信済みとして記録"""
+        for event in events:
+            self.mark(getattr(event, 'webhook_event_id', None))
+
+    async def claim(self, event: Any) -> bool:
+        """テーブルでイベントを処理済みとして記録（他のレプリカが処理済みならFalse）"""
+        webhook_event_id = getattr(event, 'webhook_event_id', None)
+        if self.store is None or not webhook_event_id:
+            return True
+        try:
+            await self._purge_if_due()
+            claimed = await self.store.claim_webhook_event(webhook_event_id, int(self.ttl_seconds))
+        except Exception as e:
+            # 記録に失敗した場合は取りこぼしを避けるため処理を続ける
+            logger.error(f"Error claiming webhook event {webhook_event_id}: {e}")
+            return True
+        if not claimed:
+            self.duplicates += 1
+            logger.info(f"Dropping webhook event {webhook_event_id} already handled by another replica")
+        return claimed
+
+    async def _purge_if_due(self):
+        """一定間隔で保持期間を過ぎたテーブルの記録を削除"""
+        now = time.monotonic()
+        if self._last_purge is not None and now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        purged = await self.store.purge_webhook_events(int(self.ttl_seconds))
+        if purged:
+            logger.info(f"Purged {purged} expired webhook event records")
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+from linebot.exceptions import LineBotApiError
+
+logger = logging.getLogger(__name__)
+
+# エンドポイントごとの送信レート（リクエスト/秒）。LINE Messaging APIのレート制限より低めに設定
+DEFAULT_RATE_LIMITS = {
+    'reply_message': 1000,
+    'push_message': 1000,
+    'multicast': 100,
+    'broadcast': 60 / 3600,
+    'get_profile': 1000,
+}
+# 再試行の設定
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1  # seconds
+RETRY_MAX_DELAY = 60  # seconds
+# 再試行するHTTPステータス（レート制限とサーバーエラー）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# 応答トークンは1回限りで有効期限も短く、5xxの後の再送は失敗するか二重に届くため、レート制限のみ再試行する
+REPLY_RETRYABLE_STATUS_CODES = {429}
+# 再試行キーを付与できるAPI（同じキーの再送はLINE側で重複排除される）
+RETRY_KEY_METHODS = {'push_message', 'multicast', 'broadcast'}
+
+
+class TokenBucket:
+    """トークンバケットによるレート制限（スレッドをまたいで共有可能）"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """トークンを1つ予約し、利用可能になるまでの待ち時間を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    async def acquire(self):
+        """トークンが利用可能になるまで待機"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """レート制限を受けた場合に一定時間すべての送信を止める"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class LineDispatcher:
+    """レート制限と再試行を備えたLINE Messaging APIの送信窓口
+
+    LineBotApiと同じメソッド名で呼び出せるため、LINE BotとリマインダーでLineBotApiの代わりに共有する。
+    """
+
+    def __init__(
+        self,
+        line_bot_api,
+        rate_limits: Optional[Dict[str, float]] = None,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY
+    ):
+        self.line_bot_api = line_bot_api
+        limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.buckets = {method: TokenBucket(rate) for method, rate in limits.items()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def reply_message(self, reply_token, messages, **kwargs):
+        """応答メッセージの送信"""
+        return await self._dispatch('reply_message', reply_token, messages, **kwargs)
+
+    async def push_message(self, to, messages, **kwargs):
+        """プッシュメッセージの送信"""
+        return await self._dispatch('push_message', to, messages, **kwargs)
+
+    async def multicast(self, to, messages, **kwargs):
+        """複数ユーザーへのメッセージ送信"""
+        return await self._dispatch('multicast', to, messages, **kwargs)
+
+    async def broadcast(self, messages, **kwargs):
+        """友だち全員へのメッセージ送信"""
+        return await self._dispatch('broadcast', messages, **kwargs)
+
+    async def get_profile(self, user_id, **kwargs):
+        """プロフィールの取得"""
+        return await self._dispatch('get_profile', user_id, **kwargs)
+
+    async def close(self):
+        """クライアントの接続を閉じる"""
+        close = getattr(self.line_bot_api, 'close', None)
+        if close and asyncio.iscoroutinefunction(close):
+            await close()
+
+    def _retry_delay(self, attempt: int, error: LineBotApiError) -> float:
+        """Retry-Afterがあればそれに従い、なければジッター付き指数バックオフ"""
+        retry_after = (error.headers or {}).get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _call(self, method_name: str, *args, **kwargs) -> Any:
+        """同期・非同期どちらのクライアントのメソッドも呼び出す"""
+        method = getattr(self.line_bot_api, method_name)
+        if asyncio.iscoroutinefunction(method):
+            return await method(*args, **kwargs)
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def _dispatch(self, method_name: str, *args, **kwargs) -> Any:
+        """レート制限を守って送信し、429・5xxの場合は再試行する（応答メッセージは429のみ）"""
+        if method_name in RETRY_KEY_METHODS and kwargs.get('retry_key') is None:
+            kwargs['retry_key'] = str(uuid.uuid4())
+        bucket = self.buckets.get(method_name)
+        retryable = REPLY_RETRYABLE_STATUS_CODES if method_name == 'reply_message' else RETRYABLE_STATUS_CODES
+
+        for attempt in range(self.max_retries + 1):
+            if bucket:
+                await bucket.acquire()
+            try:
+                return await self._call(method_name, *args, **kwargs)
+            except LineBotApiError as e:
+                # 再試行キーで既に受け付け済みの場合は成功とみなす
+                if e.status_code == 409 and 'retry_key' in kwargs:
+                    return None
+                if e.status_code not in retryable or attempt >= self.max_retries:
+                    if method_name == 'reply_message':
+                        logger.error(f"LINE API reply_message failed with {e.status_code}, not retrying")
+                    raise
+                delay = self._retry_delay(attempt, e)
+                if e.status_code == 429 and bucket:
+                    bucket.pause(delay)
+                logger.warning(
+                    f"LINE API {method_name} failed with {e.status_code}, "
+                    f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})"
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# キュー全体で保持できるイベント数の上限（超えた場合はWebhookに503を返す）
+DEFAULT_MAX_SIZE = 1000
+# イベントを処理するワーカー数
+DEFAULT_WORKERS = 8
+# レイテンシの集計に使う直近のサンプル数
+LATENCY_SAMPLES = 1000
+
+
+class LatencyStats:
+    """直近のレイテンシ（秒）のパーセンタイルを集計する"""
+
+    def __init__(self, max_samples: int = LATENCY_SAMPLES):
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+
+    def add(self, value: float):
+        self.samples.append(value)
+
+    def percentile(self, p: float) -> float:
+        """p（0〜100）パーセンタイルの値（サンプルがなければ0）"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'max_ms': round(max(self.samples, default=0.0) * 1000, 3)
+        }
+
+
+class WebhookEventQueue:
+    """Webhookイベントをバックグラウンドで処理する有界キュー
+
+    同じ送信元（ユーザー・グループ・トークルーム）のイベントは同じワーカーに割り当て、受信順に処理する。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        max_size: int = DEFAULT_MAX_SIZE,
+        workers: int = DEFAULT_WORKERS
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if max_size < workers:
+            raise ValueError("max_size must be at least the number of workers")
+        self.handler = handler
+        self.max_size = max_size
+        self.shard_size = max_size // workers
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=self.shard_size) for _ in range(workers)]
+        self.tasks: List[asyncio.Task] = []
+        # 待ち時間（受信から処理開始まで）と処理時間
+        self.wait_latency = LatencyStats()
+        self.handle_latency = LatencyStats()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        """処理待ちのイベント数"""
+        return sum(q.qsize() for q in self.queues)
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self.tasks)
+
+    def start(self):
+        """実行中のイベントループでワーカーを起動"""
+        if self.running:
+            return
+        self.tasks = [
+            asyncio.create_task(self._worker(q), name=f"webhook-worker-{i}")
+            for i, q in enumerate(self.queues)
+        ]
+        logger.info(f"Started {len(self.tasks)} webhook workers (queue size {self.max_size})")
+
+    async def stop(self, timeout: float = 10):
+        """キューに残ったイベントの処理を待ってワーカーを停止"""
+        if self.running:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stopping webhook workers with {self.depth} events left in queue")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _shard(self, event: Any) -> int:
+        """送信元IDからワーカーを決定"""
+        source = getattr(event, 'source', None)
+        key = (
+            getattr(source, 'group_id', None)
+            or getattr(source, 'room_id', None)
+            or getattr(source, 'user_id', None)
+        )
+        if not key:
+            return 0
+        return zlib.crc32(key.encode('utf-8')) % len(self.queues)
+
+    def put_events(self, events: Sequence[Any]):
+        """イベントをまとめてキューに追加
+
+        一部だけが追加されることはなく、空きが足りなければasyncio.QueueFullを送出する。
+        """
+        shards: List[Tuple[int, Any]] = [(self._shard(event), event) for event in events]
+        counts: Dict[int, int] = {}
+        for shard, _ in shards:
+            counts[shard] = counts.get(shard, 0) + 1
+        for shard, count in counts.items():
+            if self.queues[shard].qsize() + count > self.shard_size:
+                self.rejected += len(events)
+                raise asyncio.QueueFull()
+
+        received_at = time.monotonic()
+        for shard, event in shards:
+            self.queues[shard].put_nowait((event, received_at))
+        self.enqueued += len(events)
+
+    async def _worker(self, queue: asyncio.Queue):
+        """キューのイベントを順に処理"""
+        while True:
+            event, received_at = await queue.get()
+            started_at = time.monotonic()
+            self.wait_latency.add(started_at - received_at)
+            try:
+                await self.handler(event)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing webhook event: {e}")
+            finally:
+                self.handle_latency.add(time.monotonic() - started_at)
+                queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """キューの深さとレイテンシのメトリクス"""
+        return {
+            'depth': self.depth,
+            'max_size': self.max_size,
+            'workers': len(self.queues),
+            'running': self.running,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'wait_latency': self.wait_latency.summary(),
+            'handle_latency': self.handle_latency.summary()
+        }
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# キャッシュするLINEユーザー数の上限
+DEFAULT_MAX_USERS = 10000
+# キャッシュの有効期間（秒）。表示名の変更はこの期間内に反映される
+DEFAULT_TTL_SECONDS = 3600
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """LINEユーザーに対応する内部のユーザーIDと表示名（未確定の項目はNone）"""
+    user_uuid: Optional[str] = None
+    display_name: Optional[str] = None
+
+
+class LineUserCache:
+    """LINEユーザーIDから内部のユーザーIDと表示名を引くLRU+TTLキャッシュ
+
+    参加・キャンセルの結果と取得したプロフィールで登録し、友だち追加・ブロック時に破棄する。
+    """
+
+    def __init__(self, max_users: int = DEFAULT_MAX_USERS, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        if max_users < 1:
+            raise ValueError("max_users must be at least 1")
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, CachedUser]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, line_user_id: str) -> Optional[CachedUser]:
+        """ユーザー情報の取得（未登録または期限切れの場合はNone）"""
+        entry = self._entries.get(line_user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            self._entries.pop(line_user_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(line_user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, line_user_id: str, user_uuid: Optional[str] = None, display_name: Optional[str] = None):
+        """ユーザー情報の登録（指定しなかった項目は登録済みの値を引き継ぐ）"""
+        entry = self._entries.get(line_user_id)
+        if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+            user_uuid = user_uuid or entry[1].user_uuid
+            display_name = display_name or entry[1].display_name
+        self._entries[line_user_id] = (time.monotonic(), CachedUser(user_uuid, display_name))
+        self._entries.move_to_end(line_user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, line_user_id: str):
+        """ユーザー情報を破棄（友だち追加・ブロック時に呼び出す）"""
+        self._entries.pop(line_user_id, None)
+
+    def clear(self):
+        """全エントリの破棄"""
+        self._entries.clear()
+
+
+# LINE Botで共有するインスタンス
+line_user_cache = LineUserCache()
@@ -3,13 +3,14 @@ import uvicorn
 from discord_bot.bot import EventBot
 from line_bot.app import app, line_bot_api
 from reminder.scheduler import ReminderScheduler
+from reminder.outbox import TriggerOutboxConsumer
 import logging
 import sys
 import signal
 from concurrent.futures import ThreadPoolExecutor
 from config.settings import DISCORD_TOKEN
-from supabase import create_client
-from config.settings import SUPABASE_URL, SUPABASE_ANON_KEY
+from database.repository import create_repository
+from config.settings import REMINDER_SCHEDULER_MODE, LINE_BROADCAST_TRIGGERS
 
 # ロギングの設定
 logging.basicConfig(
@@ -25,7 +26,8 @@ class EventNotificationSystem:
         self.running = True
         self.line_bot_server = None
         self.reminder_scheduler = None
-        self.supabase = create_client(str(SUPABASE_URL), str(SUPABASE_ANON_KEY))
+        self.trigger_outbox = None
+        self.repository = None
 
     async def start_discord_bot(self):
         """Discord Botの起動"""
@@ -50,12 +52,33 @@ class EventNotificationSystem:
     async def start_reminder_scheduler(self):
         """リマインダースケジューラーの起動"""
         try:
-            self.reminder_scheduler = ReminderScheduler(self.supabase, line_bot_api)
+            self.reminder_scheduler = ReminderScheduler(
+                self.repository,
+                line_bot_api,
+                mode=REMINDER_SCHEDULER_MODE
+            )
+            # Discordでのイベント変更をタイマーに反映
+            self.discord_bot.add_event_change_listener(self.reminder_scheduler.notify_event_changed)
             await self.reminder_scheduler.start()
         except Exception as e:
             logger.error(f"Reminder scheduler error: {e}")
             await self.shutdown()
 
+    async def start_trigger_outbox(self):
+        """Discordで作成されたトリガーをLINEに配信するコンシューマーの起動"""
+        try:
+            self.trigger_outbox = TriggerOutboxConsumer(
+                self.repository,
+                line_bot_api,
+                broadcast_conditions=LINE_BROADCAST_TRIGGERS
+            )
+            # 同じプロセスのDiscord Botがトリガーを書き込んだら確認間隔を待たずに配信
+            self.discord_bot.add_event_change_listener(lambda event_id: self.trigger_outbox.notify())
+            await self.trigger_outbox.start()
+        except Exception as e:
+            logger.error(f"Trigger outbox consumer error: {e}")
+            await self.shutdown()
+
     async def run(self):
         """システム全体の起動"""
         logger.info("Starting Event Notification System...")
@@ -66,10 +89,14 @@ class EventNotificationSystem:
             loop.add_signal_handler(sig, lambda s=sig: asyncio.create_task(self.shutdown(sig)))
 
         try:
-            # LINE Bot、Discord Bot、リマインダースケジューラーを並行して起動
+            # 接続プールはメインのイベントループで作成し、スケジューラーとアウトボックスで共有する
+            self.repository = create_repository()
+
+            # LINE Bot、Discord Bot、リマインダースケジューラー、トリガーのアウトボックスを並行して起動
             line_bot_future = self.executor.submit(self.start_line_bot)
             discord_task = asyncio.create_task(self.start_discord_bot())
             reminder_task = asyncio.create_task(self.start_reminder_scheduler())
+            outbox_task = asyncio.create_task(self.start_trigger_outbox())
 
             # 全てのコンポーネントの状態を監視
             while self.running:
@@ -91,6 +118,12 @@ class EventNotificationSystem:
                     if exc:
                         raise exc
 
+                # トリガーのアウトボックスのエラーチェック
+                if outbox_task.done():
+                    exc = outbox_task.exception()
+                    if exc:
+                        raise exc
+
                 await asyncio.sleep(1)
 
         except Exception as e:
@@ -127,6 +160,26 @@ class EventNotificationSystem:
         except Exception as e:
             logger.error(f"Error stopping reminder scheduler: {e}")
 
+        # トリガーのアウトボックスの終了
+        try:
+            if self.trigger_outbox:
+                await self.trigger_outbox.stop()
+        except Exception as e:
+            logger.error(f"Error stopping trigger outbox consumer: {e}")
+
+        # LINE APIクライアントの接続を閉じる
+        try:
+            await line_bot_api.close()
+        except Exception as e:
+            logger.error(f"Error closing LINE API client: {e}")
+
+        # Supabase接続プールを閉じる
+        try:
+            if self.repository:
+                await self.repository.close()
+        except Exception as e:
+            logger.error(f"Error closing Supabase connection pool: {e}")
+
         # ThreadPoolExecutorの終了（待機してクリーンアップ）
         try:
             self.executor.shutdown(wait=True)
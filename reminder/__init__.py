@@ -1,4 +1,7 @@
 # Reminder package initialization
 from .scheduler import ReminderScheduler
+from .fanout import MulticastFanout, FanoutResult
+from .recipients import RecipientCache, recipient_cache
+from .outbox import TriggerOutboxConsumer
 
-__all__ = ['ReminderScheduler']
\ No newline at end of file
+__all__ = ['ReminderScheduler', 'MulticastFanout', 'FanoutResult', 'RecipientCache', 'recipient_cache', 'TriggerOutboxConsumer']
\ No newline at end of file
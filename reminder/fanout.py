@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Union
+from linebot.models import SendMessage
+from line_bot.dispatcher import LineDispatcher
+
+logger = logging.getLogger(__name__)
+
+# LINE Messaging APIのmulticastで一度に指定できる宛先の上限
+MULTICAST_MAX_RECIPIENTS = 500
+# 同時に送信するバッチ数の上限
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+@dataclass
+class BatchResult:
+    """1回のmulticast呼び出しの結果"""
+    recipients: List[str]
+    success: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class FanoutResult:
+    """ファンアウト全体の結果"""
+    batches: List[BatchResult] = field(default_factory=list)
+
+    @property
+    def sent_count(self) -> int:
+        return sum(len(b.recipients) for b in self.batches if b.success)
+
+    @property
+    def failed_count(self) -> int:
+        return sum(len(b.recipients) for b in self.batches if not b.success)
+
+    @property
+    def failed_batches(self) -> List[BatchResult]:
+        return [b for b in self.batches if not b.success]
+
+
+class MulticastFanout:
+    """宛先をmulticastのバッチにまとめ、並行数を制限して送信する"""
+
+    def __init__(
+        self,
+        dispatcher: LineDispatcher,
+        batch_size: int = MULTICAST_MAX_RECIPIENTS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    ):
+        if not 0 < batch_size <= MULTICAST_MAX_RECIPIENTS:
+            raise ValueError(f"batch_size must be between 1 and {MULTICAST_MAX_RECIPIENTS}")
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+
+    def make_batches(self, recipients: Sequence[str]) -> List[List[str]]:
+        """宛先の重複と空値を除いてバッチに分割"""
+        unique = list(dict.fromkeys(r for r in recipients if r))
+        return [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+
+    async def send(
+        self,
+        recipients: Sequence[str],
+        messages: Union[SendMessage, List[SendMessage]]
+    ) -> FanoutResult:
+        """全宛先へメッセージを送信し、バッチごとの結果を返す"""
+        batches = self.make_batches(recipients)
+        if not batches:
+            return FanoutResult()
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send_batch(batch: List[str]) -> BatchResult:
+            async with semaphore:
+                try:
+                    await self.dispatcher.multicast(batch, messages)
+                    return BatchResult(recipients=batch, success=True)
+                except Exception as e:
+                    logger.error(f"Error sending multicast to {len(batch)} users: {e}")
+                    return BatchResult(recipients=batch, success=False, error=str(e))
+
+        results = await asyncio.gather(*(send_batch(batch) for batch in batches))
+        return FanoutResult(batches=list(results))
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Set, Union
+from linebot import LineBotApi
+from linebot.models import TextSendMessage
+from line_bot.dispatcher import LineDispatcher
+from line_bot.event_queue import LatencyStats
+from database.repository import Repository, Row
+from .fanout import MulticastFanout
+
+logger = logging.getLogger(__name__)
+
+# trigger_outbox_cursorsのコンシューマー名
+DEFAULT_CONSUMER = 'line'
+# 1回に読み込むトリガー数
+OUTBOX_BATCH_SIZE = 100
+# 新しいトリガーを確認する間隔（秒）
+POLL_INTERVAL_SECONDS = 5
+# アウトボックスのリース期間（秒）。期限切れは他のワーカーが引き継ぐ
+LEASE_SECONDS = 60
+# 作成からこの秒数が経ったトリガーのみ読む（コミットの遅れたトリガーを読み飛ばさないため）
+SETTLE_SECONDS = 2
+# 1件のトリガーの配信を試みる回数の上限（超えたら読み飛ばして後続を配信する）
+MAX_ATTEMPTS = 5
+# 1回のbroadcastで送れるメッセージ数の上限（LINE Messaging APIの制限）
+BROADCAST_MAX_MESSAGES = 5
+
+
+class TriggerOutboxConsumer:
+    """triggersテーブルのLINE通知を配信するアウトボックスコンシューマー
+
+    リースを持つ1つのワーカーが(created_at, id)順にバッチで読み進め、配信した位置をtrigger_outbox_cursorsに記録する。
+    トリガーはイベント参加者にmulticastし（参加者がいなければ読み飛ばす）、broadcast_conditionsに指定した種類のみ友だち全員にbroadcastする。
+    バッチ内のbroadcastは最大5件ずつ1回の送信にまとめ、multicastはイベントごとに並行して作成順に送る。
+    送信後・記録前に停止した場合は再送される（at-least-once）。
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        line_bot_api: Union[LineBotApi, LineDispatcher],
+        consumer: str = DEFAULT_CONSUMER,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = POLL_INTERVAL_SECONDS,
+        broadcast_conditions: Sequence[str] = ()
+    ):
+        self.repository = repository
+        # LINE Botと共有するディスパッチャー経由で送信（LineBotApiが渡された場合はラップする）
+        if isinstance(line_bot_api, LineDispatcher):
+            self.dispatcher = line_bot_api
+        else:
+            self.dispatcher = LineDispatcher(line_bot_api)
+        self.fanout = MulticastFanout(self.dispatcher)
+        self.consumer = consumer
+        # 友だち全員にbroadcastするトリガーの種類（既定ではbroadcastしない）
+        self.broadcast_conditions = tuple(broadcast_conditions)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.running = True
+        self._wakeup = asyncio.Event()
+        # 処理中のバッチで読み込んだイベントごとの送信先
+        self._batch_recipients: Dict[str, List[str]] = {}
+        # 配信に失敗したトリガーIDと失敗回数
+        self.failed_attempts: Dict[str, int] = {}
+        # トリガーの作成から送信完了までと、送信にかかった時間
+        self.delivery_latency = LatencyStats()
+        self.send_latency = LatencyStats()
+        self.delivered = 0
+        self.skipped = 0
+        self.failed = 0
+        self.recipients_sent = 0
+        self.started_at = time.monotonic()
+
+    async def start(self):
+        """アウトボックスの配信を開始"""
+        logger.info(f"Starting trigger outbox consumer ({self.worker_id})...")
+        while self.running:
+            try:
+                await self.process_outbox()
+            except Exception as e:
+                logger.error(f"Error in trigger outbox consumer: {e}")
+            await self._sleep()
+
+    async def stop(self):
+        """配信の停止"""
+        self.running = False
+        self._wakeup.set()
+
+    def notify(self):
+        """新しいトリガーの通知（次の確認間隔を待たずに配信する）"""
+        self._wakeup.set()
+
+    async def _sleep(self):
+        """確認間隔か通知まで待機（通知された場合はトリガーが読めるようになるまで待つ）"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            await asyncio.sleep(SETTLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def process_outbox(self) -> int:
+        """リースを取得できた場合に、未配信のトリガーがなくなるまで配信して件数を返す"""
+        processed = 0
+        while self.running:
+            # バッチごとにリースを延長する
+            cursor = await self.repository.acquire_trigger_outbox(self.consumer, self.worker_id, LEASE_SECONDS)
+            if cursor is None:
+                return processed
+
+            until = datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS)
+            triggers = await self.repository.list_triggers_after(
+                cursor['last_created_at'],
+                cursor['last_trigger_id'],
+                self.batch_size,
+                until
+            )
+            if not triggers:
+                return processed
+
+            last = await self.deliver_batch(triggers)
+            if last is None:
+                # 先頭のトリガーが配信できなかった場合は次の確認で再試行
+                return processed
+            if not await self.repository.advance_trigger_outbox(self.consumer, self.worker_id, last['created_at'], last['id']):
+                logger.warning(f"Trigger outbox lease for {self.consumer} was taken over by another worker")
+                return processed
+
+            processed += triggers.index(last) + 1
+            logger.info(f"Delivered {triggers.index(last) + 1} triggers: {self.stats()}")
+            if last is not triggers[-1] or len(triggers) < self.batch_size:
+                return processed
+        return processed
+
+    async def deliver_batch(self, triggers: List[Row]) -> Optional[Row]:
+        """バッチの配信。作成順で先頭から続けて配信済み（または読み飛ばし）になった最後のトリガーを返す"""
+        broadcasts: List[Row] = []
+        groups: Dict[str, List[Row]] = {}
+        for trigger in triggers:
+            if trigger['trigger_condition'] in self.broadcast_conditions:
+                broadcasts.append(trigger)
+            else:
+                groups.setdefault(trigger['event_id'], []).append(trigger)
+
+        done: Set[str] = set()
+        self._batch_recipients = {}
+
+        async def deliver_broadcasts(chunk: List[Row]):
+            if await self.deliver_with_retry(chunk):
+                done.update(trigger['id'] for trigger in chunk)
+
+        async def deliver_group(group: List[Row]):
+            for trigger in group:
+                if not await self.deliver_with_retry([trigger]):
+                    # 同じイベントの後続のトリガーは順序を守るため次回に回す
+                    return
+                done.add(trigger['id'])
+
+        # broadcastは送信回数の上限が厳しいため、複数のトリガーを1回の送信にまとめる
+        chunks = [
+            broadcasts[i:i + BROADCAST_MAX_MESSAGES]
+            for i in range(0, len(broadcasts), BROADCAST_MAX_MESSAGES)
+        ]
+        await asyncio.gather(
+            *(deliver_broadcasts(chunk) for chunk in chunks),
+            *(deliver_group(group) for group in groups.values())
+        )
+
+        last = None
+        for trigger in triggers:
+            if trigger['id'] not in done:
+                break
+            last = trigger
+        return last
+
+    async def deliver_with_retry(self, triggers: List[Row]) -> bool:
+        """トリガーの配信（配信済みまたは読み飛ばした場合はTrue）"""
+        key = triggers[0]['id']
+        try:
+            await self.deliver(triggers)
+            self.failed_attempts.pop(key, None)
+            return True
+        except Exception as e:
+            attempts = self.failed_attempts.get(key, 0) + 1
+            if attempts >= MAX_ATTEMPTS:
+                logger.error(f"Skipping {len(triggers)} triggers from {key} after {attempts} failed attempts: {e}")
+                self.failed_attempts.pop(key, None)
+                self.skipped += len(triggers)
+                return True
+            logger.error(f"Error delivering {len(triggers)} triggers from {key} (attempt {attempts}): {e}")
+            self.failed_attempts[key] = attempts
+            self.failed += len(triggers)
+            return False
+
+    async def deliver(self, triggers: List[Row]):
+        """トリガーのメッセージをLINEに送信（broadcastは複数件、multicastは1件ずつ）"""
+        started = time.monotonic()
+        messages = [TextSendMessage(text=trigger['message_content']) for trigger in triggers]
+        if triggers[0]['trigger_condition'] in self.broadcast_conditions:
+            await self.dispatcher.broadcast(messages)
+        else:
+            trigger = triggers[0]
+            recipients = await self.get_recipients(trigger['event_id'])
+            if not recipients:
+                # 作成直後のイベントなど参加者がいない場合は送信せず読み飛ばす（broadcastは設定で有効にする）
+                logger.info(f"Skipping {trigger['trigger_condition']} trigger {trigger['id']}: event has no participants")
+                self.skipped += 1
+                return
+            result = await self.fanout.send(recipients, messages[0])
+            if result.failed_batches and not result.sent_count:
+                raise RuntimeError(result.failed_batches[0].error)
+            for batch in result.failed_batches:
+                logger.error(
+                    f"Failed to send trigger {trigger['id']} "
+                    f"to {len(batch.recipients)} users: {batch.error}"
+                )
+            self.recipients_sent += result.sent_count
+
+        self.send_latency.add(time.monotonic() - started)
+        now = datetime.now(timezone.utc)
+        for trigger in triggers:
+            created_at = datetime.fromisoformat(trigger['created_at'].replace('Z', '+00:00'))
+            self.delivery_latency.add((now - created_at).total_seconds())
+        self.delivered += len(triggers)
+
+    async def get_recipients(self, event_id: str) -> List[str]:
+        """イベント参加者のLINEユーザーIDの取得（同じバッチ内では1回だけ読み込む）
+
+        トリガーには参加者の版数がなく別プロセスでの変更を検証できないため、バッチをまたいでキャッシュしない。
+        """
+        recipients = self._batch_recipients.get(event_id)
+        if recipients is None:
+            recipients = await self.repository.list_participant_line_ids(event_id)
+            self._batch_recipients[event_id] = recipients
+        return recipients
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            'delivered': self.delivered,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'recipients': self.recipients_sent,
+            'throughput_per_sec': round(self.delivered / elapsed, 3),
+            'delivery_latency': self.delivery_latency.summary(),
+            'send_latency': self.send_latency.summary()
+        }
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# キャッシュするイベント数の上限
+DEFAULT_MAX_EVENTS = 1024
+# キャッシュの有効期間（秒）。1日前・3時間前・1時間前のリマインダーをまたいで使えるよう1日より長くする
+# 別プロセスでの参加・キャンセルは有効期間ではなく参加者の版数（participants_version）で検出する
+DEFAULT_TTL_SECONDS = 25 * 3600
+
+
+class RecipientCache:
+    """イベントごとのリマインダー送信先（LINEユーザーID）のLRUキャッシュ
+
+    送信先は読み込んだ時点の参加者の版数とともに記録し、版数が変わっていれば読み直す。
+    LINE Botとリマインダースケジューラーのスレッドから参照されるためロックで保護する。
+    """
+
+    def __init__(self, max_events: int = DEFAULT_MAX_EVENTS, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        if max_events < 1:
+            raise ValueError("max_events must be at least 1")
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        # イベントID -> (記録した時刻, 参加者の版数, 送信先)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[int], List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, event_id: str, version: Optional[int] = None) -> Optional[List[str]]:
+        """送信先の取得（未登録・期限切れ・版数が異なる場合はNone。版数を省略した場合は期限のみで判定）"""
+        with self._lock:
+            entry = self._entries.get(event_id)
+            if (
+                entry is None
+                or time.monotonic() - entry[0] > self.ttl_seconds
+                or (version is not None and entry[1] != version)
+            ):
+                self._entries.pop(event_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(event_id)
+            self.hits += 1
+            return list(entry[2])
+
+    def set(self, event_id: str, recipients: List[str], version: Optional[int] = None):
+        """送信先の登録（上限を超えた場合は最も古いエントリを削除）"""
+        with self._lock:
+            self._entries[event_id] = (time.monotonic(), version, list(recipients))
+            self._entries.move_to_end(event_id)
+            while len(self._entries) > self.max_events:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, event_id: str):
+        """イベントの送信先を破棄（同じプロセスでの参加・キャンセル時に呼び出す）"""
+        with self._lock:
+            self._entries.pop(event_id, None)
+
+    def clear(self):
+        """全エントリの破棄"""
+        with self._lock:
+            self._entries.clear()
+
+
+# LINE Botとリマインダースケジューラーで共有するインスタンス
+recipient_cache = RecipientCache()
@@ -1,22 +1,87 @@
 import asyncio
 import logging
+import os
+import signal
+import socket
+import uuid
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
-from supabase import Client
+from typing import List, Dict, Any, Optional, Set, Union
 from linebot import LineBotApi
 from linebot.models import TextSendMessage
+from line_bot.dispatcher import LineDispatcher
+from database.repository import Repository
+from .fanout import MulticastFanout, FanoutResult
+from .timer import ReminderTimer
+from .recipients import RecipientCache, recipient_cache
 
 logger = logging.getLogger(__name__)
 
+# リマインダーを並行処理するワーカー数の既定値
+DEFAULT_MAX_WORKERS = 4
+# 1回の割り当てで取得するリマインダー数
+CLAIM_BATCH_SIZE = 100
+# 割り当てたリマインダーのリース期間（秒）。期限切れは他のスケジューラーが再取得する
+LEASE_SECONDS = 300
+# 予定時刻の何秒前から送信対象とするか
+LOOKAHEAD_SECONDS = 300
+# 送信に失敗したリマインダーを再試行する回数の上限。達したものは失敗としてマークし再取得しない
+MAX_ATTEMPTS = 5
+# タイマーモードでメモリに読み込む先読み期間（秒）。この間隔でのみ全件を再読み込みする
+# 別プロセスで作成・変更されたイベントはこの間隔で取り込まれる
+TIMER_HORIZON_SECONDS = 900
+# タイマーモードで送信に失敗したリマインダーを再試行するまでの待ち時間（秒）。ポーリングモードの確認間隔と同じ
+RETRY_DELAY_SECONDS = 60
+
+SCHEDULER_MODES = ('polling', 'timer')
+
 class ReminderScheduler:
-    def __init__(self, supabase: Client, line_bot_api: LineBotApi):
-        self.supabase = supabase
+    def __init__(
+        self,
+        repository: Repository,
+        line_bot_api: Union[LineBotApi, LineDispatcher],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        mode: str = 'polling',
+        recipients: Optional[RecipientCache] = None
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if mode not in SCHEDULER_MODES:
+            raise ValueError(f"Invalid scheduler mode: {mode}")
+        self.repository = repository
         self.line_bot_api = line_bot_api
+        # LINE Botと共有するディスパッチャー経由で送信（LineBotApiが渡された場合はラップする）
+        if isinstance(line_bot_api, LineDispatcher):
+            self.dispatcher = line_bot_api
+        else:
+            self.dispatcher = LineDispatcher(line_bot_api)
+        self.fanout = MulticastFanout(self.dispatcher)
+        self.recipients = recipients if recipients is not None else recipient_cache
+        self.max_workers = max_workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # スケジューラーのインスタンスごとに一意なワーカーID
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.mode = mode
+        self.timer = ReminderTimer()
+        self._wakeup = asyncio.Event()
+        self._changed_events: Set[str] = set()
+        self._horizon_end: Optional[datetime] = None
+        # 送信済みだがDBへのマークが未完了のリマインダーID
+        self.pending_sent: Set[str] = set()
+        # 送信に失敗したリマインダーIDと失敗回数（上限に達するまで次回の取得で再試行される）
+        self.failed_reminders: Dict[str, int] = {}
         self.running = True
 
+    @property
+    def queue_depth(self) -> int:
+        """処理待ちのイベント（リマインダーのまとまり）の数"""
+        return self.queue.qsize()
+
     async def start(self):
         """リマインダースケジューラーの開始"""
-        logger.info("Starting reminder scheduler...")
+        logger.info(f"Starting reminder scheduler ({self.mode} mode)...")
+        if self.mode == 'timer':
+            await self._run_timer()
+            return
         while self.running:
             try:
                 await self.process_reminders()
@@ -28,77 +93,245 @@ class ReminderScheduler:
     async def stop(self):
         """スケジューラーの停止"""
         self.running = False
+        self._wakeup.set()
 
-    async def process_reminders(self):
-        """期限の来たリマインダーの処理"""
+    def notify_event_changed(self, event_id: str):
+        """イベントの変更通知（タイマーモードでは該当イベントのリマインダーのみ再読み込み）"""
+        self._changed_events.add(event_id)
+        self._wakeup.set()
+
+    async def _run_timer(self):
+        """次の予定時刻までスリープし、到来したリマインダーを送信する"""
+        while self.running:
+            try:
+                now = datetime.now(timezone.utc)
+                if self._horizon_end is None or now >= self._horizon_end:
+                    await self.load_timer()
+                elif self._changed_events:
+                    changed, self._changed_events = self._changed_events, set()
+                    for event_id in changed:
+                        await self.refresh_event(event_id)
+
+                if self.timer.pop_due(datetime.now(timezone.utc)):
+                    await self.process_reminders(lookahead_seconds=0)
+
+                await self._sleep_until_next_deadline()
+            except Exception as e:
+                logger.error(f"Error in reminder scheduler: {e}")
+                self._horizon_end = None
+                await asyncio.sleep(60)  # エラー時は1分待機して全件再読み込み
+
+    async def _sleep_until_next_deadline(self):
+        """次の予定時刻・先読み期間の終了・変更通知のいずれかまで待機"""
+        now = datetime.now(timezone.utc)
+        wake_at = self._horizon_end
+        deadline = self.timer.next_deadline()
+        if deadline is not None and deadline < wake_at:
+            wake_at = deadline
+        timeout = max((wake_at - now).total_seconds(), 0)
         try:
-            current_time = datetime.now(timezone.utc)
-            target_time = current_time + timedelta(minutes=5)
-
-            # 未送信のリマインダーを取得
-            reminders = await asyncio.to_thread(
-                lambda: self.supabase.table('reminders')
-                    .select('*, events(*)')
-                    .is_('sent_at', 'null')
-                    .lte('scheduled_at', target_time.isoformat())
-                    .execute()
-            )
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def load_timer(self):
+        """先読み期間内の未送信リマインダーをタイマーに読み込む"""
+        now = datetime.now(timezone.utc)
+        horizon_end = now + timedelta(seconds=TIMER_HORIZON_SECONDS)
+        rows = await self.repository.list_pending_reminders(horizon_end)
+        self.timer.clear()
+        self._changed_events.clear()
+        self._horizon_end = horizon_end
+        for row in rows:
+            self._schedule_row(row)
+        logger.info(f"Loaded {len(self.timer)} reminders into timer until {horizon_end.isoformat()}")
 
-            for reminder in reminders.data:
-                try:
-                    event = reminder['events']
-                    if not event or event['status'] != 'scheduled':
-                        continue
-
-                    # メッセージの作成と送信
-                    message = self.create_reminder_message(event, reminder['reminder_type'])
-                    await self.send_reminder(event['id'], message)
-
-                    # リマインダーを送信済みとしてマーク
-                    await asyncio.to_thread(
-                        lambda: self.supabase.table('reminders')
-                            .update({
-                                'sent_at': datetime.now(timezone.utc).isoformat()
-                            })
-                            .eq('id', reminder['id'])
-                            .execute()
-                    )
-                except Exception as e:
-                    logger.error(f"Error processing reminder {reminder['id']}: {e}")
+    async def refresh_event(self, event_id: str):
+        """1イベント分のリマインダーをタイマーに再読み込み"""
+        rows = await self.repository.list_event_reminders(event_id)
+        self.timer.cancel_event(event_id)
+        for row in rows:
+            if row['events']['status'] == 'scheduled':
+                self._schedule_row(row)
+
+    def _schedule_row(self, row: Dict[str, Any]):
+        """取得した行を先読み期間内であればタイマーに登録"""
+        scheduled_at = datetime.fromisoformat(row['scheduled_at'].replace('Z', '+00:00'))
+        if self._horizon_end is not None and scheduled_at > self._horizon_end:
+            return
+        self.timer.schedule(row['id'], scheduled_at, row['events']['event_id'])
+
+    async def process_reminders(self, lookahead_seconds: int = LOOKAHEAD_SECONDS):
+        """期限の来たリマインダーの処理"""
+        try:
+            while True:
+                reminders = await self.claim_due_reminders(lookahead_seconds)
+                await self.dispatch_reminders(reminders)
+                # バッチが満杯なら残りがある可能性があるため続けて取得
+                if len(reminders) < CLAIM_BATCH_SIZE:
+                    break
 
         except Exception as e:
             logger.error(f"Error processing reminders: {e}")
             raise
 
-    async def send_reminder(self, event_id: str, message: str):
-        """リマインダーの送信"""
-        try:
-            # イベント参加者の取得
-            participants = await asyncio.to_thread(
-                lambda: self.supabase.table('participants')
-                    .select('users(line_user_id)')
-                    .eq('event_id', event_id)
-                    .execute()
-            )
+    async def claim_due_reminders(self, lookahead_seconds: int = LOOKAHEAD_SECONDS) -> List[Dict[str, Any]]:
+        """期限の来たリマインダーをこのワーカーにリースして取得"""
+        return await self.repository.claim_due_reminders(
+            self.worker_id,
+            CLAIM_BATCH_SIZE,
+            LEASE_SECONDS,
+            lookahead_seconds
+        )
 
-            # 参加者へのメッセージ送信
-            for participant in participants.data:
-                user = participant['users']
-                if user and user['line_user_id']:
+    async def dispatch_reminders(self, reminders: List[Dict[str, Any]]):
+        """リマインダーをイベント単位でワーカーに振り分けて処理"""
+        # イベントごとにまとめ、同じイベントのリマインダーは予定時刻順に処理する
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for reminder in sorted(reminders, key=lambda r: r['scheduled_at']):
+            groups.setdefault(reminder['event_id'], []).append(reminder)
+
+        if groups:
+            for group in groups.values():
+                self.queue.put_nowait(group)
+
+            delivered: List[str] = []
+            failed: List[str] = []
+            workers = [
+                asyncio.create_task(self._worker(delivered, failed))
+                for _ in range(min(self.max_workers, len(groups)))
+            ]
+            await asyncio.gather(*workers)
+
+            self.pending_sent.update(delivered)
+            for reminder_id in delivered:
+                self.failed_reminders.pop(reminder_id, None)
+            retry: List[str] = []
+            exhausted: List[str] = []
+            for reminder_id in failed:
+                attempts = self.failed_reminders.get(reminder_id, 0) + 1
+                self.failed_reminders[reminder_id] = attempts
+                if attempts >= MAX_ATTEMPTS:
+                    exhausted.append(reminder_id)
+                else:
+                    retry.append(reminder_id)
+            if retry:
+                released = await self.release_reminders(retry)
+                if self.mode == 'timer':
+                    self._schedule_retry(reminders, retry, released)
+            if exhausted:
+                await self.mark_reminders_failed(exhausted)
+
+        await self.flush_sent()
+
+    async def _worker(self, delivered: List[str], failed: List[str]):
+        """キューからイベント単位でリマインダーを取り出して処理"""
+        while True:
+            try:
+                group = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                for reminder in group:
                     try:
-                        await asyncio.to_thread(
-                            lambda: self.line_bot_api.push_message(
-                                user['line_user_id'],
-                                TextSendMessage(text=message)
-                            )
-                        )
+                        if await self.process_reminder(reminder):
+                            delivered.append(reminder['id'])
                     except Exception as e:
-                        logger.error(f"Error sending reminder to user {user['line_user_id']}: {e}")
+                        logger.error(f"Error processing reminder {reminder['id']}: {e}")
+                        failed.append(reminder['id'])
+            finally:
+                self.queue.task_done()
+
+    async def process_reminder(self, reminder: Dict[str, Any]) -> bool:
+        """1件のリマインダーの送信（送信した場合はTrue）"""
+        event = reminder['events']
+        if not event or event['status'] != 'scheduled':
+            return False
+
+        # メッセージの作成と送信
+        message = self.create_reminder_message(event, reminder['reminder_type'])
+        await self.send_reminder(event['id'], message, event.get('participants_version'))
+        return True
+
+    async def flush_sent(self):
+        """送信済みのリマインダーを1回の更新でまとめてマーク"""
+        if not self.pending_sent:
+            return
+        reminder_ids = list(self.pending_sent)
+        try:
+            await self.repository.mark_reminders_sent(reminder_ids, self.worker_id)
+            self.pending_sent.difference_update(reminder_ids)
+        except Exception as e:
+            # 失敗した場合は次回のflushで再試行する
+            logger.error(f"Error marking {len(reminder_ids)} reminders as sent: {e}")
+
+    async def release_reminders(self, reminder_ids: List[str]) -> bool:
+        """送信に失敗したリマインダーのリースを解放し、次回の取得で再試行させる（解放できた場合はTrue）"""
+        try:
+            await self.repository.release_reminders(reminder_ids, self.worker_id)
+            return True
+        except Exception as e:
+            # 解放できなくてもリースの期限切れ後に再取得される
+            logger.error(f"Error releasing {len(reminder_ids)} reminder leases: {e}")
+            return False
+
+    def _schedule_retry(self, reminders: List[Dict[str, Any]], reminder_ids: List[str], released: bool):
+        """タイマーから取り出し済みの再試行するリマインダーを、待ち時間の後に再びタイマーに登録"""
+        delay = RETRY_DELAY_SECONDS if released else LEASE_SECONDS
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        retry_ids = set(reminder_ids)
+        for reminder in reminders:
+            if reminder['id'] in retry_ids:
+                self.timer.schedule(reminder['id'], retry_at, (reminder.get('events') or {}).get('event_id'))
+
+    async def mark_reminders_failed(self, reminder_ids: List[str]):
+        """再試行の上限に達したリマインダーを失敗としてマーク"""
+        logger.error(f"Giving up {len(reminder_ids)} reminders after {MAX_ATTEMPTS} failed attempts: {reminder_ids}")
+        try:
+            await self.repository.mark_reminders_failed(reminder_ids, self.worker_id)
+            for reminder_id in reminder_ids:
+                self.failed_reminders.pop(reminder_id, None)
+        except Exception as e:
+            # マークできなかった場合はリースの期限切れ後の再取得でもう一度試行し、再度マークする
+            logger.error(f"Error marking {len(reminder_ids)} reminders as failed: {e}")
+
+    async def send_reminder(self, event_id: str, message: str, version: Optional[int] = None) -> FanoutResult:
+        """リマインダーの送信（全バッチが失敗した場合は例外を送出し、再試行の対象にする）"""
+        try:
+            recipients = await self.get_recipients(event_id, version)
+
+            # 参加者へのメッセージ送信（multicastでまとめて送信）
+            result = await self.fanout.send(recipients, TextSendMessage(text=message))
+            if result.failed_batches and not result.sent_count:
+                raise RuntimeError(result.failed_batches[0].error)
+            # 一部のバッチのみ失敗した場合は、送信済みの宛先への重複を避けるため再試行しない
+            for batch in result.failed_batches:
+                logger.error(
+                    f"Failed to send reminder for event {event_id} "
+                    f"to {len(batch.recipients)} users: {batch.error}"
+                )
+            logger.info(
+                f"Reminder for event {event_id} sent to {result.sent_count} users "
+                f"({result.failed_count} failed)"
+            )
+            return result
 
         except Exception as e:
             logger.error(f"Error sending reminder for event {event_id}: {e}")
             raise
 
+    async def get_recipients(self, event_id: str, version: Optional[int] = None) -> List[str]:
+        """イベント参加者のLINEユーザーIDの取得（参加者の版数が同じであればキャッシュを使う）"""
+        recipients = self.recipients.get(event_id, version)
+        if recipients is not None:
+            return recipients
+
+        # イベント参加者の取得
+        recipients = await self.repository.list_participant_line_ids(event_id)
+        self.recipients.set(event_id, recipients, version)
+        return recipients
+
     def create_reminder_message(self, event: Dict[Any, Any], reminder_type: str) -> str:
         """リマインダーメッセージの作成"""
         start_time = datetime.fromisoformat(event['start_date'].replace('Z', '+00:00'))
@@ -121,4 +354,47 @@ class ReminderScheduler:
         if event['description']:
             message += f"\nℹ️ {event['description']}\n"
 
-        return message
\ No newline at end of file
+        return message
+
+
+async def run_scheduler():
+    """リマインダースケジューラーとトリガーのアウトボックスを単独のプロセスとして起動（docker/reminder-scheduler）
+
+    リマインダーはリースで分担され、アウトボックスはリースを持つ1つのプロセスだけが配信するため、複数のレプリカで実行できる。
+    """
+    from config.settings import LINE_CHANNEL_ACCESS_TOKEN, REMINDER_SCHEDULER_MODE, LINE_BROADCAST_TRIGGERS
+    from database.repository import create_repository
+    from line_bot.client import AsyncLineClient
+    from .outbox import TriggerOutboxConsumer
+
+    repository = create_repository()
+    line_bot_api = LineDispatcher(AsyncLineClient(LINE_CHANNEL_ACCESS_TOKEN))
+    scheduler = ReminderScheduler(repository, line_bot_api, mode=REMINDER_SCHEDULER_MODE)
+    outbox = TriggerOutboxConsumer(repository, line_bot_api, broadcast_conditions=LINE_BROADCAST_TRIGGERS)
+    task = asyncio.gather(scheduler.start(), outbox.start())
+
+    # 終了シグナルで送信待ちのスリープを中断する
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        logger.info("Reminder scheduler stopped")
+    finally:
+        # 一方が終了した場合も残りを止める
+        task.cancel()
+        await scheduler.stop()
+        await outbox.stop()
+        # 送信済みのリマインダーをマークしてから終了（未送信のリースは期限切れ後に他のレプリカが取得する）
+        await scheduler.flush_sent()
+        await line_bot_api.close()
+        await repository.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(run_scheduler())
\ No newline at end of file
@@ -0,0 +1,65 @@
+import heapq
+import itertools
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class ReminderTimer:
+    """予定時刻順にリマインダーを保持するタイマー（ヒープ実装）
+
+    削除や時刻変更はエントリを無効化するだけで、ヒープからは取り出し時に取り除く。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int, str]] = []
+        # reminder_id -> (予定時刻, 外部イベントID, 世代番号)
+        self._entries: Dict[str, Tuple[datetime, str, int]] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, reminder_id: str, scheduled_at: datetime, event_key: str):
+        """リマインダーの登録（登録済みの場合は予定時刻を更新）"""
+        generation = next(self._counter)
+        self._entries[reminder_id] = (scheduled_at, event_key, generation)
+        heapq.heappush(self._heap, (scheduled_at, generation, reminder_id))
+
+    def cancel(self, reminder_id: str):
+        """リマインダーの登録解除"""
+        self._entries.pop(reminder_id, None)
+
+    def cancel_event(self, event_key: str):
+        """イベントに紐づくリマインダーをすべて登録解除"""
+        for reminder_id in [rid for rid, entry in self._entries.items() if entry[1] == event_key]:
+            del self._entries[reminder_id]
+
+    def clear(self):
+        """全エントリの削除"""
+        self._heap.clear()
+        self._entries.clear()
+
+    def _discard_stale(self):
+        """ヒープ先頭の無効なエントリを取り除く"""
+        while self._heap:
+            scheduled_at, generation, reminder_id = self._heap[0]
+            entry = self._entries.get(reminder_id)
+            if entry and entry[2] == generation:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[datetime]:
+        """次に到来する予定時刻"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """予定時刻を過ぎたリマインダーIDを取り出す"""
+        due = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, reminder_id = heapq.heappop(self._heap)
+            del self._entries[reminder_id]
+            due.append(reminder_id)
@@ -0,0 +1,46 @@
+-- 複数のスケジューラーでリマインダーを分担するためのリース
+ALTER TABLE public.reminders
+    ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+-- インデックスの作成
+CREATE INDEX IF NOT EXISTS idx_reminders_lease ON reminders(scheduled_at, lease_expires_at) WHERE sent_at IS NULL;
+
+-- 期限の来たリマインダーをワーカーに割り当てる関数
+-- 他のワーカーがロック中の行はスキップし、リースが切れた行（クラッシュしたワーカーの分）は再割り当てする
+CREATE OR REPLACE FUNCTION claim_due_reminders(
+    p_worker_id VARCHAR,
+    p_batch_size INTEGER DEFAULT 100,
+    p_lease_seconds INTEGER DEFAULT 300,
+    p_lookahead_seconds INTEGER DEFAULT 300
+) RETURNS TABLE (
+    id UUID,
+    event_id UUID,
+    reminder_type VARCHAR,
+    scheduled_at TIMESTAMP WITH TIME ZONE,
+    events JSONB
+) AS $$
+    WITH due AS (
+        SELECT r.id
+        FROM public.reminders r
+        JOIN public.events e ON e.id = r.event_id
+        WHERE r.sent_at IS NULL
+          AND e.status = 'scheduled'
+          AND r.scheduled_at <= NOW() + make_interval(secs => p_lookahead_seconds)
+          AND (r.lease_expires_at IS NULL OR r.lease_expires_at < NOW())
+        ORDER BY r.scheduled_at
+        LIMIT p_batch_size
+        FOR UPDATE OF r SKIP LOCKED
+    ), claimed AS (
+        UPDATE public.reminders r
+        SET claimed_by = p_worker_id,
+            lease_expires_at = NOW() + make_interval(secs => p_lease_seconds)
+        FROM due
+        WHERE r.id = due.id
+        RETURNING r.id, r.event_id, r.reminder_type, r.scheduled_at
+    )
+    SELECT c.id, c.event_id, c.reminder_type, c.scheduled_at, to_jsonb(e) AS events
+    FROM claimed c
+    JOIN public.events e ON e.id = c.event_id
+    ORDER BY c.scheduled_at;
+$$ LANGUAGE sql;
\ No newline at end of file
@@ -0,0 +1,52 @@
+-- 処理済みのLINE Webhookイベント（複数レプリカ間での再送の重複排除用）
+CREATE TABLE IF NOT EXISTS public.webhook_events (
+    webhook_event_id VARCHAR(255) PRIMARY KEY,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
+);
+
+-- インデックスの作成
+CREATE INDEX IF NOT EXISTS idx_webhook_events_received_at ON webhook_events(received_at);
+
+-- RLSを有効化
+ALTER TABLE public.webhook_events ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "webhook_events_read_policy" ON public.webhook_events
+    FOR SELECT USING (true);
+
+CREATE POLICY "webhook_events_insert_policy" ON public.webhook_events
+    FOR INSERT WITH CHECK (true);
+
+CREATE POLICY "webhook_events_update_policy" ON public.webhook_events
+    FOR UPDATE USING (true);
+
+CREATE POLICY "webhook_events_delete_policy" ON public.webhook_events
+    FOR DELETE USING (true);
+
+-- Webhookイベントを処理済みとして記録する関数
+-- 初めて記録した場合（または前回の記録が保持期間を過ぎている場合）のみtrueを返す
+CREATE OR REPLACE FUNCTION claim_webhook_event(
+    p_webhook_event_id VARCHAR,
+    p_ttl_seconds INTEGER DEFAULT 86400
+) RETURNS BOOLEAN AS $$
+    WITH claimed AS (
+        INSERT INTO public.webhook_events (webhook_event_id)
+        VALUES (p_webhook_event_id)
+        ON CONFLICT (webhook_event_id) DO UPDATE
+        SET received_at = NOW()
+        WHERE webhook_events.received_at < NOW() - make_interval(secs => p_ttl_seconds)
+        RETURNING 1
+    )
+    SELECT EXISTS (SELECT 1 FROM claimed);
+$$ LANGUAGE sql;
+
+-- 保持期間を過ぎた記録の削除
+CREATE OR REPLACE FUNCTION purge_webhook_events(
+    p_ttl_seconds INTEGER DEFAULT 86400
+) RETURNS INTEGER AS $$
+    WITH purged AS (
+        DELETE FROM public.webhook_events
+        WHERE received_at < NOW() - make_interval(secs => p_ttl_seconds)
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM purged;
+$$ LANGUAGE sql;
@@ -0,0 +1,72 @@
+-- イベント参加をまとめて行う関数（register_for_eventの拡張）
+-- ユーザーの作成、開始時刻・重複・定員のチェック、参加登録を1つのトランザクションで行い、結果をステータスで返す
+--   joined: 参加登録完了 / already_registered: 登録済み / event_not_found: イベントなし
+--   event_started: 開始済み / event_full: 定員超過 / profile_required: 未登録ユーザーで名前の指定なし
+CREATE OR REPLACE FUNCTION join_event(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_display_name VARCHAR DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_user_id UUID;
+    v_participant_count INTEGER;
+BEGIN
+    -- イベント行をロックし、同じイベントへの参加登録を直列化する（複数レプリカでも定員を守る）
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    IF v_event.start_date < NOW() THEN
+        RETURN jsonb_build_object('status', 'event_started', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- ユーザーの取得または作成
+    SELECT id INTO v_user_id
+    FROM public.users
+    WHERE line_user_id = p_line_user_id;
+
+    IF v_user_id IS NULL THEN
+        IF p_display_name IS NULL THEN
+            RETURN jsonb_build_object('status', 'profile_required', 'event', to_jsonb(v_event));
+        END IF;
+
+        INSERT INTO public.users (line_user_id, name)
+        VALUES (p_line_user_id, p_display_name)
+        ON CONFLICT (line_user_id) DO UPDATE SET line_user_id = EXCLUDED.line_user_id
+        RETURNING id INTO v_user_id;
+    END IF;
+
+    -- 重複参加チェック
+    IF EXISTS (
+        SELECT 1 FROM public.participants
+        WHERE event_id = v_event.id AND user_id = v_user_id
+    ) THEN
+        RETURN jsonb_build_object('status', 'already_registered', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 定員チェック
+    SELECT COUNT(*) INTO v_participant_count
+    FROM public.participants
+    WHERE event_id = v_event.id;
+
+    IF v_event.max_participants IS NOT NULL AND v_participant_count >= v_event.max_participants THEN
+        RETURN jsonb_build_object('status', 'event_full', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 参加登録
+    INSERT INTO public.participants (event_id, user_id, status)
+    VALUES (v_event.id, v_user_id, 'registered');
+
+    RETURN jsonb_build_object(
+        'status', 'joined',
+        'event', to_jsonb(v_event),
+        'participant_count', v_participant_count + 1
+    );
+END;
+$$ LANGUAGE plpgsql;
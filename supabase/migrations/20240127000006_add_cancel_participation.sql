@@ -0,0 +1,59 @@
+-- イベント参加のキャンセルをまとめて行う関数
+-- 参加登録の削除、参加者数の集計、参加者が0人になった場合のステータス更新を1つのトランザクションで行う
+--   cancelled: キャンセル完了 / event_not_found: イベントなし
+--   user_not_found: 未登録ユーザー / not_registered: 参加登録なし
+CREATE OR REPLACE FUNCTION cancel_participation(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_user_id UUID;
+    v_participant_count INTEGER;
+BEGIN
+    -- イベント行をロックし、同時キャンセル時の集計とステータス更新を直列化する
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    SELECT id INTO v_user_id
+    FROM public.users
+    WHERE line_user_id = p_line_user_id;
+
+    IF v_user_id IS NULL THEN
+        RETURN jsonb_build_object('status', 'user_not_found', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 参加登録の削除
+    DELETE FROM public.participants
+    WHERE event_id = v_event.id AND user_id = v_user_id;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'not_registered', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 参加者数の確認
+    SELECT COUNT(*) INTO v_participant_count
+    FROM public.participants
+    WHERE event_id = v_event.id;
+
+    -- 参加者が0人になった場合、イベントのステータスを更新
+    IF v_participant_count = 0 THEN
+        UPDATE public.events
+        SET status = 'pending'
+        WHERE id = v_event.id
+        RETURNING * INTO v_event;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'cancelled',
+        'event', to_jsonb(v_event),
+        'participant_count', v_participant_count
+    );
+END;
+$$ LANGUAGE plpgsql;
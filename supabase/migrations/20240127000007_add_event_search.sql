@@ -0,0 +1,56 @@
+-- イベント検索用のn-gramインデックスと検索関数
+-- 名前・説明・場所を正規化（NFKC・小文字化）した検索用カラムを持ち、部分一致をGINインデックスで検索する
+
+-- 検索用テキスト（名前・説明・場所を連結して正規化）
+ALTER TABLE public.events
+    ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+        lower(normalize(
+            coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(location, ''),
+            NFKC
+        ))
+    ) STORED;
+
+-- 日本語の短い語句も索引できるpg_bigm（2-gram）を優先し、使えない環境ではpg_trgmを使う
+-- pg_trgmは3文字未満の語句にはインデックスが効かず、マルチバイト文字の扱いはDBのロケールに依存する
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_bigm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_bigm;
+        EXECUTE 'CREATE INDEX IF NOT EXISTS idx_events_search_text ON public.events USING gin (search_text gin_bigm_ops)';
+    ELSE
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXECUTE 'CREATE INDEX IF NOT EXISTS idx_events_search_text ON public.events USING gin (search_text gin_trgm_ops)';
+    END IF;
+END $$;
+
+-- 開始前の予定済みイベントの検索
+-- 空白区切りの語句をすべて含むイベントを、一致した項目の重み（名前3・場所2・説明1）の合計が高い順に返す
+-- 同点は開始日時順。件数は1〜50件に制限する（database/search.pyのEventSearchIndexと同じ順位付け）
+CREATE OR REPLACE FUNCTION search_events(
+    p_query TEXT,
+    p_limit INTEGER DEFAULT 10
+) RETURNS SETOF public.events AS $$
+    WITH terms AS (
+        -- LIKEの特殊文字をエスケープした部分一致パターン
+        SELECT '%' || replace(replace(replace(term, '\', '\\'), '%', '\%'), '_', '\_') || '%' AS pattern,
+               length(term) AS term_length
+        FROM regexp_split_to_table(lower(normalize(coalesce(p_query, ''), NFKC)), '\s+') AS term
+        WHERE term <> ''
+    )
+    SELECT e.*
+    FROM public.events e
+    WHERE e.status = 'scheduled'
+      AND e.start_date >= NOW()
+      -- 最も長い語句でインデックスを引き、残りの語句は行ごとに確認する
+      AND e.search_text LIKE (SELECT pattern FROM terms ORDER BY term_length DESC LIMIT 1)
+      AND NOT EXISTS (SELECT 1 FROM terms t WHERE e.search_text NOT LIKE t.pattern)
+    ORDER BY (
+        SELECT SUM(
+            CASE WHEN lower(normalize(e.name, NFKC)) LIKE t.pattern THEN 3 ELSE 0 END
+          + CASE WHEN lower(normalize(coalesce(e.location, ''), NFKC)) LIKE t.pattern THEN 2 ELSE 0 END
+          + CASE WHEN lower(normalize(coalesce(e.description, ''), NFKC)) LIKE t.pattern THEN 1 ELSE 0 END
+        )
+        FROM terms t
+    ) DESC, e.start_date, e.id
+    LIMIT LEAST(GREATEST(coalesce(p_limit, 10), 1), 50);
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,4 @@
+-- イベント作成者（DiscordのユーザーID）
+-- Discord Botは予定イベントをevent_idで一括upsertするため、書き込む列はすべてテーブルに存在する必要がある
+ALTER TABLE public.events
+    ADD COLUMN IF NOT EXISTS created_by VARCHAR(255);
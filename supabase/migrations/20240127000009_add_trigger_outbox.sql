@@ -0,0 +1,66 @@
+-- triggersテーブルをLINEへの通知のアウトボックスとして読み進める位置（コンシューマーごと）
+-- リースを持つ1つのワーカーだけが配信し、(created_at, id)の順に読み進める
+CREATE TABLE IF NOT EXISTS public.trigger_outbox_cursors (
+    consumer VARCHAR(100) PRIMARY KEY,
+    last_created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_trigger_id UUID NOT NULL,
+    lease_owner VARCHAR(255),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW())
+);
+
+-- インデックスの作成（キーセットでの読み進め用）
+CREATE INDEX IF NOT EXISTS idx_triggers_created_at_id ON triggers(created_at, id);
+
+-- RLSを有効化
+ALTER TABLE public.trigger_outbox_cursors ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "trigger_outbox_cursors_read_policy" ON public.trigger_outbox_cursors
+    FOR SELECT USING (true);
+
+CREATE POLICY "trigger_outbox_cursors_insert_policy" ON public.trigger_outbox_cursors
+    FOR INSERT WITH CHECK (true);
+
+CREATE POLICY "trigger_outbox_cursors_update_policy" ON public.trigger_outbox_cursors
+    FOR UPDATE USING (true);
+
+-- アウトボックスのリースを取得し、読み進める位置を返す（他のワーカーがリース中なら行を返さない）
+-- 初回は現在時刻から読み始める（導入前のトリガーはまとめて配信しない）
+CREATE OR REPLACE FUNCTION acquire_trigger_outbox(
+    p_consumer VARCHAR,
+    p_owner VARCHAR,
+    p_lease_seconds INTEGER DEFAULT 60
+) RETURNS SETOF public.trigger_outbox_cursors AS $$
+BEGIN
+    INSERT INTO public.trigger_outbox_cursors (consumer, last_created_at, last_trigger_id)
+    VALUES (p_consumer, NOW(), '00000000-0000-0000-0000-000000000000')
+    ON CONFLICT (consumer) DO NOTHING;
+
+    RETURN QUERY
+    UPDATE public.trigger_outbox_cursors
+    SET lease_owner = p_owner,
+        lease_expires_at = NOW() + make_interval(secs => p_lease_seconds)
+    WHERE consumer = p_consumer
+      AND (lease_owner IS NULL OR lease_owner = p_owner OR lease_expires_at < NOW())
+    RETURNING *;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 配信済みの位置まで読み進める（リースを持つワーカーのみ）
+CREATE OR REPLACE FUNCTION advance_trigger_outbox(
+    p_consumer VARCHAR,
+    p_owner VARCHAR,
+    p_created_at TIMESTAMP WITH TIME ZONE,
+    p_trigger_id UUID
+) RETURNS BOOLEAN AS $$
+    WITH advanced AS (
+        UPDATE public.trigger_outbox_cursors
+        SET last_created_at = p_created_at,
+            last_trigger_id = p_trigger_id,
+            updated_at = NOW()
+        WHERE consumer = p_consumer
+          AND lease_owner = p_owner
+        RETURNING 1
+    )
+    SELECT EXISTS (SELECT 1 FROM advanced);
+$$ LANGUAGE sql;
@@ -0,0 +1,138 @@
+-- 参加・キャンセルでLINE Bot側でキャッシュしたユーザーIDを受け取り、usersの検索を省略する
+-- 結果にはユーザーIDを含め、次回以降の呼び出しでキャッシュから渡せるようにする
+DROP FUNCTION IF EXISTS join_event(VARCHAR, VARCHAR, VARCHAR);
+DROP FUNCTION IF EXISTS cancel_participation(VARCHAR, VARCHAR);
+
+CREATE OR REPLACE FUNCTION join_event(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_display_name VARCHAR DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_user_id UUID := p_user_id;
+    v_participant_count INTEGER;
+BEGIN
+    -- イベント行をロックし、同じイベントへの参加登録を直列化する（複数レプリカでも定員を守る）
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    IF v_event.start_date < NOW() THEN
+        RETURN jsonb_build_object('status', 'event_started', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- ユーザーの取得または作成（ユーザーIDが渡された場合は検索しない）
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        IF p_display_name IS NULL THEN
+            RETURN jsonb_build_object('status', 'profile_required', 'event', to_jsonb(v_event));
+        END IF;
+
+        INSERT INTO public.users (line_user_id, name)
+        VALUES (p_line_user_id, p_display_name)
+        ON CONFLICT (line_user_id) DO UPDATE SET line_user_id = EXCLUDED.line_user_id
+        RETURNING id INTO v_user_id;
+    END IF;
+
+    -- 重複参加チェック
+    IF EXISTS (
+        SELECT 1 FROM public.participants
+        WHERE event_id = v_event.id AND user_id = v_user_id
+    ) THEN
+        RETURN jsonb_build_object('status', 'already_registered', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- 定員チェック
+    SELECT COUNT(*) INTO v_participant_count
+    FROM public.participants
+    WHERE event_id = v_event.id;
+
+    IF v_event.max_participants IS NOT NULL AND v_participant_count >= v_event.max_participants THEN
+        RETURN jsonb_build_object('status', 'event_full', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- 参加登録（存在しないユーザーIDは外部キー制約でエラーになる）
+    INSERT INTO public.participants (event_id, user_id, status)
+    VALUES (v_event.id, v_user_id, 'registered');
+
+    RETURN jsonb_build_object(
+        'status', 'joined',
+        'event', to_jsonb(v_event),
+        'participant_count', v_participant_count + 1,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION cancel_participation(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_user_id UUID := p_user_id;
+    v_participant_count INTEGER;
+BEGIN
+    -- イベント行をロックし、同時キャンセル時の集計とステータス更新を直列化する
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    -- ユーザーIDが渡された場合は検索しない
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        RETURN jsonb_build_object('status', 'user_not_found', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 参加登録の削除
+    DELETE FROM public.participants
+    WHERE event_id = v_event.id AND user_id = v_user_id;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'not_registered', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- 参加者数の確認
+    SELECT COUNT(*) INTO v_participant_count
+    FROM public.participants
+    WHERE event_id = v_event.id;
+
+    -- 参加者が0人になった場合、イベントのステータスを更新
+    IF v_participant_count = 0 THEN
+        UPDATE public.events
+        SET status = 'pending'
+        WHERE id = v_event.id
+        RETURNING * INTO v_event;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'cancelled',
+        'event', to_jsonb(v_event),
+        'participant_count', v_participant_count,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,3 @@
+-- イベントごとの参加者を登録順にページ単位で読むためのインデックス
+CREATE INDEX IF NOT EXISTS idx_participants_event_registered_at
+    ON participants(event_id, registered_at, id);
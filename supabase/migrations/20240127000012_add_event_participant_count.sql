@@ -0,0 +1,188 @@
+-- イベントの参加者数をeventsに保持し、participantsの追加・削除時にトリガーで更新する
+-- 参加者数・定員チェック・参加者0人でのpendingへの変更を、participantsの集計なしに行えるようにする
+ALTER TABLE public.events
+    ADD COLUMN IF NOT EXISTS participant_count INTEGER NOT NULL DEFAULT 0;
+
+-- 既存の参加者数を反映
+UPDATE public.events e
+SET participant_count = counts.participant_count
+FROM (
+    SELECT event_id, COUNT(*) AS participant_count
+    FROM public.participants
+    GROUP BY event_id
+) counts
+WHERE e.id = counts.event_id;
+
+-- participantsの変更に合わせて参加者数を増減する
+CREATE OR REPLACE FUNCTION update_event_participant_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE public.events
+        SET participant_count = participant_count - 1
+        WHERE id = OLD.event_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.events
+        SET participant_count = participant_count + 1
+        WHERE id = NEW.event_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS participants_count_trigger ON public.participants;
+CREATE TRIGGER participants_count_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF event_id ON public.participants
+    FOR EACH ROW
+    EXECUTE FUNCTION update_event_participant_count();
+
+-- 参加者数の更新ではリマインダーの更新を行わない（ステータス・開始日時の変更時のみ）
+DROP TRIGGER IF EXISTS update_reminders_after_event_update ON public.events;
+CREATE TRIGGER update_reminders_after_event_update
+    AFTER UPDATE OF status, start_date ON public.events
+    FOR EACH ROW
+    EXECUTE FUNCTION update_reminders_on_event();
+
+-- 参加者数は列から読む（集計しない）
+DROP VIEW IF EXISTS public.active_events;
+CREATE VIEW public.active_events AS
+SELECT e.*
+FROM events e
+WHERE e.status = 'scheduled';
+
+-- 定員チェックは保持している参加者数で行う
+CREATE OR REPLACE FUNCTION join_event(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_display_name VARCHAR DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_user_id UUID := p_user_id;
+BEGIN
+    -- イベント行をロックし、同じイベントへの参加登録を直列化する（複数レプリカでも定員を守る）
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    IF v_event.start_date < NOW() THEN
+        RETURN jsonb_build_object('status', 'event_started', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- ユーザーの取得または作成（ユーザーIDが渡された場合は検索しない）
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        IF p_display_name IS NULL THEN
+            RETURN jsonb_build_object('status', 'profile_required', 'event', to_jsonb(v_event));
+        END IF;
+
+        INSERT INTO public.users (line_user_id, name)
+        VALUES (p_line_user_id, p_display_name)
+        ON CONFLICT (line_user_id) DO UPDATE SET line_user_id = EXCLUDED.line_user_id
+        RETURNING id INTO v_user_id;
+    END IF;
+
+    -- 重複参加チェック
+    IF EXISTS (
+        SELECT 1 FROM public.participants
+        WHERE event_id = v_event.id AND user_id = v_user_id
+    ) THEN
+        RETURN jsonb_build_object('status', 'already_registered', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- 定員チェック
+    IF v_event.max_participants IS NOT NULL AND v_event.participant_count >= v_event.max_participants THEN
+        RETURN jsonb_build_object('status', 'event_full', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- 参加登録（存在しないユーザーIDは外部キー制約でエラーになる）
+    INSERT INTO public.participants (event_id, user_id, status)
+    VALUES (v_event.id, v_user_id, 'registered');
+
+    -- トリガーで更新された参加者数を含むイベント行
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE id = v_event.id;
+
+    RETURN jsonb_build_object(
+        'status', 'joined',
+        'event', to_jsonb(v_event),
+        'participant_count', v_event.participant_count,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- 参加者数は保持している値を読む
+CREATE OR REPLACE FUNCTION cancel_participation(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_user_id UUID := p_user_id;
+BEGIN
+    -- イベント行をロックし、同時キャンセル時の集計とステータス更新を直列化する
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    -- ユーザーIDが渡された場合は検索しない
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        RETURN jsonb_build_object('status', 'user_not_found', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 参加登録の削除
+    DELETE FROM public.participants
+    WHERE event_id = v_event.id AND user_id = v_user_id;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'not_registered', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- トリガーで更新された参加者数を読み、0人になった場合はイベントのステータスを更新
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE id = v_event.id;
+
+    IF v_event.participant_count = 0 THEN
+        UPDATE public.events
+        SET status = 'pending'
+        WHERE id = v_event.id
+        RETURNING * INTO v_event;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'cancelled',
+        'event', to_jsonb(v_event),
+        'participant_count', v_event.participant_count,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
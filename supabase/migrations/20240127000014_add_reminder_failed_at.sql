@@ -0,0 +1,46 @@
+-- 再試行の上限まで送信に失敗したリマインダーを記録し、以降は割り当てない
+ALTER TABLE public.reminders
+    ADD COLUMN IF NOT EXISTS failed_at TIMESTAMP WITH TIME ZONE;
+
+-- 送信済み・失敗済みのリマインダーはインデックスの対象外
+DROP INDEX IF EXISTS idx_reminders_lease;
+CREATE INDEX idx_reminders_lease ON reminders(scheduled_at, lease_expires_at) WHERE sent_at IS NULL AND failed_at IS NULL;
+
+-- 失敗済みのリマインダーを除いて割り当てる
+CREATE OR REPLACE FUNCTION claim_due_reminders(
+    p_worker_id VARCHAR,
+    p_batch_size INTEGER DEFAULT 100,
+    p_lease_seconds INTEGER DEFAULT 300,
+    p_lookahead_seconds INTEGER DEFAULT 300
+) RETURNS TABLE (
+    id UUID,
+    event_id UUID,
+    reminder_type VARCHAR,
+    scheduled_at TIMESTAMP WITH TIME ZONE,
+    events JSONB
+) AS $$
+    WITH due AS (
+        SELECT r.id
+        FROM public.reminders r
+        JOIN public.events e ON e.id = r.event_id
+        WHERE r.sent_at IS NULL
+          AND r.failed_at IS NULL
+          AND e.status = 'scheduled'
+          AND r.scheduled_at <= NOW() + make_interval(secs => p_lookahead_seconds)
+          AND (r.lease_expires_at IS NULL OR r.lease_expires_at < NOW())
+        ORDER BY r.scheduled_at
+        LIMIT p_batch_size
+        FOR UPDATE OF r SKIP LOCKED
+    ), claimed AS (
+        UPDATE public.reminders r
+        SET claimed_by = p_worker_id,
+            lease_expires_at = NOW() + make_interval(secs => p_lease_seconds)
+        FROM due
+        WHERE r.id = due.id
+        RETURNING r.id, r.event_id, r.reminder_type, r.scheduled_at
+    )
+    SELECT c.id, c.event_id, c.reminder_type, c.scheduled_at, to_jsonb(e) AS events
+    FROM claimed c
+    JOIN public.events e ON e.id = c.event_id
+    ORDER BY c.scheduled_at;
+$$ LANGUAGE sql;
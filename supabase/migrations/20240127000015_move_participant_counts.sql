@@ -0,0 +1,267 @@
+-- 参加者数・キャンセル待ちの人数をeventsから別テーブルに移す
+-- eventsの行を更新しないため、参加・キャンセルのたびにupdated_atが変わったり検索用カラム（search_text）が再計算されたりしない
+-- 参加登録の直列化もこのテーブルの行ロックで行い、Discordからのイベント更新と競合しないようにする
+CREATE TABLE IF NOT EXISTS public.event_participant_counts (
+    event_id UUID PRIMARY KEY REFERENCES public.events(id) ON DELETE CASCADE,
+    participant_count INTEGER NOT NULL DEFAULT 0,
+    waitlist_count INTEGER NOT NULL DEFAULT 0
+);
+
+ALTER TABLE public.event_participant_counts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "event_participant_counts_read_policy" ON public.event_participant_counts
+    FOR SELECT USING (true);
+
+-- トリガー（参加・キャンセルを行うロールの権限で実行）からの作成・更新と、join_event等での行ロックに必要
+CREATE POLICY "event_participant_counts_insert_policy" ON public.event_participant_counts
+    FOR INSERT WITH CHECK (true);
+
+CREATE POLICY "event_participant_counts_update_policy" ON public.event_participant_counts
+    FOR UPDATE USING (true);
+
+-- 既存の人数を反映
+INSERT INTO public.event_participant_counts (event_id, participant_count, waitlist_count)
+SELECT id, participant_count, waitlist_count
+FROM public.events
+ON CONFLICT (event_id) DO NOTHING;
+
+-- イベントの作成時に人数の行を作成する
+CREATE OR REPLACE FUNCTION create_event_participant_counts()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.event_participant_counts (event_id)
+    VALUES (NEW.id)
+    ON CONFLICT (event_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS create_event_participant_counts_trigger ON public.events;
+CREATE TRIGGER create_event_participant_counts_trigger
+    AFTER INSERT ON public.events
+    FOR EACH ROW
+    EXECUTE FUNCTION create_event_participant_counts();
+
+-- participantsの変更に合わせてステータスごとの人数を増減する
+CREATE OR REPLACE FUNCTION update_event_participant_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE public.event_participant_counts
+        SET participant_count = participant_count - (OLD.status = 'registered')::INTEGER,
+            waitlist_count = waitlist_count - (OLD.status = 'waitlisted')::INTEGER
+        WHERE event_id = OLD.event_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.event_participant_counts
+        SET participant_count = participant_count + (NEW.status = 'registered')::INTEGER,
+            waitlist_count = waitlist_count + (NEW.status = 'waitlisted')::INTEGER
+        WHERE event_id = NEW.event_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 参加者数は人数のテーブルから読む
+DROP VIEW IF EXISTS public.active_events;
+ALTER TABLE public.events
+    DROP COLUMN IF EXISTS participant_count,
+    DROP COLUMN IF EXISTS waitlist_count;
+
+CREATE VIEW public.active_events AS
+SELECT e.*, COALESCE(c.participant_count, 0) AS participant_count
+FROM events e
+LEFT JOIN event_participant_counts c ON c.event_id = e.id
+WHERE e.status = 'scheduled';
+
+-- 参加登録（定員に達している場合はキャンセル待ちに登録）
+--   joined: 参加登録完了 / waitlisted: キャンセル待ちに登録（waitlist_positionに順番）
+--   already_registered: 登録済み / already_waitlisted: キャンセル待ち登録済み
+CREATE OR REPLACE FUNCTION join_event(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_display_name VARCHAR DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_counts public.event_participant_counts%ROWTYPE;
+    v_user_id UUID := p_user_id;
+    v_status VARCHAR;
+BEGIN
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    IF v_event.start_date < NOW() THEN
+        RETURN jsonb_build_object('status', 'event_started', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- ユーザーの取得または作成（ユーザーIDが渡された場合は検索しない）
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        IF p_display_name IS NULL THEN
+            RETURN jsonb_build_object('status', 'profile_required', 'event', to_jsonb(v_event));
+        END IF;
+
+        INSERT INTO public.users (line_user_id, name)
+        VALUES (p_line_user_id, p_display_name)
+        ON CONFLICT (line_user_id) DO UPDATE SET line_user_id = EXCLUDED.line_user_id
+        RETURNING id INTO v_user_id;
+    END IF;
+
+    -- 人数の行をロックし、同じイベントへの参加登録を直列化する（複数レプリカでも定員を守る）
+    SELECT * INTO v_counts
+    FROM public.event_participant_counts
+    WHERE event_id = v_event.id
+    FOR UPDATE;
+
+    -- 重複参加チェック
+    SELECT status INTO v_status
+    FROM public.participants
+    WHERE event_id = v_event.id AND user_id = v_user_id;
+
+    IF FOUND THEN
+        RETURN jsonb_build_object(
+            'status', CASE WHEN v_status = 'waitlisted' THEN 'already_waitlisted' ELSE 'already_registered' END,
+            'event', to_jsonb(v_event),
+            'user_id', v_user_id
+        );
+    END IF;
+
+    -- 定員チェック（保持している参加者数で判定し、超える場合はキャンセル待ち）
+    IF v_event.max_participants IS NOT NULL AND v_counts.participant_count >= v_event.max_participants THEN
+        v_status := 'waitlisted';
+    ELSE
+        v_status := 'registered';
+    END IF;
+
+    -- 参加登録（存在しないユーザーIDは外部キー制約でエラーになる）
+    INSERT INTO public.participants (event_id, user_id, status)
+    VALUES (v_event.id, v_user_id, v_status);
+
+    -- トリガーで更新された人数
+    SELECT * INTO v_counts
+    FROM public.event_participant_counts
+    WHERE event_id = v_event.id;
+
+    IF v_status = 'waitlisted' THEN
+        RETURN jsonb_build_object(
+            'status', 'waitlisted',
+            'event', to_jsonb(v_event),
+            'waitlist_position', v_counts.waitlist_count,
+            'user_id', v_user_id
+        );
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'joined',
+        'event', to_jsonb(v_event),
+        'participant_count', v_counts.participant_count,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- 参加のキャンセル（参加確定者のキャンセルで空いた枠はキャンセル待ちの先頭を繰り上げる）
+--   cancelled: キャンセル完了（was_waitlistedでキャンセル待ちの取り消しか、promoted_line_user_idで繰り上げたユーザーを返す）
+CREATE OR REPLACE FUNCTION cancel_participation(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_counts public.event_participant_counts%ROWTYPE;
+    v_user_id UUID := p_user_id;
+    v_status VARCHAR;
+    v_promoted_user_id UUID;
+    v_promoted_line_user_id VARCHAR;
+BEGIN
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    -- ユーザーIDが渡された場合は検索しない
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        RETURN jsonb_build_object('status', 'user_not_found', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- 人数の行をロックし、同時キャンセル時の繰り上げとステータス更新を直列化する
+    SELECT * INTO v_counts
+    FROM public.event_participant_counts
+    WHERE event_id = v_event.id
+    FOR UPDATE;
+
+    -- 参加登録の削除
+    DELETE FROM public.participants
+    WHERE event_id = v_event.id AND user_id = v_user_id
+    RETURNING status INTO v_status;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'not_registered', 'event', to_jsonb(v_event), 'user_id', v_user_id);
+    END IF;
+
+    -- 参加確定者のキャンセルで定員に空きができた場合、キャンセル待ちの先頭を繰り上げる
+    IF v_status = 'registered'
+        AND v_counts.waitlist_count > 0
+        AND (v_event.max_participants IS NULL OR v_counts.participant_count - 1 < v_event.max_participants)
+    THEN
+        UPDATE public.participants
+        SET status = 'registered'
+        WHERE id = (
+            SELECT id FROM public.participants
+            WHERE event_id = v_event.id AND status = 'waitlisted'
+            ORDER BY registered_at, id
+            LIMIT 1
+        )
+        RETURNING user_id INTO v_promoted_user_id;
+
+        SELECT line_user_id INTO v_promoted_line_user_id
+        FROM public.users
+        WHERE id = v_promoted_user_id;
+    END IF;
+
+    -- トリガーで更新された人数を読み、0人になった場合はイベントのステータスを更新
+    SELECT * INTO v_counts
+    FROM public.event_participant_counts
+    WHERE event_id = v_event.id;
+
+    IF v_counts.participant_count = 0 AND v_counts.waitlist_count = 0 THEN
+        UPDATE public.events
+        SET status = 'pending'
+        WHERE id = v_event.id
+        RETURNING * INTO v_event;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'cancelled',
+        'event', to_jsonb(v_event),
+        'participant_count', v_counts.participant_count,
+        'was_waitlisted', v_status = 'waitlisted',
+        'promoted_line_user_id', v_promoted_line_user_id,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
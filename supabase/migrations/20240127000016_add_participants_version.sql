@@ -0,0 +1,69 @@
+-- 参加者が変わるたびに増える版数を人数の行に持ち、割り当てたリマインダーのイベントと一緒に返す
+-- リマインダースケジューラーは送信先のキャッシュをこの版数で検証し、別プロセスでの参加・キャンセルを反映する
+ALTER TABLE public.event_participant_counts
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+-- participantsの変更に合わせてステータスごとの人数を増減し、版数を進める
+CREATE OR REPLACE FUNCTION update_event_participant_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE public.event_participant_counts
+        SET participant_count = participant_count - (OLD.status = 'registered')::INTEGER,
+            waitlist_count = waitlist_count - (OLD.status = 'waitlisted')::INTEGER,
+            version = version + 1
+        WHERE event_id = OLD.event_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.event_participant_counts
+        SET participant_count = participant_count + (NEW.status = 'registered')::INTEGER,
+            waitlist_count = waitlist_count + (NEW.status = 'waitlisted')::INTEGER,
+            version = version + 1
+        WHERE event_id = NEW.event_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- イベントの行に参加者の版数（participants_version）を加えて返す
+CREATE OR REPLACE FUNCTION claim_due_reminders(
+    p_worker_id VARCHAR,
+    p_batch_size INTEGER DEFAULT 100,
+    p_lease_seconds INTEGER DEFAULT 300,
+    p_lookahead_seconds INTEGER DEFAULT 300
+) RETURNS TABLE (
+    id UUID,
+    event_id UUID,
+    reminder_type VARCHAR,
+    scheduled_at TIMESTAMP WITH TIME ZONE,
+    events JSONB
+) AS $$
+    WITH due AS (
+        SELECT r.id
+        FROM public.reminders r
+        JOIN public.events e ON e.id = r.event_id
+        WHERE r.sent_at IS NULL
+          AND r.failed_at IS NULL
+          AND e.status = 'scheduled'
+          AND r.scheduled_at <= NOW() + make_interval(secs => p_lookahead_seconds)
+          AND (r.lease_expires_at IS NULL OR r.lease_expires_at < NOW())
+        ORDER BY r.scheduled_at
+        LIMIT p_batch_size
+        FOR UPDATE OF r SKIP LOCKED
+    ), claimed AS (
+        UPDATE public.reminders r
+        SET claimed_by = p_worker_id,
+            lease_expires_at = NOW() + make_interval(secs => p_lease_seconds)
+        FROM due
+        WHERE r.id = due.id
+        RETURNING r.id, r.event_id, r.reminder_type, r.scheduled_at
+    )
+    SELECT c.id, c.event_id, c.reminder_type, c.scheduled_at,
+           to_jsonb(e) || jsonb_build_object('participants_version', COALESCE(pc.version, 0)) AS events
+    FROM claimed c
+    JOIN public.events e ON e.id = c.event_id
+    LEFT JOIN public.event_participant_counts pc ON pc.event_id = c.event_id
+    ORDER BY c.scheduled_at;
+$$ LANGUAGE sql;
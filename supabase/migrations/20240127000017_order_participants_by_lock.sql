@@ -0,0 +1,101 @@
+-- 参加者の登録日時をトランザクションの開始時刻（NOW()）ではなく、人数の行をロックした後の時刻にする
+-- 同時に参加した場合もキャンセル待ちの繰り上げ順（registered_at, id）がwaitlist_positionの順番と一致する
+
+-- 参加登録（定員に達している場合はキャンセル待ちに登録）
+--   joined: 参加登録完了 / waitlisted: キャンセル待ちに登録（waitlist_positionに順番）
+--   already_registered: 登録済み / already_waitlisted: キャンセル待ち登録済み
+CREATE OR REPLACE FUNCTION join_event(
+    p_event_id VARCHAR,
+    p_line_user_id VARCHAR,
+    p_display_name VARCHAR DEFAULT NULL,
+    p_user_id UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_event public.events%ROWTYPE;
+    v_counts public.event_participant_counts%ROWTYPE;
+    v_user_id UUID := p_user_id;
+    v_status VARCHAR;
+BEGIN
+    SELECT * INTO v_event
+    FROM public.events
+    WHERE event_id = p_event_id;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'event_not_found');
+    END IF;
+
+    IF v_event.start_date < NOW() THEN
+        RETURN jsonb_build_object('status', 'event_started', 'event', to_jsonb(v_event));
+    END IF;
+
+    -- ユーザーの取得または作成（ユーザーIDが渡された場合は検索しない）
+    IF v_user_id IS NULL THEN
+        SELECT id INTO v_user_id
+        FROM public.users
+        WHERE line_user_id = p_line_user_id;
+    END IF;
+
+    IF v_user_id IS NULL THEN
+        IF p_display_name IS NULL THEN
+            RETURN jsonb_build_object('status', 'profile_required', 'event', to_jsonb(v_event));
+        END IF;
+
+        INSERT INTO public.users (line_user_id, name)
+        VALUES (p_line_user_id, p_display_name)
+        ON CONFLICT (line_user_id) DO UPDATE SET line_user_id = EXCLUDED.line_user_id
+        RETURNING id INTO v_user_id;
+    END IF;
+
+    -- 人数の行をロックし、同じイベントへの参加登録を直列化する（複数レプリカでも定員を守る）
+    SELECT * INTO v_counts
+    FROM public.event_participant_counts
+    WHERE event_id = v_event.id
+    FOR UPDATE;
+
+    -- 重複参加チェック
+    SELECT status INTO v_status
+    FROM public.participants
+    WHERE event_id = v_event.id AND user_id = v_user_id;
+
+    IF FOUND THEN
+        RETURN jsonb_build_object(
+            'status', CASE WHEN v_status = 'waitlisted' THEN 'already_waitlisted' ELSE 'already_registered' END,
+            'event', to_jsonb(v_event),
+            'user_id', v_user_id
+        );
+    END IF;
+
+    -- 定員チェック（保持している参加者数で判定し、超える場合はキャンセル待ち）
+    IF v_event.max_participants IS NOT NULL AND v_counts.participant_count >= v_event.max_participants THEN
+        v_status := 'waitlisted';
+    ELSE
+        v_status := 'registered';
+    END IF;
+
+    -- 参加登録（存在しないユーザーIDは外部キー制約でエラーになる）
+    -- 登録日時はロックの取得後の時刻にし、キャンセル待ちの繰り上げ順を返した順番と一致させる
+    INSERT INTO public.participants (event_id, user_id, status, registered_at)
+    VALUES (v_event.id, v_user_id, v_status, clock_timestamp());
+
+    -- トリガーで更新された人数
+    SELECT * INTO v_counts
+    FROM public.event_participant_counts
+    WHERE event_id = v_event.id;
+
+    IF v_status = 'waitlisted' THEN
+        RETURN jsonb_build_object(
+            'status', 'waitlisted',
+            'event', to_jsonb(v_event),
+            'waitlist_position', v_counts.waitlist_count,
+            'user_id', v_user_id
+        );
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'joined',
+        'event', to_jsonb(v_event),
+        'participant_count', v_counts.participant_count,
+        'user_id', v_user_id
+    );
+END;
+$$ LANGUAGE plpgsql;
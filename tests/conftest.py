@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 import os
 import asyncio
 from dotenv import load_dotenv
@@ -8,6 +8,20 @@ from datetime import datetime, timezone, timedelta
 # テスト用の環境変数を読み込む
 load_dotenv('.env.test')
 
+@pytest.fixture(autouse=True)
+def clear_shared_caches():
+    """Clear process-wide caches between tests"""
+    from reminder.recipients import recipient_cache
+    from database.cache import upcoming_events_cache, event_record_cache
+    from database.search import event_search_index
+    from line_bot.users import line_user_cache
+    recipient_cache.clear()
+    upcoming_events_cache.clear()
+    event_record_cache.clear()
+    event_search_index.clear()
+    line_user_cache.clear()
+    yield
+
 @pytest.fixture
 def event_data():
     """Sample event data for tests"""
@@ -73,6 +87,22 @@ def mock_supabase():
     mock.context = MagicMock
     return mock
 
+@pytest.fixture
+def mock_repository():
+    """Mock async Supabase repository"""
+    from database.repository import Repository
+    mock = AsyncMock(spec=Repository)
+    mock.get_event.return_value = None
+    mock.list_upcoming_events.return_value = []
+    mock.count_upcoming_events.return_value = 0
+    mock.search_events.return_value = []
+    mock.list_participant_line_ids.return_value = []
+    mock.list_participant_names.return_value = []
+    mock.claim_due_reminders.return_value = []
+    mock.list_pending_reminders.return_value = []
+    mock.list_event_reminders.return_value = []
+    return mock
+
 @pytest.fixture
 def mock_line_bot():
     """Mock LINE Bot client"""
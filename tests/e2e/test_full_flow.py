@@ -11,6 +11,7 @@ from fastapi.testclient import TestClient
 import discord
 from linebot.models import TextSendMessage
 from discord_bot.bot import EventCommands
+from database.repository import Repository
 
 @pytest.mark.e2e
 class TestFullFlow:
@@ -34,7 +35,7 @@ class TestFullFlow:
         """Set up Discord bot mock"""
         mock_bot = MagicMock()
         mock_bot.send_message = AsyncMock()
-        mock_bot.supabase = MagicMock()
+        mock_bot.repository = AsyncMock()
         return mock_bot
 
     def create_mock_query_chain(self, result):
@@ -46,7 +47,7 @@ class TestFullFlow:
         mock_chain.lte.return_value = mock_chain
         mock_chain.order.return_value = mock_chain
         mock_chain.range.return_value = mock_chain
-        mock_chain.execute.return_value = MagicMock(data=result, count=len(result))
+        mock_chain.execute = AsyncMock(return_value=MagicMock(data=result, count=len(result)))
 
         # deleteとupdateのモックを設定
         mock_delete = MagicMock()
@@ -94,6 +95,8 @@ class TestFullFlow:
         mock_table = MagicMock(side_effect=get_table)
         mock_table.table_calls = table_calls
         mock_supabase.table = mock_table
+        # PostgRESTクライアント（リポジトリ経由）のテーブル選択
+        mock_supabase.from_ = mock_table
 
         # イベントコマンド実行時のリマインダーテーブル呼び出しを設定
         def execute_with_reminder():
@@ -128,10 +131,10 @@ class TestFullFlow:
 
         # Supabaseのモックを設定
         mock_supabase = self.setup_mock_tables(mock_supabase, event_data)
-        mock_discord_bot.supabase = mock_supabase
+        mock_discord_bot.repository = Repository(mock_supabase)
 
         with patch('line_bot.app.line_bot_api', mock_line_bot_api), \
-             patch('line_bot.app.supabase', mock_supabase), \
+             patch('line_bot.app.repository', mock_supabase), \
              patch('linebot.webhook.WebhookHandler.handle', return_value=True), \
              patch('reminder.scheduler.ReminderScheduler.process_reminders', new_callable=AsyncMock) as mock_process:
 
@@ -213,7 +216,7 @@ class TestFullFlow:
 
         # Supabaseのモックを設定
         mock_supabase = self.setup_mock_tables(mock_supabase, event_data)
-        mock_discord_bot.supabase = mock_supabase
+        mock_discord_bot.repository = Repository(mock_supabase)
 
         # イベントのキャンセル処理をモック
         async def handle_event_info(self, ctx, event_id):
@@ -226,7 +229,7 @@ class TestFullFlow:
             table_calls.append('events')  # イベントテーブルの呼び出しを記録
 
         with patch('line_bot.app.line_bot_api', mock_line_bot_api), \
-             patch('line_bot.app.supabase', mock_supabase), \
+             patch('line_bot.app.repository', mock_supabase), \
              patch.object(EventCommands, 'event_info', new=handle_event_info):
 
             # 1. イベントの作成
@@ -256,10 +259,10 @@ class TestFullFlow:
         """Test reminder notification flow"""
         # Supabaseのモックを設定
         mock_supabase = self.setup_mock_tables(mock_supabase, event_data)
-        mock_discord_bot.supabase = mock_supabase
+        mock_discord_bot.repository = Repository(mock_supabase)
 
         with patch('line_bot.app.line_bot_api', mock_line_bot_api), \
-             patch('line_bot.app.supabase', mock_supabase), \
+             patch('line_bot.app.repository', mock_supabase), \
              patch('reminder.scheduler.ReminderScheduler.process_reminders', new_callable=AsyncMock) as mock_process:
 
             # リマインダーデータの設定
@@ -12,6 +12,7 @@ from linebot.models import (
 from discord.ext import commands
 import discord
 from discord_bot.bot import EventCommands
+from database.repository import Repository
 
 @pytest.mark.integration
 class TestEventFlow:
@@ -29,7 +30,7 @@ class TestEventFlow:
         """Set up Discord bot mock"""
         mock_bot = MagicMock()
         mock_bot.send_message = AsyncMock()
-        mock_bot.supabase = MagicMock()
+        mock_bot.repository = AsyncMock()
         return mock_bot
 
     def create_mock_query_chain(self, result):
@@ -41,7 +42,7 @@ class TestEventFlow:
         mock_chain.lte.return_value = mock_chain
         mock_chain.order.return_value = mock_chain
         mock_chain.range.return_value = mock_chain
-        mock_chain.execute.return_value = MagicMock(data=result, count=len(result))
+        mock_chain.execute = AsyncMock(return_value=MagicMock(data=result, count=len(result)))
 
         # deleteとupdateのモックを設定
         mock_delete = MagicMock()
@@ -89,6 +90,8 @@ class TestEventFlow:
         mock_table = MagicMock(side_effect=get_table)
         mock_table.table_calls = table_calls
         mock_supabase.table = mock_table
+        # PostgRESTクライアント（リポジトリ経由）のテーブル選択
+        mock_supabase.from_ = mock_table
 
         # イベントコマンド実行時のリマインダーテーブル呼び出しを設定
         def execute_with_reminder():
@@ -122,10 +125,10 @@ class TestEventFlow:
 
         # Supabaseのモックを設定
         mock_supabase = self.setup_mock_tables(mock_supabase, result_data)
-        mock_discord_bot.supabase = mock_supabase
+        mock_discord_bot.repository = Repository(mock_supabase)
 
         with patch('line_bot.app.line_bot_api', mock_line_bot_api), \
-             patch('line_bot.app.supabase', mock_supabase):
+             patch('line_bot.app.repository', mock_supabase):
 
             # 1. Discordでイベントを作成
             cog = EventCommands(mock_discord_bot)
@@ -148,7 +151,7 @@ class TestEventFlow:
         # Supabaseのモックを設定
         mock_supabase = self.setup_mock_tables(mock_supabase, event_data)
         mock_supabase.table('reminders').select().eq().lte().execute.return_value.data = [reminder_data]
-        mock_discord_bot.supabase = mock_supabase
+        mock_discord_bot.repository = Repository(mock_supabase)
 
         # リマインダースケジューラーの実行
         from reminder.scheduler import ReminderScheduler
@@ -188,7 +191,7 @@ class TestEventFlow:
 
         # Supabaseのモックを設定
         mock_supabase = self.setup_mock_tables(mock_supabase, updated_event)
-        mock_discord_bot.supabase = mock_supabase
+        mock_discord_bot.repository = Repository(mock_supabase)
 
         # リマインダーテーブルのモックを設定
         reminders_chain = mock_supabase.table('reminders')
@@ -204,7 +207,7 @@ class TestEventFlow:
             await ctx.send(embed=embed)
 
         with patch('line_bot.app.line_bot_api', mock_line_bot_api), \
-             patch('line_bot.app.supabase', mock_supabase), \
+             patch('line_bot.app.repository', mock_supabase), \
              patch.object(EventCommands, 'event_info', new=handle_event_info):
 
             # イベントの更新
@@ -0,0 +1,249 @@
+import os
+import uuid
+import pytest
+import asyncio
+import time
+from unittest.mock import MagicMock, patch, AsyncMock
+from datetime import datetime, timezone, timedelta
+from linebot.models import PostbackEvent, Postback, SourceUser
+from line_bot.event_queue import WebhookEventQueue
+
+# 1回のRPCの往復にかかる時間（秒）
+RPC_LATENCY = 0.005
+# 人数の行のロックを保持している時間（秒）
+LOCK_HOLD = 0.001
+# 定員と参加を試みるユーザー数
+CAPACITY = 50
+USERS = 500
+
+# 実際のDBで負荷試験を行う場合の接続先（使い捨てのSupabaseプロジェクトを指定する）
+STORM_SUPABASE_URL = os.getenv('JOIN_STORM_SUPABASE_URL')
+STORM_SUPABASE_KEY = os.getenv('JOIN_STORM_SUPABASE_KEY')
+
+
+class FakeEventStore:
+    """join_event・cancel_participation関数と同じ結果を返すメモリ上のリポジトリ
+
+    人数の行のロック（FOR UPDATE）をイベントごとのasyncio.Lockで再現し、RPCの往復の遅延と
+    ロックを保持している時間を加える。ロック待ちの順番やPostgreSQLの実際の処理時間は再現しないため、
+    DBでの直列化は TestJoinStormDatabase で確認する。
+    """
+
+    def __init__(self, event):
+        self.event = dict(event, participant_count=0, waitlist_count=0)
+        self.participants = []  # (line_user_id, status)の登録順
+        self.lock = asyncio.Lock()
+        self.calls = 0
+
+    async def join_event(self, event_id, line_user_id, display_name=None, user_uuid=None):
+        self.calls += 1
+        await asyncio.sleep(RPC_LATENCY)
+        async with self.lock:
+            await asyncio.sleep(LOCK_HOLD)
+            for user, status in self.participants:
+                if user == line_user_id:
+                    return {
+                        'status': 'already_waitlisted' if status == 'waitlisted' else 'already_registered',
+                        'event': dict(self.event),
+                        'user_id': f'uuid-{line_user_id}'
+                    }
+            if self.event['participant_count'] >= self.event['max_participants']:
+                self.participants.append((line_user_id, 'waitlisted'))
+                self.event['waitlist_count'] += 1
+                return {
+                    'status': 'waitlisted',
+                    'event': dict(self.event),
+                    'waitlist_position': self.event['waitlist_count'],
+                    'user_id': f'uuid-{line_user_id}'
+                }
+            self.participants.append((line_user_id, 'registered'))
+            self.event['participant_count'] += 1
+            return {
+                'status': 'joined',
+                'event': dict(self.event),
+                'participant_count': self.event['participant_count'],
+                'user_id': f'uuid-{line_user_id}'
+            }
+
+    async def cancel_participation(self, event_id, line_user_id, user_uuid=None):
+        self.calls += 1
+        await asyncio.sleep(RPC_LATENCY)
+        async with self.lock:
+            await asyncio.sleep(LOCK_HOLD)
+            index = next(i for i, (user, _) in enumerate(self.participants) if user == line_user_id)
+            _, status = self.participants.pop(index)
+            promoted = None
+            if status == 'registered':
+                self.event['participant_count'] -= 1
+                waitlisted = [i for i, (_, s) in enumerate(self.participants) if s == 'waitlisted']
+                if waitlisted:
+                    promoted = self.participants[waitlisted[0]][0]
+                    self.participants[waitlisted[0]] = (promoted, 'registered')
+                    self.event['participant_count'] += 1
+                    self.event['waitlist_count'] -= 1
+            else:
+                self.event['waitlist_count'] -= 1
+            return {
+                'status': 'cancelled',
+                'event': dict(self.event),
+                'participant_count': self.event['participant_count'],
+                'was_waitlisted': status == 'waitlisted',
+                'promoted_line_user_id': promoted,
+                'user_id': f'uuid-{line_user_id}'
+            }
+
+
+def make_postback(data, user_id):
+    """Create a postback event from a LINE user"""
+    return PostbackEvent(
+        reply_token=f"token-{user_id}",
+        postback=Postback(data=data),
+        source=SourceUser(user_id=user_id)
+    )
+
+
+@pytest.mark.integration
+@pytest.mark.line
+class TestJoinStorm:
+    @pytest.fixture
+    def mock_line_bot_api(self):
+        """Set up LINE Bot API mock"""
+        mock = MagicMock()
+        mock.reply_message = AsyncMock()
+        mock.push_message = AsyncMock()
+        mock.get_profile = AsyncMock(return_value=MagicMock(display_name="Test User"))
+        return mock
+
+    @pytest.fixture
+    def store(self):
+        """Event with limited capacity that starts tomorrow"""
+        start_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        return FakeEventStore({
+            'id': 'event-uuid',
+            'event_id': '123',
+            'name': 'Popular Event',
+            'location': 'Tokyo',
+            'start_date': start_date,
+            'max_participants': CAPACITY
+        })
+
+    async def run_storm(self, store, mock_line_bot_api, events):
+        """Push postbacks through the webhook queue and wait until all are handled"""
+        from line_bot.app import dispatch_event
+        queue = WebhookEventQueue(dispatch_event, max_size=len(events) * 2)
+        with patch('line_bot.app.repository', store), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            queue.start()
+            started = time.monotonic()
+            queue.put_events(events)
+            await asyncio.gather(*(q.join() for q in queue.queues))
+            elapsed = time.monotonic() - started
+            await queue.stop()
+        return elapsed, queue
+
+    @pytest.mark.asyncio
+    async def test_join_storm_fills_capacity_then_waitlists(self, store, mock_line_bot_api, record_property):
+        """Test hundreds of simultaneous joins register exactly the capacity and waitlist the rest in order"""
+        users = [f'line-user-{i}' for i in range(USERS)]
+
+        elapsed, queue = await self.run_storm(
+            store, mock_line_bot_api, [make_postback('join_123', user) for user in users]
+        )
+
+        registered = [user for user, status in store.participants if status == 'registered']
+        waitlisted = [user for user, status in store.participants if status == 'waitlisted']
+        assert len(registered) == CAPACITY
+        assert len(waitlisted) == USERS - CAPACITY
+        assert store.event['participant_count'] == CAPACITY
+        # 全員に1回ずつ応答し、キャンセル待ちの順番は重複しない
+        texts = [c[0][1].text for c in mock_line_bot_api.reply_message.call_args_list]
+        assert len(texts) == USERS
+        assert sum("参加登録が完了しました" in text for text in texts) == CAPACITY
+        positions = sorted(int(text.split('（')[1].split('番目')[0]) for text in texts if "キャンセル待ち" in text)
+        assert positions == list(range(1, USERS - CAPACITY + 1))
+        assert queue.failed == 0
+        # DBの呼び出しは1人1回（プロフィール取得の再実行なし）
+        assert store.calls == USERS
+        # ロックを保持している時間は直列になり、ロックの外の往復だけが並行して進む
+        record_property('joins_per_second', round(USERS / elapsed))
+        record_property('handle_latency', queue.stats()['handle_latency'])
+        assert elapsed >= USERS * LOCK_HOLD
+        assert elapsed < USERS * (RPC_LATENCY + LOCK_HOLD)
+
+    @pytest.mark.asyncio
+    async def test_cancellations_promote_waitlist_in_order(self, store, mock_line_bot_api):
+        """Test each cancellation promotes the earliest waitlisted user and notifies them"""
+        users = [f'line-user-{i}' for i in range(CAPACITY + 10)]
+        await self.run_storm(store, mock_line_bot_api, [make_postback('join_123', user) for user in users])
+        waitlisted = [user for user, status in store.participants if status == 'waitlisted']
+        registered = [user for user, status in store.participants if status == 'registered']
+
+        await self.run_storm(
+            store, mock_line_bot_api, [make_postback('cancel_123', user) for user in registered[:5]]
+        )
+
+        promoted = [c[0][0] for c in mock_line_bot_api.push_message.call_args_list]
+        assert sorted(promoted) == sorted(waitlisted[:5])
+        assert store.event['participant_count'] == CAPACITY
+        assert store.event['waitlist_count'] == 5
+        assert "参加が確定しました" in mock_line_bot_api.push_message.call_args[0][1].text
+
+
+@pytest.mark.integration
+@pytest.mark.database
+@pytest.mark.skipif(
+    not (STORM_SUPABASE_URL and STORM_SUPABASE_KEY),
+    reason="JOIN_STORM_SUPABASE_URL and JOIN_STORM_SUPABASE_KEY are not set"
+)
+class TestJoinStormDatabase:
+    @pytest.fixture
+    async def storm(self):
+        """Repository connected to a disposable database and an event created for the run"""
+        from database.repository import create_repository
+        repository = create_repository(STORM_SUPABASE_URL, STORM_SUPABASE_KEY)
+        run_id = uuid.uuid4().hex[:8]
+        start_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        event = (await repository.upsert_events([{
+            'event_id': f'join-storm-{run_id}',
+            'name': 'Join Storm',
+            'start_date': start_date,
+            'max_participants': CAPACITY
+        }]))[0]
+        try:
+            yield repository, event, run_id
+        finally:
+            # 試験で作成した参加者・イベント・ユーザーを削除
+            await repository.client.from_('participants').delete().eq('event_id', event['id']).execute()
+            await repository.client.from_('events').delete().eq('id', event['id']).execute()
+            await repository.client.from_('users').delete().like('line_user_id', f'storm-{run_id}-%').execute()
+            await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_join_storm_against_database(self, storm, record_property):
+        """Test concurrent join_event calls are serialized by the counts row lock in PostgreSQL"""
+        repository, event, run_id = storm
+        users = [f'storm-{run_id}-{i}' for i in range(USERS)]
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            repository.join_event(event['event_id'], user, "Storm User") for user in users
+        ))
+        elapsed = time.monotonic() - started
+        record_property('joins_per_second', round(USERS / elapsed))
+
+        statuses = [result['status'] for result in results]
+        assert statuses.count('joined') == CAPACITY
+        assert statuses.count('waitlisted') == USERS - CAPACITY
+        positions = {
+            result['waitlist_position']: user
+            for user, result in zip(users, results) if result['status'] == 'waitlisted'
+        }
+        assert sorted(positions) == list(range(1, USERS - CAPACITY + 1))
+        assert await repository.count_participants(event['id']) == CAPACITY
+
+        # キャンセルごとにキャンセル待ちの先頭（返した順番）から繰り上がる
+        registered = [user for user, result in zip(users, results) if result['status'] == 'joined']
+        for i, user in enumerate(registered[:5]):
+            result = await repository.cancel_participation(event['event_id'], user)
+            assert result['promoted_line_user_id'] == positions[i + 1]
+        assert await repository.count_participants(event['id']) == CAPACITY
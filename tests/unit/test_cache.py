@@ -0,0 +1,158 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+from unittest.mock import patch
+from database.cache import UpcomingEventsCache, CursorStore, EventRecordCache, event_key, upcoming_events_cache, event_record_cache
+
+def make_events(count, start=None):
+    """Create upcoming events sorted by start date"""
+    start = start or datetime.now(timezone.utc) + timedelta(days=1)
+    return [
+        {'id': f'event-{i}', 'event_id': f'{i}', 'start_date': (start + timedelta(hours=i)).isoformat()}
+        for i in range(count)
+    ]
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestUpcomingEventsCache:
+    @pytest.mark.asyncio
+    async def test_pages_are_sliced_from_one_query(self, mock_repository):
+        """Test every page and the total are served from a single listing query"""
+        mock_repository.list_upcoming_events.return_value = make_events(12)
+        cache = UpcomingEventsCache()
+
+        first = await cache.get_page(mock_repository, 5)
+        last = await cache.get_page(mock_repository, 5, offset=10)
+
+        assert [e['id'] for e in first.events] == [f'event-{i}' for i in range(5)]
+        assert [e['id'] for e in last.events] == ['event-10', 'event-11']
+        assert first.total == 12
+        assert first.next_cursor == event_key(first.events[-1])
+        assert last.next_cursor is None
+        mock_repository.list_upcoming_events.assert_called_once()
+        mock_repository.count_upcoming_events.assert_not_called()
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @pytest.mark.asyncio
+    async def test_keyset_pages_follow_cursor(self, mock_repository):
+        """Test following next_cursor walks every event once, including events with the same start date"""
+        events = make_events(7)
+        events[3]['start_date'] = events[2]['start_date']
+        mock_repository.list_upcoming_events.return_value = events
+        cache = UpcomingEventsCache()
+
+        seen, cursor = [], None
+        while True:
+            page = await cache.get_page(mock_repository, 2, after=cursor)
+            seen += [e['id'] for e in page.events]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        assert seen == [e['id'] for e in events]
+
+    @pytest.mark.asyncio
+    async def test_invalidate_and_started_events(self, mock_repository):
+        """Test invalidation reloads the list and events that have started are skipped"""
+        started = make_events(1, start=datetime.now(timezone.utc) - timedelta(minutes=1))
+        mock_repository.list_upcoming_events.return_value = started + make_events(2)
+        cache = UpcomingEventsCache()
+
+        page = await cache.get_page(mock_repository, 5)
+        assert page.total == 2
+        assert len(page.events) == 2
+
+        cache.invalidate()
+        await cache.get_page(mock_repository, 5)
+        assert mock_repository.list_upcoming_events.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_pages_beyond_cached_range_use_keyset_query(self, mock_repository):
+        """Test pages past the cached events use a keyset query and the total is counted once per load"""
+        cached = make_events(3)
+        rest = make_events(2, start=datetime.now(timezone.utc) + timedelta(days=2))
+        mock_repository.list_upcoming_events.side_effect = [cached, rest]
+        mock_repository.count_upcoming_events.return_value = 5
+        cache = UpcomingEventsCache(max_events=3)
+
+        cursor = event_key(cached[-1])
+        page = await cache.get_page(mock_repository, 3, after=cursor)
+
+        assert len(page.events) == 2
+        assert page.total == 5
+        assert page.next_cursor is None
+        mock_repository.list_upcoming_events.assert_called_with(limit=3, after=cursor, offset=0)
+        mock_repository.count_upcoming_events.assert_called_once()
+
+    def test_cursor_store_is_bounded(self):
+        """Test the per-user cursor store evicts the least recently used entries"""
+        store = CursorStore(max_users=2)
+        store.set('a', None, 2)
+        store.set('b', None, 2)
+        store.get('a')
+        store.set('c', None, 2)
+        store.set('a', None, 3)
+
+        assert store.get('b') is None
+        assert store.get('a') == (None, 3)
+
+    def test_discord_event_change_invalidates(self):
+        """Test Discord scheduled event changes invalidate the shared listing cache"""
+        from discord_bot.bot import EventBot
+        upcoming_events_cache._snapshot = ([], [], 0)
+
+        EventBot().notify_event_changed('1')
+
+        assert upcoming_events_cache._snapshot is None
+
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestEventRecordCache:
+    @pytest.mark.asyncio
+    async def test_records_and_unknown_ids_are_cached(self, mock_repository):
+        """Test hot events and unknown IDs are served from memory after one lookup"""
+        event = make_events(1)[0]
+        mock_repository.get_event.side_effect = lambda event_id: event if event_id == '0' else None
+        cache = EventRecordCache()
+
+        for _ in range(3):
+            assert await cache.get(mock_repository, '0') == event
+            assert await cache.get(mock_repository, 'unknown') is None
+
+        assert mock_repository.get_event.call_count == 2
+        assert (cache.hits, cache.misses) == (4, 2)
+
+    @pytest.mark.asyncio
+    async def test_unknown_ids_expire_sooner(self, mock_repository):
+        """Test negative entries use the shorter TTL"""
+        cache = EventRecordCache(ttl_seconds=300, negative_ttl_seconds=30)
+        with patch('database.cache.time.monotonic', return_value=0):
+            cache.set('0', make_events(1)[0])
+            cache.set('unknown', None)
+        with patch('database.cache.time.monotonic', return_value=31):
+            assert cache.peek('0')[0] is True
+            assert cache.peek('unknown') == (False, None)
+
+    @pytest.mark.asyncio
+    async def test_invalidate_during_load_keeps_cache_empty(self, mock_repository):
+        """Test a row read before an invalidation is not stored"""
+        cache = EventRecordCache()
+
+        async def get_event(event_id):
+            # 読み込み中にDiscordでイベントが変更された
+            cache.invalidate(event_id)
+            return make_events(1)[0]
+        mock_repository.get_event.side_effect = get_event
+
+        await cache.get(mock_repository, '0')
+
+        assert cache.peek('0') == (False, None)
+
+    def test_discord_event_change_invalidates_record(self):
+        """Test Discord scheduled event changes drop the cached event row"""
+        from discord_bot.bot import EventBot
+        event_record_cache.set('1', None)
+
+        EventBot().notify_event_changed('1')
+
+        assert event_record_cache.peek('1') == (False, None)
@@ -0,0 +1,95 @@
+import pytest
+import base64
+import hashlib
+import hmac
+import json
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from linebot.models import MessageEvent, TextMessage, SourceUser
+from line_bot.dedup import WebhookEventDeduplicator
+from line_bot.event_queue import WebhookEventQueue
+
+def make_event(webhook_event_id):
+    """Create a LINE text message event with a webhook event ID"""
+    return MessageEvent(
+        message=TextMessage(text="join test-event-id"),
+        reply_token="test-reply-token",
+        source=SourceUser(user_id="test-user"),
+        webhook_event_id=webhook_event_id
+    )
+
+@pytest.mark.unit
+@pytest.mark.line
+class TestWebhookEventDeduplicator:
+    def test_filter_new_drops_redeliveries(self):
+        """Test events already marked and repeated IDs within one request are dropped"""
+        dedup = WebhookEventDeduplicator()
+        first = dedup.filter_new([make_event('event-1'), make_event('event-1'), make_event('event-2')])
+        assert [e.webhook_event_id for e in first] == ['event-1', 'event-2']
+
+        # キューに追加されるまでは記録しない
+        assert len(dedup.filter_new([make_event('event-1')])) == 1
+
+        dedup.mark_all(first)
+        assert dedup.filter_new([make_event('event-1'), make_event('event-3')])[0].webhook_event_id == 'event-3'
+        assert dedup.duplicates == 2
+
+    def test_entries_are_bounded_and_expire(self):
+        """Test the oldest entries are evicted and expired entries are forgotten"""
+        dedup = WebhookEventDeduplicator(max_entries=2)
+        for webhook_event_id in ['event-1', 'event-2', 'event-3']:
+            dedup.mark(webhook_event_id)
+
+        assert len(dedup) == 2
+        assert not dedup.is_duplicate('event-1')
+        assert dedup.is_duplicate('event-3')
+
+        with patch('line_bot.dedup.time.monotonic', return_value=float('inf')):
+            assert not dedup.is_duplicate('event-3')
+
+    @pytest.mark.asyncio
+    async def test_claim_with_table_store(self, mock_repository):
+        """Test events handled by another replica are dropped through the table store"""
+        mock_repository.claim_webhook_event.side_effect = [True, False]
+        mock_repository.purge_webhook_events.return_value = 0
+        dedup = WebhookEventDeduplicator(store=mock_repository)
+
+        assert await dedup.claim(make_event('event-1'))
+        assert not await dedup.claim(make_event('event-1'))
+        mock_repository.claim_webhook_event.assert_called_with('event-1', int(dedup.ttl_seconds))
+        # 古い記録の削除は一定間隔に1回
+        mock_repository.purge_webhook_events.assert_called_once()
+
+    def test_webhook_enqueues_redelivery_once(self):
+        """Test a redelivered webhook is acknowledged without being enqueued again"""
+        from line_bot.app import app, parser
+
+        payload = json.dumps({
+            "destination": "test-destination",
+            "events": [{
+                "type": "postback",
+                "postback": {"data": "join_test-event-id"},
+                "source": {"type": "user", "userId": "test-user"},
+                "replyToken": "test-reply-token",
+                "timestamp": 0,
+                "mode": "active",
+                "webhookEventId": "test-webhook-id",
+                "deliveryContext": {"isRedelivery": False}
+            }]
+        })
+        signature = base64.b64encode(
+            hmac.new(parser.signature_validator.channel_secret, payload.encode('utf-8'), hashlib.sha256).digest()
+        ).decode('utf-8')
+
+        async def handler(event):
+            pass
+
+        queue = WebhookEventQueue(handler, max_size=10, workers=1)
+        with patch('line_bot.app.webhook_queue', queue), \
+             patch('line_bot.app.webhook_dedup', WebhookEventDeduplicator()):
+            client = TestClient(app)
+            for _ in range(2):
+                response = client.post("/webhook", content=payload, headers={"X-Line-Signature": signature})
+                assert response.status_code == 200
+
+        assert queue.depth == 1
@@ -12,7 +12,7 @@ class TestDiscordBot:
         """Set up test bot"""
         with patch('discord_bot.bot.EventBot') as MockBot:
             mock_bot = MagicMock()
-            mock_bot.supabase = MagicMock()
+            mock_bot.repository = AsyncMock()
             MockBot.return_value = mock_bot
             from discord_bot.bot import bot
             return bot
@@ -24,33 +24,18 @@ class TestDiscordBot:
         ctx.send = AsyncMock()
         return ctx
 
-    def setup_supabase_mock(self, mock_supabase, result_data, count_data=None):
-        """Set up Supabase mock with proper chaining"""
-        mock_table = MagicMock()
-        mock_select = MagicMock()
-        mock_execute = MagicMock()
-        mock_result = MagicMock()
-        mock_result.data = result_data
-
-        mock_table.select.return_value = mock_select
-        mock_select.eq.return_value = mock_select
-        mock_select.gte.return_value = mock_select
-        mock_select.order.return_value = mock_select
-        mock_select.range.return_value = mock_select
-        mock_select.execute.return_value = mock_result
-
+    def setup_repository_mock(self, mock_repository, result_data, count_data=None):
+        """Set up repository mock responses"""
+        mock_repository.list_upcoming_events.return_value = result_data
+        mock_repository.search_events.return_value = result_data
         if count_data is not None:
-            mock_count = MagicMock()
-            mock_count.count = count_data
-            mock_select.execute.side_effect = [mock_result, mock_count]
-
-        mock_supabase.table.return_value = mock_table
-        return mock_table, mock_result
+            mock_repository.count_upcoming_events.return_value = count_data
+        return mock_repository
 
     @pytest.mark.asyncio
-    async def test_events_command(self, test_bot, event_data, mock_supabase, mock_context):
+    async def test_events_command(self, test_bot, event_data, mock_repository, mock_context):
         """Test events command"""
-        # Supabaseのモックレスポンスの設定
+        # リポジトリのモックレスポンスの設定
         result_data = [{
             'name': event_data['name'],
             'description': event_data['description'],
@@ -58,8 +43,8 @@ class TestDiscordBot:
             'location': event_data['location']
         }]
         
-        mock_table, _ = self.setup_supabase_mock(mock_supabase, result_data, count_data=1)
-        test_bot.supabase = mock_supabase
+        self.setup_repository_mock(mock_repository, result_data, count_data=1)
+        test_bot.repository = mock_repository
         
         # EventCommandsのインスタンスを作成
         from discord_bot.bot import EventCommands
@@ -75,7 +60,7 @@ class TestDiscordBot:
         assert event_data['name'] in str(call_args[1]['embed'].to_dict())
 
     @pytest.mark.asyncio
-    async def test_eventinfo_command(self, test_bot, event_data, mock_supabase, mock_context):
+    async def test_eventinfo_command(self, test_bot, event_data, mock_repository, mock_context):
         """Test eventinfo command"""
         # イベント情報のモック設定
         event_result_data = [{
@@ -95,37 +80,12 @@ class TestDiscordBot:
             }
         }]
 
-        # Supabaseのモックを設定
-        mock_event_table = MagicMock()
-        mock_event_select = MagicMock()
-        mock_event_result = MagicMock()
-        mock_event_result.data = event_result_data
-
-        mock_participants_table = MagicMock()
-        mock_participants_select = MagicMock()
-        mock_participants_result = MagicMock()
-        mock_participants_result.data = participants_result_data
-
-        # イベントテーブルのチェーン設定
-        mock_event_table.select.return_value = mock_event_select
-        mock_event_select.eq.return_value = mock_event_select
-        mock_event_select.execute.return_value = mock_event_result
-
-        # 参加者テーブルのチェーン設定
-        mock_participants_table.select.return_value = mock_participants_select
-        mock_participants_select.eq.return_value = mock_participants_select
-        mock_participants_select.execute.return_value = mock_participants_result
-
-        # Supabaseのtableメソッドをモック
-        def mock_table_side_effect(table_name):
-            if table_name == 'events':
-                return mock_event_table
-            elif table_name == 'participants':
-                return mock_participants_table
-            return MagicMock()
-
-        mock_supabase.table.side_effect = mock_table_side_effect
-        test_bot.supabase = mock_supabase
+        # リポジトリのモックを設定
+        mock_repository.get_event.return_value = event_result_data[0]
+        mock_repository.list_participant_names.return_value = [
+            p['users']['name'] for p in participants_result_data
+        ]
+        test_bot.repository = mock_repository
         
         # EventCommandsのインスタンスを作成
         from discord_bot.bot import EventCommands
@@ -143,18 +103,19 @@ class TestDiscordBot:
         assert event_data['description'] == embed_dict['description']
 
     @pytest.mark.asyncio
-    async def test_search_command(self, test_bot, event_data, mock_supabase, mock_context):
+    async def test_search_command(self, test_bot, event_data, mock_repository, mock_context):
         """Test search command"""
-        # Supabaseのモックレスポンスの設定
+        # リポジトリのモックレスポンスの設定
         result_data = [{
             'name': event_data['name'],
             'description': event_data['description'],
             'start_time': '2024-02-01T10:00:00Z',
+            'start_date': '2024-02-01T10:00:00Z',
             'location': event_data['location']
         }]
         
-        mock_table, _ = self.setup_supabase_mock(mock_supabase, result_data)
-        test_bot.supabase = mock_supabase
+        self.setup_repository_mock(mock_repository, result_data)
+        test_bot.repository = mock_repository
         
         # EventCommandsのインスタンスを作成
         from discord_bot.bot import EventCommands
@@ -168,4 +129,89 @@ class TestDiscordBot:
         call_args = mock_context.send.call_args
         assert isinstance(call_args[1]['embed'], discord.Embed)
         embed_dict = call_args[1]['embed'].to_dict()
-        assert "Test" in embed_dict['title']
\ No newline at end of file
+        assert "Test" in embed_dict['title']
+    @pytest.mark.asyncio
+    async def test_listeners_update_search_index(self, mock_repository):
+        """Test scheduled event changes reach the search index once they are synced"""
+        from datetime import timezone, timedelta
+        from database.search import event_search_index
+        from discord_bot.bot import EventBot, EventCommands
+        from discord_bot.sync import EventSyncBuffer
+        start_time = datetime.now(timezone.utc) + timedelta(days=1)
+        scheduled_event = MagicMock()
+        scheduled_event.id = 123
+        scheduled_event.name = 'もくもく会'
+        scheduled_event.description = None
+        scheduled_event.location = '渋谷'
+        scheduled_event.start_time = start_time
+        scheduled_event.end_time = None
+        mock_repository.upsert_events.side_effect = lambda rows: [dict(row, id='event-uuid') for row in rows]
+        test_bot = MagicMock()
+        test_bot.event_sync = EventSyncBuffer(
+            lambda: mock_repository,
+            lambda rows: EventBot.on_events_synced(test_bot, rows)
+        )
+
+        cog = EventCommands(test_bot)
+
+        await cog.on_scheduled_event_create(scheduled_event)
+        # 書き込み前はインデックスに反映されない
+        assert event_search_index.search('もくもく') == []
+        await test_bot.event_sync.flush()
+        assert [e['event_id'] for e in event_search_index.search('もくもく')] == ['123']
+        test_bot.notify_event_changed.assert_called_with('123')
+
+        await cog.on_scheduled_event_delete(scheduled_event)
+        await test_bot.event_sync.flush()
+        assert event_search_index.search('もくもく') == []
+        await test_bot.event_sync.close()
+
+    @pytest.mark.asyncio
+    async def test_eventinfo_caps_participant_list(self, mock_repository, mock_context):
+        """Test eventinfo counts participants separately and keeps the name field within the embed limit"""
+        from discord_bot.bot import EventCommands, PARTICIPANT_PREVIEW_LIMIT
+        mock_repository.get_event.return_value = {
+            'id': 'event-uuid',
+            'name': 'Big Event',
+            'description': 'Test Description',
+            'start_date': '2024-02-01T10:00:00+00:00',
+            'end_date': None,
+            'location': 'Tokyo',
+            'status': 'scheduled'
+        }
+        mock_repository.count_participants.return_value = 5000
+        mock_repository.list_participant_names.return_value = ['参加者' + 'あ' * 100] * PARTICIPANT_PREVIEW_LIMIT
+        test_bot = MagicMock()
+        test_bot.repository = mock_repository
+
+        cog = EventCommands(test_bot)
+        await cog.event_info.callback(cog, mock_context, '123')
+
+        embed = mock_context.send.call_args[1]['embed'].to_dict()
+        field = embed['fields'][-1]
+        assert field['name'] == "参加者 (5000人)"
+        assert len(field['value']) <= 1024
+        assert field['value'].endswith("人")
+        assert "!participants 123" in embed['footer']['text']
+        mock_repository.list_participant_names.assert_called_once_with('event-uuid', limit=PARTICIPANT_PREVIEW_LIMIT)
+
+    @pytest.mark.asyncio
+    async def test_participants_command_pages(self, mock_repository, mock_context):
+        """Test the participant browser fetches one page at a time"""
+        from discord_bot.bot import EventCommands, PARTICIPANTS_PER_PAGE
+        mock_repository.get_event.return_value = {'id': 'event-uuid', 'name': 'Big Event'}
+        mock_repository.count_participants.return_value = 45
+        mock_repository.list_participant_names.return_value = [f'User {i}' for i in range(5)]
+        test_bot = MagicMock()
+        test_bot.repository = mock_repository
+
+        cog = EventCommands(test_bot)
+        await cog.list_participants.callback(cog, mock_context, '123', '3')
+
+        mock_repository.list_participant_names.assert_called_once_with(
+            'event-uuid', limit=PARTICIPANTS_PER_PAGE, offset=2 * PARTICIPANTS_PER_PAGE
+        )
+        embed = mock_context.send.call_args[1]['embed'].to_dict()
+        assert embed['title'] == "Big Event の参加者 (45人)"
+        assert embed['description'].startswith("41. User 0")
+        assert embed['footer']['text'].startswith("ページ 3/3")
@@ -0,0 +1,81 @@
+import pytest
+import time
+from unittest.mock import MagicMock, AsyncMock, patch
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+from linebot.models.error import Error
+from line_bot.dispatcher import LineDispatcher, TokenBucket
+
+def make_api_error(status_code, headers=None):
+    """Create a LINE API error"""
+    return LineBotApiError(status_code, headers or {}, error=Error(message="error"))
+
+@pytest.mark.unit
+@pytest.mark.line
+class TestLineDispatcher:
+    @pytest.mark.asyncio
+    async def test_retry_after_is_honored(self):
+        """Test 429 responses are retried after Retry-After with the same retry key"""
+        mock_api = MagicMock()
+        mock_api.push_message = AsyncMock(side_effect=[make_api_error(429, {'Retry-After': '2'}), None])
+        dispatcher = LineDispatcher(mock_api)
+
+        with patch('line_bot.dispatcher.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+            await dispatcher.push_message('user-1', TextSendMessage(text="test"))
+
+        assert mock_api.push_message.call_count == 2
+        mock_sleep.assert_any_call(2.0)
+        # 再送時も同じ再試行キーを使う
+        retry_keys = {c.kwargs['retry_key'] for c in mock_api.push_message.call_args_list}
+        assert len(retry_keys) == 1
+
+    @pytest.mark.asyncio
+    async def test_non_retryable_error_is_raised(self):
+        """Test client errors are raised without retrying"""
+        mock_api = MagicMock()
+        mock_api.reply_message = AsyncMock(side_effect=make_api_error(400))
+        dispatcher = LineDispatcher(mock_api)
+
+        with pytest.raises(LineBotApiError):
+            await dispatcher.reply_message('token', TextSendMessage(text="test"))
+        assert mock_api.reply_message.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_reply_is_not_retried_after_server_error(self):
+        """Test replies are retried on 429 only because reply tokens are single-use"""
+        mock_api = MagicMock()
+        mock_api.reply_message = AsyncMock(side_effect=[make_api_error(429), None, make_api_error(500)])
+        dispatcher = LineDispatcher(mock_api)
+
+        with patch('line_bot.dispatcher.asyncio.sleep', new_callable=AsyncMock):
+            await dispatcher.reply_message('token-1', TextSendMessage(text="test"))
+            assert mock_api.reply_message.call_count == 2
+            # 5xxの後は再送せずに呼び出し元へ返す
+            with pytest.raises(LineBotApiError):
+                await dispatcher.reply_message('token-2', TextSendMessage(text="test"))
+        assert mock_api.reply_message.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self):
+        """Test server errors are retried with backoff up to the retry limit"""
+        mock_api = MagicMock()
+        mock_api.multicast = MagicMock(side_effect=make_api_error(500))
+        dispatcher = LineDispatcher(mock_api, max_retries=2)
+
+        with patch('line_bot.dispatcher.asyncio.sleep', new_callable=AsyncMock):
+            with pytest.raises(LineBotApiError):
+                await dispatcher.multicast(['user-1'], TextSendMessage(text="test"))
+        assert mock_api.multicast.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_token_bucket_limits_rate(self):
+        """Test the token bucket spaces requests beyond the burst capacity"""
+        bucket = TokenBucket(rate=100, capacity=2)
+
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        elapsed = time.monotonic() - started
+
+        # 2件はバースト、残り4件は100件/秒で待機
+        assert elapsed >= 0.035
@@ -0,0 +1,100 @@
+import pytest
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from linebot.models import MessageEvent, TextMessage, SourceUser
+from line_bot.event_queue import WebhookEventQueue
+
+def make_event(user_id, text):
+    """Create a LINE text message event"""
+    return MessageEvent(
+        message=TextMessage(text=text),
+        reply_token="test-reply-token",
+        source=SourceUser(user_id=user_id)
+    )
+
+@pytest.mark.unit
+@pytest.mark.line
+class TestWebhookEventQueue:
+    @pytest.mark.asyncio
+    async def test_events_from_one_user_keep_order(self):
+        """Test events are processed in the background in order per user"""
+        handled = []
+
+        async def handler(event):
+            await asyncio.sleep(0.01)
+            handled.append((event.source.user_id, event.message.text))
+
+        queue = WebhookEventQueue(handler, max_size=100, workers=4)
+        queue.put_events([make_event('user-1', str(i)) for i in range(5)] + [make_event('user-2', 'a')])
+        assert queue.depth == 6
+
+        queue.start()
+        await queue.stop()
+
+        assert [text for user, text in handled if user == 'user-1'] == ['0', '1', '2', '3', '4']
+        stats = queue.stats()
+        assert stats['processed'] == 6
+        assert stats['depth'] == 0
+        assert stats['handle_latency']['p99_ms'] >= 10
+
+    @pytest.mark.asyncio
+    async def test_full_queue_rejects_whole_batch(self):
+        """Test a batch that does not fit is rejected without enqueuing part of it"""
+        async def handler(event):
+            pass
+
+        queue = WebhookEventQueue(handler, max_size=2, workers=1)
+        queue.put_events([make_event('user-1', '0')])
+
+        with pytest.raises(asyncio.QueueFull):
+            queue.put_events([make_event('user-1', '1'), make_event('user-1', '2')])
+        assert queue.depth == 1
+        assert queue.stats()['rejected'] == 2
+
+    def test_webhook_acknowledges_before_processing(self):
+        """Test the webhook enqueues signed events and returns without running handlers"""
+        from line_bot.app import app, parser
+        from line_bot.dedup import WebhookEventDeduplicator
+
+        def make_payload(webhook_event_id):
+            return json.dumps({
+                "destination": "test-destination",
+                "events": [{
+                    "type": "message",
+                    "message": {"type": "text", "id": "1", "text": "events"},
+                    "source": {"type": "user", "userId": "test-user"},
+                    "replyToken": "test-reply-token",
+                    "timestamp": 0,
+                    "mode": "active",
+                    "webhookEventId": webhook_event_id,
+                    "deliveryContext": {"isRedelivery": False}
+                }]
+            })
+
+        def sign(payload):
+            return base64.b64encode(
+                hmac.new(parser.signature_validator.channel_secret, payload.encode('utf-8'), hashlib.sha256).digest()
+            ).decode('utf-8')
+
+        async def handler(event):
+            raise AssertionError("handler must not run inside the request")
+
+        # ワーカーを起動していないキューで受信のみを確認
+        queue = WebhookEventQueue(handler, max_size=1, workers=1)
+        with patch('line_bot.app.webhook_queue', queue), \
+             patch('line_bot.app.webhook_dedup', WebhookEventDeduplicator()):
+            client = TestClient(app)
+            payload = make_payload('test-webhook-id-1')
+            response = client.post("/webhook", content=payload, headers={"X-Line-Signature": sign(payload)})
+            assert response.status_code == 200
+            assert queue.depth == 1
+
+            # キューが満杯の場合は503
+            payload = make_payload('test-webhook-id-2')
+            response = client.post("/webhook", content=payload, headers={"X-Line-Signature": sign(payload)})
+            assert response.status_code == 503
@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import MagicMock
+from linebot.models import TextSendMessage
+from line_bot.dispatcher import LineDispatcher
+from reminder.fanout import MulticastFanout, MULTICAST_MAX_RECIPIENTS
+
+@pytest.mark.unit
+@pytest.mark.reminder
+class TestMulticastFanout:
+    @pytest.fixture
+    def mock_line_bot_api(self):
+        """Set up LINE Bot API mock"""
+        mock = MagicMock()
+        mock.multicast = MagicMock()
+        return mock
+
+    def test_make_batches(self, mock_line_bot_api):
+        """Test recipients are deduplicated and split into multicast batches"""
+        fanout = MulticastFanout(LineDispatcher(mock_line_bot_api))
+        recipients = [f'user-{i}' for i in range(1200)] + ['user-0', None, '']
+
+        batches = fanout.make_batches(recipients)
+
+        assert [len(b) for b in batches] == [MULTICAST_MAX_RECIPIENTS, MULTICAST_MAX_RECIPIENTS, 200]
+        assert sum(batches, []) == [f'user-{i}' for i in range(1200)]
+
+    @pytest.mark.asyncio
+    async def test_send_reports_batch_results(self, mock_line_bot_api):
+        """Test per-batch success and failure reporting"""
+        # 2回目のバッチのみ失敗させる
+        mock_line_bot_api.multicast.side_effect = [None, Exception("Test error"), None]
+        fanout = MulticastFanout(LineDispatcher(mock_line_bot_api), batch_size=2, max_concurrency=1)
+
+        result = await fanout.send(['a', 'b', 'c', 'd', 'e'], TextSendMessage(text="test"))
+
+        assert mock_line_bot_api.multicast.call_count == 3
+        assert result.sent_count == 3
+        assert result.failed_count == 2
+        assert result.failed_batches[0].recipients == ['c', 'd']
+        assert "Test error" in result.failed_batches[0].error
+
+    @pytest.mark.asyncio
+    async def test_send_without_recipients(self, mock_line_bot_api):
+        """Test no API call is made when there are no recipients"""
+        fanout = MulticastFanout(LineDispatcher(mock_line_bot_api))
+
+        result = await fanout.send([], TextSendMessage(text="test"))
+
+        mock_line_bot_api.multicast.assert_not_called()
+        assert result.batches == []
@@ -1,4 +1,5 @@
 import pytest
+import asyncio
 from unittest.mock import MagicMock, patch, AsyncMock, PropertyMock
 from linebot.models import (
     MessageEvent,
@@ -22,58 +23,47 @@ class TestLineBot:
             mock.get_profile = AsyncMock(return_value=MagicMock(display_name="Test User"))
             return mock
 
-    def create_mock_query_chain(self, result):
-        """Create a mock query chain with a specific result"""
-        mock_chain = MagicMock()
-        mock_chain.select.return_value = mock_chain
-        mock_chain.eq.return_value = mock_chain
-        mock_chain.gte.return_value = mock_chain
-        mock_chain.order.return_value = mock_chain
-        mock_chain.range.return_value = mock_chain
-        mock_chain.execute.return_value = MagicMock(data=result, count=len(result))
-        return mock_chain
-
-    def setup_supabase_mock(self, mock_supabase, event_data, user_data=None, participant_data=None):
-        """Set up Supabase mock with proper chaining"""
-        # イベントテーブルのモック
-        mock_events = self.create_mock_query_chain(event_data)
-        
-        # ユーザーテーブルのモック
-        mock_users = self.create_mock_query_chain([user_data] if user_data else [])
-        
-        # 参加者テーブルのモック
-        mock_participants = self.create_mock_query_chain(participant_data if participant_data else [])
-        
-        # insertとdeleteのモック
-        mock_insert = MagicMock()
-        mock_insert.execute.return_value = MagicMock(data=[{'id': 'new-id'}])
-        
-        mock_delete = MagicMock()
-        mock_delete.eq.return_value = mock_delete
-        mock_delete.execute.return_value = MagicMock(data=[{'id': 'deleted-id'}])
-
-        # テーブル選択のモック
-        def mock_table_side_effect(table_name):
-            table = MagicMock()
-            if table_name == 'events':
-                table.select.return_value = mock_events
-                table.insert.return_value = mock_insert
-            elif table_name == 'users':
-                table.select.return_value = mock_users
-                table.insert.return_value = mock_insert
-            elif table_name == 'participants':
-                table.select.return_value = mock_participants
-                table.insert.return_value = mock_insert
-                table.delete.return_value = mock_delete
-            return table
-
-        mock_supabase.table.side_effect = mock_table_side_effect
-        return mock_events
+    def setup_repository_mock(self, mock_repository, event_data, user_data=None, participant_data=None):
+        """Set up repository mock responses"""
+        # イベントのモック
+        mock_repository.get_event.return_value = event_data[0] if event_data else None
+        mock_repository.list_upcoming_events.return_value = event_data
+        mock_repository.count_upcoming_events.return_value = len(event_data)
+
+        participant_data = participant_data if participant_data else []
+
+        # 参加登録（join_event）のモック
+        if not event_data:
+            join_status = 'event_not_found'
+        elif participant_data:
+            join_status = 'already_registered'
+        else:
+            join_status = 'joined'
+        mock_repository.join_event.return_value = {
+            'status': join_status,
+            'event': event_data[0] if event_data else None
+        }
+
+        # キャンセル（cancel_participation）のモック
+        if not event_data:
+            cancel_status = 'event_not_found'
+        elif not user_data:
+            cancel_status = 'user_not_found'
+        elif not participant_data:
+            cancel_status = 'not_registered'
+        else:
+            cancel_status = 'cancelled'
+        mock_repository.cancel_participation.return_value = {
+            'status': cancel_status,
+            'event': event_data[0] if event_data else None,
+            'participant_count': max(len(participant_data) - 1, 0)
+        }
+        return mock_repository
 
     @pytest.mark.asyncio
-    async def test_handle_events_command(self, mock_line_bot_api, event_data, mock_supabase):
+    async def test_handle_events_command(self, mock_line_bot_api, event_data, mock_repository):
         """Test handling events command"""
-        # Supabaseのモックレスポンスの設定
+        # リポジトリのモックレスポンスの設定
         future_time = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
         result_data = [{
             'id': event_data['id'],
@@ -85,9 +75,9 @@ class TestLineBot:
             'event_id': event_data['id']
         }]
         
-        self.setup_supabase_mock(mock_supabase, result_data)
+        self.setup_repository_mock(mock_repository, result_data)
         
-        with patch('line_bot.app.supabase', mock_supabase), \
+        with patch('line_bot.app.repository', mock_repository), \
              patch('line_bot.app.line_bot_api', mock_line_bot_api):
             # メッセージイベントの作成
             event = MessageEvent(
@@ -109,9 +99,9 @@ class TestLineBot:
             assert event_data['location'] in text_message.text
 
     @pytest.mark.asyncio
-    async def test_handle_join_postback(self, mock_line_bot_api, event_data, mock_supabase):
+    async def test_handle_join_postback(self, mock_line_bot_api, event_data, mock_repository):
         """Test handling join postback"""
-        # Supabaseのモックレスポンスの設定
+        # リポジトリのモックレスポンスの設定
         future_time = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
         result_data = [{
             'id': event_data['id'],
@@ -128,9 +118,9 @@ class TestLineBot:
             'name': 'Test User'
         }
         
-        self.setup_supabase_mock(mock_supabase, result_data, user_data)
+        self.setup_repository_mock(mock_repository, result_data, user_data)
         
-        with patch('line_bot.app.supabase', mock_supabase), \
+        with patch('line_bot.app.repository', mock_repository), \
              patch('line_bot.app.line_bot_api', mock_line_bot_api):
             # ポストバックイベントの作成
             event = PostbackEvent(
@@ -152,9 +142,9 @@ class TestLineBot:
             assert event_data['name'] in text_message.text
 
     @pytest.mark.asyncio
-    async def test_handle_event_info(self, mock_line_bot_api, event_data, mock_supabase):
+    async def test_handle_event_info(self, mock_line_bot_api, event_data, mock_repository):
         """Test handling event info command"""
-        # Supabaseのモックレスポンスの設定
+        # リポジトリのモックレスポンスの設定
         future_time = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
         result_data = [{
             'id': event_data['id'],
@@ -175,9 +165,9 @@ class TestLineBot:
             'name': 'Test User'
         }
         
-        self.setup_supabase_mock(mock_supabase, result_data, user_data)
+        self.setup_repository_mock(mock_repository, result_data, user_data)
         
-        with patch('line_bot.app.supabase', mock_supabase), \
+        with patch('line_bot.app.repository', mock_repository), \
              patch('line_bot.app.line_bot_api', mock_line_bot_api):
             # メッセージイベントの作成
             event = MessageEvent(
@@ -199,9 +189,9 @@ class TestLineBot:
             assert event_data['location'] in text_message.text
 
     @pytest.mark.asyncio
-    async def test_handle_cancel_registration(self, mock_line_bot_api, event_data, mock_supabase):
+    async def test_handle_cancel_registration(self, mock_line_bot_api, event_data, mock_repository):
         """Test handling cancel registration"""
-        # Supabaseのモックレスポンスの設定
+        # リポジトリのモックレスポンスの設定
         result_data = [{
             'id': event_data['id'],
             'name': event_data['name'],
@@ -221,9 +211,9 @@ class TestLineBot:
             'status': 'registered'
         }]
         
-        self.setup_supabase_mock(mock_supabase, result_data, user_data, participant_data)
+        self.setup_repository_mock(mock_repository, result_data, user_data, participant_data)
         
-        with patch('line_bot.app.supabase', mock_supabase), \
+        with patch('line_bot.app.repository', mock_repository), \
              patch('line_bot.app.line_bot_api', mock_line_bot_api):
             # ポストバックイベントの作成
             event = PostbackEvent(
@@ -242,4 +232,197 @@ class TestLineBot:
             text_message = args[0][1]
             assert isinstance(text_message, TextSendMessage)
             assert "キャンセル" in text_message.text
-            assert event_data['name'] in text_message.text
\ No newline at end of file
+            assert event_data['name'] in text_message.text
+
+    @pytest.mark.asyncio
+    async def test_join_fetches_profile_only_for_new_users(self, mock_line_bot_api, event_data, mock_repository):
+        """Test join is one RPC and the LINE profile is fetched only when the user is unknown"""
+        future_time = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+        event = dict(event_data, start_date=future_time)
+        mock_repository.join_event.side_effect = [
+            {'status': 'profile_required', 'event': event},
+            {'status': 'joined', 'event': event, 'participant_count': 1}
+        ]
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import handle_event_join
+            await handle_event_join("test-reply-token", event_data['event_id'], "test-user")
+
+        mock_line_bot_api.get_profile.assert_called_once_with("test-user")
+        assert mock_repository.join_event.call_args_list[1][0] == (event_data['event_id'], "test-user", "Test User")
+        text_message = mock_line_bot_api.reply_message.call_args[0][1]
+        assert "参加登録が完了しました" in text_message.text
+
+    @pytest.mark.asyncio
+    async def test_join_already_waitlisted(self, mock_line_bot_api, event_data, mock_repository):
+        """Test the join status returned by the database is reported without further queries"""
+        mock_repository.join_event.return_value = {'status': 'already_waitlisted', 'event': event_data}
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import handle_event_join
+            await handle_event_join("test-reply-token", event_data['event_id'], "test-user")
+
+        mock_repository.join_event.assert_called_once()
+        mock_line_bot_api.get_profile.assert_not_called()
+        text_message = mock_line_bot_api.reply_message.call_args[0][1]
+        assert "キャンセル待ち" in text_message.text
+
+    @pytest.mark.asyncio
+    async def test_cancel_is_single_rpc(self, mock_line_bot_api, event_data, mock_repository):
+        """Test cancel runs one database call and invalidates cached recipients"""
+        from reminder.recipients import recipient_cache
+        recipient_cache.set(event_data['id'], ['test-user'])
+        mock_repository.cancel_participation.return_value = {
+            'status': 'cancelled',
+            'event': event_data,
+            'participant_count': 0
+        }
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import handle_event_cancel
+            await handle_event_cancel("test-reply-token", event_data['event_id'], "test-user")
+
+        mock_repository.cancel_participation.assert_called_once_with(event_data['event_id'], "test-user", user_uuid=None)
+        assert recipient_cache.get(event_data['id']) is None
+        text_message = mock_line_bot_api.reply_message.call_args[0][1]
+        assert "キャンセル" in text_message.text
+
+    @pytest.mark.asyncio
+    async def test_cancel_of_last_participant_removes_event_from_search(self, mock_line_bot_api, event_data, mock_repository):
+        """Test an event moved to pending by the last cancellation is dropped from the search index"""
+        from database.search import event_search_index
+        event_search_index.build([event_data])
+        # 最後の参加者のキャンセルでpendingに変更されたイベント
+        mock_repository.cancel_participation.return_value = {
+            'status': 'cancelled',
+            'event': dict(event_data, status='pending'),
+            'participant_count': 0
+        }
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import handle_event_cancel
+            await handle_event_cancel("test-reply-token", event_data['event_id'], "test-user")
+
+        assert len(event_search_index) == 0
+        event_search_index.clear()
+
+    @pytest.mark.asyncio
+    async def test_events_next_continues_from_cursor(self, mock_line_bot_api, mock_repository):
+        """Test 'events next' shows the page after the one the user last saw and stops at the end"""
+        start = datetime.now(timezone.utc) + timedelta(days=1)
+        mock_repository.list_upcoming_events.return_value = [
+            {
+                'id': f'event-{i}',
+                'event_id': f'{i}',
+                'name': f'Event {i}',
+                'start_date': (start + timedelta(hours=i)).isoformat(),
+                'location': 'Test Location',
+                'description': 'Test Description'
+            }
+            for i in range(7)
+        ]
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import show_event_list, event_list_cursors
+            event_list_cursors.clear()
+            await show_event_list("token-1", "test-user")
+            await show_event_list("token-2", "test-user", next_page=True)
+            await show_event_list("token-3", "test-user", next_page=True)
+
+        texts = [c[0][1].text for c in mock_line_bot_api.reply_message.call_args_list]
+        assert "Event 4" in texts[0] and "Event 5" not in texts[0]
+        assert "Event 5" in texts[1] and "Event 6" in texts[1]
+        assert "ページ 2/2" in texts[1]
+        assert "events next" not in texts[1]
+        assert "これ以上のイベントはありません" in texts[2]
+        # 一覧の読み込みは1回のみ
+        mock_repository.list_upcoming_events.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_search_command_uses_index(self, mock_line_bot_api, mock_repository):
+        """Test the search command is answered from the in-memory index"""
+        from database.search import event_search_index
+        event_search_index.build([{
+            'id': 'event-uuid',
+            'event_id': '123',
+            'name': '東京もくもく会',
+            'description': 'Test Description',
+            'location': '渋谷',
+            'status': 'scheduled',
+            'start_date': (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        }])
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            event = MessageEvent(
+                message=TextMessage(text="search もくもく"),
+                reply_token="test-reply-token",
+                source=SourceUser(user_id="test-user")
+            )
+            from line_bot.app import handle_message
+            await handle_message(event)
+
+        text_message = mock_line_bot_api.reply_message.call_args[0][1]
+        assert "東京もくもく会" in text_message.text
+        assert "join 123" in text_message.text
+        # DBへの問い合わせなし
+        mock_repository.list_upcoming_events.assert_not_called()
+        mock_repository.search_events.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_join_and_cancel_use_event_cache(self, mock_line_bot_api, event_data, mock_repository):
+        """Test unknown events are answered from the event cache and cached rows never reject a join"""
+        from database.cache import event_record_cache
+        past_time = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        future_time = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        mock_repository.join_event.side_effect = [
+            {'status': 'event_not_found'},
+            {'status': 'joined', 'event': dict(event_data, start_date=future_time), 'participant_count': 1}
+        ]
+        # 別プロセスで開始日時が変更される前の行がキャッシュに残っている
+        event_record_cache.set('rescheduled-event', dict(event_data, start_date=past_time))
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import handle_event_join, handle_event_cancel
+            # 1回目はDBに問い合わせ、存在しないことを記録する
+            await handle_event_join("token-1", "unknown-event", "test-user")
+            await handle_event_join("token-2", "unknown-event", "test-user")
+            await handle_event_cancel("token-3", "unknown-event", "test-user")
+            await handle_event_join("token-4", "rescheduled-event", "test-user")
+
+        # 開始済みかどうかはキャッシュではなくjoin_eventで判定する
+        assert mock_repository.join_event.call_count == 2
+        assert mock_repository.join_event.call_args[0][0] == "rescheduled-event"
+        mock_repository.cancel_participation.assert_not_called()
+        texts = [c[0][1].text for c in mock_line_bot_api.reply_message.call_args_list]
+        assert all("見つかりませんでした" in text for text in texts[:3])
+        assert "参加登録が完了しました" in texts[3]
+
+@pytest.mark.unit
+@pytest.mark.line
+class TestAsyncLineClient:
+    @pytest.mark.asyncio
+    async def test_session_is_pooled_per_loop(self):
+        """Test one pooled session is reused for all calls on the running loop"""
+        from line_bot.client import AsyncLineClient
+
+        client = AsyncLineClient('test-token', pool_size=10)
+        api = client._api()
+        session = client._clients[asyncio.get_running_loop()][0]
+
+        assert client._api() is api
+        assert session.connector.limit == 10
+
+        with patch.object(api, 'push_message', new_callable=AsyncMock) as mock_push:
+            await client.push_message('user-1', TextSendMessage(text="test"))
+        mock_push.assert_called_once()
+
+        await client.close()
+        assert session.closed
+        assert client._clients == {}
@@ -0,0 +1,187 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+from unittest.mock import MagicMock
+from line_bot.dispatcher import LineDispatcher
+from reminder.outbox import TriggerOutboxConsumer, MAX_ATTEMPTS
+
+
+def make_trigger(trigger_id, event_id, condition, seconds_ago=10):
+    """Build a trigger row created the given seconds ago"""
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    return {
+        'id': trigger_id,
+        'event_id': event_id,
+        'trigger_condition': condition,
+        'message_content': f'{condition} message',
+        'created_at': created_at.isoformat()
+    }
+
+
+@pytest.mark.unit
+@pytest.mark.reminder
+class TestTriggerOutboxConsumer:
+    @pytest.fixture
+    def mock_line_bot_api(self):
+        """Set up LINE Bot API mock"""
+        mock = MagicMock()
+        mock.multicast = MagicMock()
+        mock.broadcast = MagicMock()
+        return mock
+
+    @pytest.fixture
+    def consumer(self, mock_repository, mock_line_bot_api):
+        """Set up consumer holding the outbox lease"""
+        mock_repository.acquire_trigger_outbox.return_value = {
+            'consumer': 'line',
+            'last_created_at': '2024-01-27T00:00:00+00:00',
+            'last_trigger_id': '00000000-0000-0000-0000-000000000000'
+        }
+        mock_repository.advance_trigger_outbox.return_value = True
+        mock_repository.list_participant_line_ids.return_value = ['line-user-1', 'line-user-2']
+        # broadcastのレート制限で待たないようにする
+        dispatcher = LineDispatcher(mock_line_bot_api, rate_limits={'broadcast': 1000})
+        return TriggerOutboxConsumer(
+            mock_repository, dispatcher, batch_size=10, broadcast_conditions=('event_created',)
+        )
+
+    @pytest.mark.asyncio
+    async def test_delivers_and_advances_cursor(self, consumer, mock_repository, mock_line_bot_api):
+        """Test created triggers are broadcast, others multicast, and the cursor advances"""
+        triggers = [
+            make_trigger('t1', 'event-1', 'event_created'),
+            make_trigger('t2', 'event-2', 'event_updated'),
+            make_trigger('t3', 'event-2', 'event_cancelled')
+        ]
+        mock_repository.list_triggers_after.return_value = triggers
+
+        processed = await consumer.process_outbox()
+
+        assert processed == 3
+        mock_line_bot_api.broadcast.assert_called_once()
+        assert [m.text for m in mock_line_bot_api.broadcast.call_args[0][0]] == ['event_created message']
+        assert mock_line_bot_api.multicast.call_count == 2
+        assert mock_line_bot_api.multicast.call_args[0][0] == ['line-user-1', 'line-user-2']
+        # 参加者はバッチ内で1回だけ読み込む
+        mock_repository.list_participant_line_ids.assert_called_once_with('event-2')
+        mock_repository.advance_trigger_outbox.assert_called_once_with(
+            'line', consumer.worker_id, triggers[-1]['created_at'], 't3'
+        )
+
+        stats = consumer.stats()
+        assert stats['delivered'] == 3
+        assert stats['recipients'] == 4
+        assert stats['throughput_per_sec'] > 0
+        assert stats['delivery_latency']['p50_ms'] >= 10000
+
+    @pytest.mark.asyncio
+    async def test_lease_not_acquired(self, consumer, mock_repository, mock_line_bot_api):
+        """Test nothing is read while another worker holds the lease"""
+        mock_repository.acquire_trigger_outbox.return_value = None
+
+        assert await consumer.process_outbox() == 0
+
+        mock_repository.list_triggers_after.assert_not_called()
+        mock_line_bot_api.broadcast.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_created_triggers_not_broadcast_by_default(self, mock_repository, mock_line_bot_api):
+        """Test created triggers go to event participants unless broadcast is enabled"""
+        mock_repository.acquire_trigger_outbox.return_value = {
+            'consumer': 'line',
+            'last_created_at': '2024-01-27T00:00:00+00:00',
+            'last_trigger_id': '00000000-0000-0000-0000-000000000000'
+        }
+        mock_repository.advance_trigger_outbox.return_value = True
+        mock_repository.list_participant_line_ids.return_value = ['line-user-1']
+        mock_repository.list_triggers_after.return_value = [make_trigger('t1', 'event-1', 'event_created')]
+        consumer = TriggerOutboxConsumer(mock_repository, LineDispatcher(mock_line_bot_api), batch_size=10)
+
+        assert await consumer.process_outbox() == 1
+
+        # 友だち全員へのbroadcastは設定で有効にした場合のみ
+        mock_line_bot_api.broadcast.assert_not_called()
+        assert mock_line_bot_api.multicast.call_args[0][0] == ['line-user-1']
+
+    @pytest.mark.asyncio
+    async def test_created_trigger_without_participants_is_skipped(self, mock_repository, mock_line_bot_api):
+        """Test with the default configuration a new event's trigger is counted as skipped, not delivered"""
+        mock_repository.acquire_trigger_outbox.return_value = {
+            'consumer': 'line',
+            'last_created_at': '2024-01-27T00:00:00+00:00',
+            'last_trigger_id': '00000000-0000-0000-0000-000000000000'
+        }
+        mock_repository.advance_trigger_outbox.return_value = True
+        # 作成直後のイベントには参加者がいない
+        mock_repository.list_participant_line_ids.return_value = []
+        mock_repository.list_triggers_after.return_value = [make_trigger('t1', 'event-1', 'event_created')]
+        consumer = TriggerOutboxConsumer(mock_repository, LineDispatcher(mock_line_bot_api), batch_size=10)
+
+        assert await consumer.process_outbox() == 1
+
+        mock_line_bot_api.broadcast.assert_not_called()
+        mock_line_bot_api.multicast.assert_not_called()
+        stats = consumer.stats()
+        assert stats['delivered'] == 0
+        assert stats['skipped'] == 1
+
+    @pytest.mark.asyncio
+    async def test_failure_stops_cursor_before_failed_trigger(self, consumer, mock_repository, mock_line_bot_api):
+        """Test the cursor only advances past triggers delivered in order"""
+        triggers = [
+            make_trigger('t1', 'event-1', 'event_updated'),
+            make_trigger('t2', 'event-2', 'event_updated'),
+            make_trigger('t3', 'event-1', 'event_cancelled')
+        ]
+        mock_repository.list_triggers_after.return_value = triggers
+        mock_repository.list_participant_line_ids.side_effect = lambda event_id: (
+            ['line-user-1'] if event_id == 'event-1' else ['line-user-2']
+        )
+        # event-2への送信のみ失敗させる
+        def multicast(to, messages, **kwargs):
+            if to == ['line-user-2']:
+                raise Exception("Test error")
+        mock_line_bot_api.multicast.side_effect = multicast
+
+        await consumer.process_outbox()
+
+        # t1は配信済み、t2で止まる（t3は別イベントなので送信済みだが位置はt1まで）
+        mock_repository.advance_trigger_outbox.assert_called_once_with(
+            'line', consumer.worker_id, triggers[0]['created_at'], 't1'
+        )
+        assert consumer.failed == 1
+        assert consumer.failed_attempts == {'t2': 1}
+
+    @pytest.mark.asyncio
+    async def test_skips_trigger_after_max_attempts(self, consumer, mock_repository, mock_line_bot_api):
+        """Test a trigger that keeps failing is skipped so later ones are delivered"""
+        triggers = [make_trigger('t1', 'event-1', 'event_created')]
+        mock_repository.list_triggers_after.return_value = triggers
+        mock_line_bot_api.broadcast.side_effect = Exception("Test error")
+
+        for _ in range(MAX_ATTEMPTS - 1):
+            await consumer.process_outbox()
+        mock_repository.advance_trigger_outbox.assert_not_called()
+
+        await consumer.process_outbox()
+
+        mock_repository.advance_trigger_outbox.assert_called_once()
+        assert consumer.skipped == 1
+        assert consumer.failed_attempts == {}
+
+    @pytest.mark.asyncio
+    async def test_reads_until_short_batch(self, consumer, mock_repository, mock_line_bot_api):
+        """Test full batches are followed by another read within the same poll"""
+        consumer.batch_size = 2
+        first = [make_trigger('t1', 'event-1', 'event_created'), make_trigger('t2', 'event-2', 'event_created')]
+        second = [make_trigger('t3', 'event-3', 'event_created', seconds_ago=5)]
+        mock_repository.list_triggers_after.side_effect = [first, second]
+
+        assert await consumer.process_outbox() == 3
+
+        assert mock_repository.list_triggers_after.call_count == 2
+        assert mock_repository.advance_trigger_outbox.call_count == 2
+        # 同じバッチのbroadcastは1回の送信にまとめる
+        assert mock_line_bot_api.broadcast.call_count == 2
+        assert len(mock_line_bot_api.broadcast.call_args_list[0][0][0]) == 2
+        # リースはバッチごとに延長する
+        assert mock_repository.acquire_trigger_outbox.call_count == 2
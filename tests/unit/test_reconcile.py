@@ -0,0 +1,128 @@
+import pytest
+import discord
+from unittest.mock import MagicMock, AsyncMock
+from datetime import datetime, timezone, timedelta
+from discord_bot.reconcile import reconcile_scheduled_events
+from discord_bot.sync import scheduled_event_data
+
+START = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+
+def make_scheduled_event(event_id, name='Test Event', status=discord.EventStatus.scheduled):
+    """Create a mock Discord scheduled event"""
+    event = MagicMock()
+    event.id = event_id
+    event.name = name
+    event.description = 'Test Description'
+    event.location = 'Test Location'
+    event.start_time = START
+    event.end_time = None
+    event.creator_id = 42
+    event.status = status
+    return event
+
+def make_guild(guild_id, events=None, error=None):
+    """Create a mock guild returning scheduled events"""
+    guild = MagicMock()
+    guild.id = guild_id
+    guild.fetch_scheduled_events = AsyncMock(return_value=events or [], side_effect=error)
+    return guild
+
+def make_bot(guilds):
+    """Create a mock bot whose fetch_guilds yields the given guilds"""
+    async def fetch_guilds(limit=None):
+        for guild in guilds:
+            yield guild
+    bot = MagicMock()
+    bot.fetch_guilds = fetch_guilds
+    return bot
+
+def db_row(event, **overrides):
+    """Create the events row stored for a scheduled event"""
+    row = dict(scheduled_event_data(event, 'scheduled'), id=f'uuid-{event.id}')
+    # DBは日時を別の表記で返す
+    row['start_date'] = START.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    row.update(overrides)
+    return row
+
+@pytest.mark.unit
+@pytest.mark.discord
+class TestReconcileScheduledEvents:
+    @pytest.mark.asyncio
+    async def test_only_changes_are_upserted(self, mock_repository):
+        """Test new and changed events are upserted while unchanged and vanished events are handled"""
+        unchanged = make_scheduled_event(1)
+        renamed = make_scheduled_event(2, name='Renamed')
+        created = make_scheduled_event(3)
+        bot = make_bot([make_guild(10, [unchanged, renamed]), make_guild(20, [created])])
+        mock_repository.list_events_by_event_ids.return_value = [
+            db_row(unchanged),
+            db_row(renamed, name='Old Name')
+        ]
+        deleted = db_row(make_scheduled_event(4))
+        mock_repository.list_upcoming_events.return_value = [db_row(unchanged), deleted]
+        mock_repository.upsert_events.side_effect = lambda rows: rows
+
+        result = await reconcile_scheduled_events(bot, mock_repository)
+
+        mock_repository.list_events_by_event_ids.assert_called_once()
+        mock_repository.upsert_events.assert_called_once()
+        rows = mock_repository.upsert_events.call_args[0][0]
+        assert [(row['event_id'], row['status']) for row in rows] == [
+            ('2', 'scheduled'), ('3', 'scheduled'), ('4', 'cancelled')
+        ]
+        assert rows[0]['name'] == 'Renamed'
+        # 一括upsertのため全行の列を揃える
+        assert len({tuple(sorted(row)) for row in rows}) == 1
+        assert (result.created, result.updated, result.cancelled, result.unchanged) == (1, 1, 1, 1)
+        assert (result.guilds, result.discord_events) == (2, 3)
+
+    @pytest.mark.asyncio
+    async def test_pending_events_are_not_rescheduled(self, mock_repository):
+        """Test events moved to pending in the database are only written for Discord-side changes"""
+        idle = make_scheduled_event(1)
+        renamed = make_scheduled_event(2, name='Renamed')
+        cancelled = make_scheduled_event(3, status=discord.EventStatus.cancelled)
+        bot = make_bot([make_guild(10, [idle, renamed, cancelled])])
+        # 参加者0人でpendingになったイベント
+        mock_repository.list_events_by_event_ids.return_value = [
+            db_row(idle, status='pending'),
+            db_row(renamed, name='Old Name', status='pending'),
+            db_row(cancelled, status='pending')
+        ]
+        mock_repository.upsert_events.side_effect = lambda rows: rows
+
+        result = await reconcile_scheduled_events(bot, mock_repository)
+
+        rows = mock_repository.upsert_events.call_args[0][0]
+        assert [(row['event_id'], row['status']) for row in rows] == [('2', 'pending'), ('3', 'cancelled')]
+        assert rows[0]['name'] == 'Renamed'
+        assert (result.updated, result.unchanged) == (2, 1)
+
+    @pytest.mark.asyncio
+    async def test_failed_guild_skips_cancellation(self, mock_repository):
+        """Test events missing from Discord are not cancelled when a guild could not be fetched"""
+        bot = make_bot([make_guild(10, [make_scheduled_event(1)]), make_guild(20, error=Exception("forbidden"))])
+        mock_repository.list_events_by_event_ids.return_value = []
+        mock_repository.upsert_events.side_effect = lambda rows: rows
+
+        result = await reconcile_scheduled_events(bot, mock_repository)
+
+        assert result.failed_guilds == 1
+        assert result.cancelled == 0
+        mock_repository.list_upcoming_events.assert_not_called()
+        assert [row['event_id'] for row in mock_repository.upsert_events.call_args[0][0]] == ['1']
+
+    @pytest.mark.asyncio
+    async def test_large_catalogue_is_chunked(self, mock_repository):
+        """Test thousands of events are looked up and written in a few bulk requests"""
+        events = [make_scheduled_event(i) for i in range(1200)]
+        bot = make_bot([make_guild(g, events[g * 100:(g + 1) * 100]) for g in range(12)])
+        mock_repository.list_events_by_event_ids.return_value = []
+        mock_repository.upsert_events.side_effect = lambda rows: rows
+
+        result = await reconcile_scheduled_events(bot, mock_repository)
+
+        assert result.created == 1200
+        assert mock_repository.list_events_by_event_ids.call_count == 6
+        assert mock_repository.upsert_events.call_count == 3
+        assert len(result.rows) == 1200
@@ -1,8 +1,11 @@
 import pytest
+import asyncio
 from unittest.mock import MagicMock, patch, AsyncMock
 from datetime import datetime, timezone, timedelta
 from linebot.models import TextSendMessage
-from reminder.scheduler import ReminderScheduler
+from reminder.scheduler import ReminderScheduler, MAX_ATTEMPTS, RETRY_DELAY_SECONDS, run_scheduler
+from reminder.timer import ReminderTimer
+from reminder.recipients import RecipientCache
 
 @pytest.mark.unit
 @pytest.mark.reminder
@@ -14,12 +17,6 @@ class TestReminderScheduler:
         mock.push_message = AsyncMock()
         return mock
 
-    @pytest.fixture
-    def mock_supabase(self):
-        """Set up Supabase mock"""
-        mock = MagicMock()
-        return mock
-
     def create_mock_reminder(self, event_data, reminder_type='1hour'):
         """Create a mock reminder data"""
         start_time = datetime.now(timezone.utc) + timedelta(hours=1)
@@ -36,6 +33,7 @@ class TestReminderScheduler:
                 'name': event_data['name'],
                 'description': event_data['description'],
                 'start_time': start_time.isoformat(),
+                'start_date': start_time.isoformat(),
                 'location': event_data['location'],
                 'status': 'scheduled'
             },
@@ -56,14 +54,14 @@ class TestReminderScheduler:
         }
 
     @pytest.mark.asyncio
-    async def test_process_reminders(self, mock_line_bot_api, mock_supabase, event_data):
+    async def test_process_reminders(self, mock_line_bot_api, mock_repository, event_data):
         """Test reminder processing"""
         # リマインダーデータの設定
         reminder = self.create_mock_reminder(event_data)
-        mock_supabase.table().select().eq().lte().execute.return_value.data = [reminder]
+        mock_repository.claim_due_reminders.return_value = [reminder]
         
         # スケジューラーの作成と実行
-        scheduler = ReminderScheduler(mock_supabase, mock_line_bot_api)
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
         await scheduler.process_reminders()
 
         # 通知の送信を確認
@@ -79,15 +77,15 @@ class TestReminderScheduler:
             assert event_data['location'] in args[1].text
 
         # リマインダーのステータス更新を確認
-        mock_supabase.table().update.assert_called_once()
-        update_call = mock_supabase.table().update.call_args[0][0]
-        assert update_call['is_sent'] is True
-        assert 'sent_at' in update_call
+        mock_repository.mark_reminders_sent.assert_called_once()
+        marked_ids, worker_id = mock_repository.mark_reminders_sent.call_args[0]
+        assert marked_ids == [reminder['id']]
+        assert worker_id == scheduler.worker_id
 
     @pytest.mark.asyncio
-    async def test_reminder_message_creation(self, mock_line_bot_api, mock_supabase, event_data):
+    async def test_reminder_message_creation(self, mock_line_bot_api, mock_repository, event_data):
         """Test reminder message creation for different types"""
-        scheduler = ReminderScheduler(mock_supabase, mock_line_bot_api)
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
 
         # 各リマインダータイプのメッセージをテスト
         reminder_types = {
@@ -106,32 +104,309 @@ class TestReminderScheduler:
             assert event_data['description'] in message
 
     @pytest.mark.asyncio
-    async def test_cancelled_event_reminder(self, mock_line_bot_api, mock_supabase, event_data):
+    async def test_cancelled_event_reminder(self, mock_line_bot_api, mock_repository, event_data):
         """Test handling of cancelled event reminders"""
         # キャンセルされたイベントのリマインダー
         reminder = self.create_mock_reminder(event_data)
         reminder['events']['status'] = 'cancelled'
         
-        mock_supabase.table().select().eq().lte().execute.return_value.data = [reminder]
+        mock_repository.claim_due_reminders.return_value = [reminder]
         
         # スケジューラーの作成と実行
-        scheduler = ReminderScheduler(mock_supabase, mock_line_bot_api)
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
         await scheduler.process_reminders()
 
         # キャンセルされたイベントの通知は送信されないことを確認
         mock_line_bot_api.push_message.assert_not_called()
 
     @pytest.mark.asyncio
-    async def test_error_handling(self, mock_line_bot_api, mock_supabase, event_data):
+    async def test_error_handling(self, mock_line_bot_api, mock_repository, event_data):
         """Test error handling during reminder processing"""
         # エラーを発生させる設定
         reminder = self.create_mock_reminder(event_data)
-        mock_supabase.table().select().eq().lte().execute.return_value.data = [reminder]
-        mock_line_bot_api.push_message.side_effect = Exception("Test error")
+        mock_repository.claim_due_reminders.return_value = [reminder]
+        mock_repository.list_participant_line_ids.return_value = ['test-user-1', 'test-user-2']
+        # 2人の参加者にはmulticastでまとめて送信される
+        mock_line_bot_api.multicast = MagicMock(side_effect=Exception("Test error"))
 
         # スケジューラーの作成と実行
-        scheduler = ReminderScheduler(mock_supabase, mock_line_bot_api)
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
+        await scheduler.process_reminders()
+
+        # エラーが発生しても処理が継続し、誰にも届かなかったリマインダーは再試行のため解放される
+        mock_line_bot_api.multicast.assert_called_once()
+        mock_repository.release_reminders.assert_called_once_with([reminder['id']], scheduler.worker_id)
+        mock_repository.mark_reminders_sent.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_process_reminders_concurrently(self, mock_line_bot_api, mock_repository, event_data):
+        """Test due reminders are processed in parallel while keeping per-event order"""
+        # 3イベント × 2リマインダー
+        reminders = []
+        for index in range(3):
+            event = dict(event_data, id=f'event-{index}', start_date=datetime.now(timezone.utc).isoformat())
+            for order, reminder_type in enumerate(['3hours', '1hour']):
+                reminders.append({
+                    'id': f'reminder-{index}-{order}',
+                    'event_id': event['id'],
+                    'reminder_type': reminder_type,
+                    'scheduled_at': (datetime.now(timezone.utc) + timedelta(minutes=order)).isoformat(),
+                    'events': event
+                })
+        mock_repository.claim_due_reminders.return_value = list(reversed(reminders))
+
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api, max_workers=3)
+        sent = []
+        active = 0
+        max_active = 0
+
+        async def send_reminder(event_id, message, version=None):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            sent.append((event_id, message))
+            active -= 1
+
+        with patch.object(scheduler, 'send_reminder', side_effect=send_reminder):
+            await scheduler.process_reminders()
+
+        assert len(sent) == 6
+        assert max_active == 3
+        assert scheduler.queue_depth == 0
+        # 同じイベントのリマインダーは予定時刻順に送信される
+        for index in range(3):
+            messages = [m for e, m in sent if e == f'event-{index}']
+            assert '3時間後' in messages[0]
+            assert '1時間後' in messages[1]
+
+
+    @pytest.mark.asyncio
+    async def test_claim_due_reminders_with_lease(self, mock_line_bot_api, mock_repository, event_data):
+        """Test due reminders are claimed through the lease RPC and marked by the claiming worker"""
+        reminder = self.create_mock_reminder(event_data)
+        mock_repository.claim_due_reminders.return_value = [reminder]
+
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
+        with patch.object(scheduler, 'send_reminder', new_callable=AsyncMock):
+            await scheduler.process_reminders()
+
+        # リースの取得
+        worker_id, batch_size, lease_seconds, lookahead_seconds = mock_repository.claim_due_reminders.call_args[0]
+        assert worker_id == scheduler.worker_id
+        assert lease_seconds > 0
+
+        # 送信済みマークは自分がリースした行のみに適用される
+        mock_repository.mark_reminders_sent.assert_called_once_with([reminder['id']], scheduler.worker_id)
+
+    @pytest.mark.asyncio
+    async def test_batch_mark_as_sent(self, mock_line_bot_api, mock_repository, event_data):
+        """Test delivered reminders are marked with one bulk update and failures are released"""
+        reminders = []
+        for index in range(3):
+            reminder = self.create_mock_reminder(event_data)
+            reminder['id'] = f'reminder-{index}'
+            reminder['event_id'] = f'event-{index}'
+            reminder['events'] = dict(reminder['events'], id=f'event-{index}', start_date=reminder['events']['start_time'])
+            reminders.append(reminder)
+        mock_repository.claim_due_reminders.return_value = reminders
+
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
+
+        async def send_reminder(event_id, message, version=None):
+            if event_id == 'event-1':
+                raise Exception("Test error")
+
+        with patch.object(scheduler, 'send_reminder', side_effect=send_reminder):
+            await scheduler.process_reminders()
+
+        # 送信済みマークとリース解放がそれぞれ1回ずつ
+        mock_repository.mark_reminders_sent.assert_called_once()
+        marked_ids = mock_repository.mark_reminders_sent.call_args[0][0]
+        assert sorted(marked_ids) == ['reminder-0', 'reminder-2']
+        mock_repository.release_reminders.assert_called_once_with(['reminder-1'], scheduler.worker_id)
+        assert scheduler.failed_reminders == {'reminder-1': 1}
+        assert scheduler.pending_sent == set()
+
+    @pytest.mark.asyncio
+    async def test_failed_fanout_is_retried_until_limit(self, mock_line_bot_api, mock_repository, event_data):
+        """Test a reminder that reaches nobody is released for retry and marked failed after the attempt limit"""
+        reminder = self.create_mock_reminder(event_data)
+        mock_repository.claim_due_reminders.return_value = [reminder]
+        mock_repository.list_participant_line_ids.return_value = ['test-user-1', 'test-user-2']
+        # LINE APIの障害で全バッチが失敗する
+        mock_line_bot_api.multicast = MagicMock(side_effect=Exception("LINE unavailable"))
+
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api)
         await scheduler.process_reminders()
 
-        # エラーが発生しても処理が継続することを確認
-        mock_supabase.table().update.assert_called_once()  # リマインダーは送信済みとしてマークされる
\ No newline at end of file
+        mock_repository.mark_reminders_sent.assert_not_called()
+        mock_repository.release_reminders.assert_called_once_with([reminder['id']], scheduler.worker_id)
+        assert scheduler.failed_reminders == {reminder['id']: 1}
+
+        # 上限回数に達したら失敗としてマークし、再取得させない
+        for _ in range(MAX_ATTEMPTS - 1):
+            await scheduler.process_reminders()
+
+        assert mock_repository.release_reminders.call_count == MAX_ATTEMPTS - 1
+        mock_repository.mark_reminders_failed.assert_called_once_with([reminder['id']], scheduler.worker_id)
+        mock_repository.mark_reminders_sent.assert_not_called()
+        assert scheduler.failed_reminders == {}
+
+    @pytest.mark.asyncio
+    async def test_timer_mode_retries_released_reminders(self, mock_line_bot_api, mock_repository, event_data):
+        """Test timer mode puts a released reminder back on the timer instead of waiting for the next reload"""
+        reminder = self.create_mock_reminder(event_data)
+        reminder['events']['event_id'] = event_data['event_id']
+        mock_repository.claim_due_reminders.return_value = [reminder]
+        mock_repository.list_participant_line_ids.return_value = ['test-user-1', 'test-user-2']
+        mock_line_bot_api.multicast = MagicMock(side_effect=Exception("LINE unavailable"))
+
+        scheduler = ReminderScheduler(mock_repository, mock_line_bot_api, mode='timer')
+        started = datetime.now(timezone.utc)
+        await scheduler.process_reminders(lookahead_seconds=0)
+
+        mock_repository.release_reminders.assert_called_once_with([reminder['id']], scheduler.worker_id)
+        # ポーリングモードの次回の確認と同じ間隔で再試行する
+        assert len(scheduler.timer) == 1
+        deadline = scheduler.timer.next_deadline()
+        assert started + timedelta(seconds=RETRY_DELAY_SECONDS) <= deadline
+        assert deadline <= datetime.now(timezone.utc) + timedelta(seconds=RETRY_DELAY_SECONDS)
+        assert scheduler.timer.pop_due(deadline) == [reminder['id']]
+
+    @pytest.mark.asyncio
+    async def test_run_scheduler_entry_point(self, mock_repository):
+        """Test the standalone entry point runs the scheduler and the trigger outbox and closes its connections when stopped"""
+        line_client = MagicMock()
+        line_client.close = AsyncMock()
+        modes = []
+        outboxes = []
+
+        async def start(self):
+            modes.append(self.mode)
+            # 終了シグナルによるキャンセルを再現
+            raise asyncio.CancelledError()
+
+        async def start_outbox(self):
+            outboxes.append(self)
+            await asyncio.sleep(60)
+
+        with patch('database.repository.create_repository', return_value=mock_repository), \
+             patch('line_bot.client.AsyncLineClient', return_value=line_client), \
+             patch('config.settings.REMINDER_SCHEDULER_MODE', 'timer'), \
+             patch('config.settings.LINE_BROADCAST_TRIGGERS', ('event_created',)), \
+             patch.object(ReminderScheduler, 'start', start), \
+             patch('reminder.outbox.TriggerOutboxConsumer.start', start_outbox):
+            await run_scheduler()
+
+        assert modes == ['timer']
+        assert outboxes[0].broadcast_conditions == ('event_created',)
+        assert outboxes[0].running is False
+        line_client.close.assert_called_once()
+        mock_repository.close.assert_called_once()
+
+
+@pytest.mark.unit
+@pytest.mark.reminder
+class TestReminderTimer:
+    def test_pop_due_in_deadline_order(self):
+        """Test reminders are popped in scheduled order once due"""
+        now = datetime.now(timezone.utc)
+        timer = ReminderTimer()
+        timer.schedule('r2', now + timedelta(seconds=2), 'event-a')
+        timer.schedule('r1', now - timedelta(seconds=1), 'event-a')
+        timer.schedule('r3', now + timedelta(hours=1), 'event-b')
+
+        assert timer.next_deadline() == now - timedelta(seconds=1)
+        assert timer.pop_due(now) == ['r1']
+        assert timer.pop_due(now + timedelta(seconds=2)) == ['r2']
+        assert len(timer) == 1
+
+    def test_reschedule_and_cancel_event(self):
+        """Test rescheduling replaces the old deadline and event cancellation removes entries"""
+        now = datetime.now(timezone.utc)
+        timer = ReminderTimer()
+        timer.schedule('r1', now, 'event-a')
+        timer.schedule('r1', now + timedelta(minutes=10), 'event-a')
+        timer.schedule('r2', now + timedelta(minutes=5), 'event-b')
+
+        # 古い予定時刻では発火しない
+        assert timer.pop_due(now) == []
+        assert timer.next_deadline() == now + timedelta(minutes=5)
+
+        timer.cancel_event('event-b')
+        assert timer.next_deadline() == now + timedelta(minutes=10)
+
+    @pytest.mark.asyncio
+    async def test_timer_mode_fires_due_reminders(self, mock_repository, event_data):
+        """Test timer mode claims reminders without lookahead when a deadline passes"""
+        now = datetime.now(timezone.utc)
+        mock_repository.list_pending_reminders.return_value = [{
+            'id': 'test-reminder-id',
+            'scheduled_at': (now - timedelta(seconds=1)).isoformat(),
+            'events': {'event_id': event_data['event_id'], 'status': 'scheduled'}
+        }]
+        scheduler = ReminderScheduler(mock_repository, MagicMock(), mode='timer')
+
+        async def process_reminders(lookahead_seconds):
+            assert lookahead_seconds == 0
+            await scheduler.stop()
+
+        with patch.object(scheduler, 'process_reminders', side_effect=process_reminders) as mock_process:
+            await asyncio.wait_for(scheduler.start(), timeout=1)
+
+        mock_process.assert_called_once()
+        assert len(scheduler.timer) == 0
+
+
+@pytest.mark.unit
+@pytest.mark.reminder
+class TestRecipientCache:
+    def test_lru_eviction(self):
+        """Test least recently used events are evicted when the cache is full"""
+        cache = RecipientCache(max_events=2)
+        cache.set('event-a', ['user-1'])
+        cache.set('event-b', ['user-2'])
+        assert cache.get('event-a') == ['user-1']
+
+        cache.set('event-c', ['user-3'])
+
+        assert cache.get('event-b') is None
+        assert cache.get('event-a') == ['user-1']
+        assert cache.get('event-c') == ['user-3']
+
+    @pytest.mark.asyncio
+    async def test_repeated_reminders_skip_participant_query(self, mock_repository, event_data):
+        """Test the 1day, 3hours and 1hour reminders share one participant query until the participants version changes"""
+        mock_repository.list_participant_line_ids.return_value = ['test-user-1']
+        line_bot_api = MagicMock()
+        cache = RecipientCache()
+        scheduler = ReminderScheduler(mock_repository, line_bot_api, recipients=cache)
+        start_date = datetime.now(timezone.utc) + timedelta(days=1)
+        event = dict(event_data, start_date=start_date.isoformat(), participants_version=7)
+
+        def claim(reminder_type, event):
+            mock_repository.claim_due_reminders.return_value = [{
+                'id': f'reminder-{reminder_type}',
+                'event_id': event['id'],
+                'reminder_type': reminder_type,
+                'scheduled_at': datetime.now(timezone.utc).isoformat(),
+                'events': event
+            }]
+
+        # 1日前・3時間前・1時間前のリマインダーの間隔を経過させる
+        now = 1000.0
+        with patch('reminder.recipients.time') as mock_time:
+            mock_time.monotonic.side_effect = lambda: now
+            for reminder_type, elapsed in [('1day', 0), ('3hours', 21 * 3600), ('1hour', 2 * 3600)]:
+                now += elapsed
+                claim(reminder_type, event)
+                await scheduler.process_reminders()
+
+            assert line_bot_api.multicast.call_count == 3
+            assert mock_repository.list_participant_line_ids.call_count == 1
+
+            # 別プロセス（LINE Bot）での参加で版数が変わった場合は読み直す
+            claim('1hour', dict(event, participants_version=8))
+            await scheduler.process_reminders()
+            assert mock_repository.list_participant_line_ids.call_count == 2
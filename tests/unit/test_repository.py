@@ -0,0 +1,191 @@
+import pytest
+import json
+import httpx
+from datetime import datetime, timezone
+from database.repository import PooledPostgrestClient, Repository
+
+def make_repository(handler, pool_size=5):
+    """Create a repository backed by a mock HTTP transport"""
+    client = PooledPostgrestClient(
+        'http://supabase.test/rest/v1',
+        headers={'apikey': 'test-key'},
+        pool_size=pool_size,
+        max_keepalive=2,
+        transport=httpx.MockTransport(handler)
+    )
+    return Repository(client)
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestRepository:
+    @pytest.mark.asyncio
+    async def test_pool_limits(self):
+        """Test the PostgREST session uses the configured connection pool limits"""
+        repository = make_repository(lambda request: httpx.Response(200, json=[]), pool_size=7)
+
+        assert repository.client.limits.max_connections == 7
+        assert repository.client.limits.max_keepalive_connections == 2
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_list_participant_line_ids(self):
+        """Test participants are queried with the user join and users without LINE IDs are skipped"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[
+                {'users': {'line_user_id': 'test-user-1'}},
+                {'users': None}
+            ])
+
+        repository = make_repository(handler)
+        line_ids = await repository.list_participant_line_ids('test-event-id')
+
+        assert line_ids == ['test-user-1']
+        assert requests[0].url.path == '/rest/v1/participants'
+        assert requests[0].url.params['event_id'] == 'eq.test-event-id'
+        # キャンセル待ちのユーザーには送信しない
+        assert requests[0].url.params['status'] == 'eq.registered'
+        assert requests[0].headers['apikey'] == 'test-key'
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_mark_reminders_sent(self):
+        """Test reminders are marked in one request limited to the claiming worker"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[])
+
+        repository = make_repository(handler)
+        await repository.mark_reminders_sent(['reminder-1', 'reminder-2'], 'worker-1')
+
+        assert len(requests) == 1
+        assert requests[0].method == 'PATCH'
+        assert requests[0].url.params['id'] == 'in.(reminder-1,reminder-2)'
+        assert requests[0].url.params['claimed_by'] == 'eq.worker-1'
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_mark_reminders_failed(self):
+        """Test reminders that exhausted their attempts are marked failed by the claiming worker"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[])
+
+        repository = make_repository(handler)
+        await repository.mark_reminders_failed(['reminder-1'], 'worker-1')
+
+        assert requests[0].method == 'PATCH'
+        assert 'failed_at' in json.loads(requests[0].content)
+        assert requests[0].url.params['id'] == 'in.(reminder-1)'
+        assert requests[0].url.params['claimed_by'] == 'eq.worker-1'
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_list_upcoming_events_keyset(self):
+        """Test the next page is selected by (start_date, id) instead of an offset"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[])
+
+        repository = make_repository(handler)
+        after = (datetime(2024, 2, 1, 10, 0, tzinfo=timezone.utc), 'event-uuid')
+        await repository.list_upcoming_events(limit=5, after=after)
+
+        params = requests[0].url.params
+        assert params['or'] == (
+            '(start_date.gt."2024-02-01T10:00:00+00:00",'
+            'and(start_date.eq."2024-02-01T10:00:00+00:00",id.gt."event-uuid"))'
+        )
+        assert params['order'] == 'start_date.asc,id.asc'
+        assert requests[0].headers['range'] == '0-4'
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_list_events_by_event_ids(self):
+        """Test existing events are looked up with a single in filter and no request is made for no IDs"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[])
+
+        repository = make_repository(handler)
+        await repository.list_events_by_event_ids(['1', '2'], columns='id,event_id')
+        assert await repository.list_events_by_event_ids([]) == []
+
+        assert len(requests) == 1
+        assert requests[0].url.params['event_id'] == 'in.(1,2)'
+        assert requests[0].url.params['select'] == 'id,event_id'
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_search_events(self):
+        """Test search is a single ranked and limited call to the search_events function"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[{'id': 'test-event-id'}])
+
+        repository = make_repository(handler)
+        result = await repository.search_events('Test', limit=3)
+
+        assert result == [{'id': 'test-event-id'}]
+        assert requests[0].url.path == '/rest/v1/rpc/search_events'
+        assert json.loads(requests[0].content) == {'p_query': 'Test', 'p_limit': 3}
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_list_triggers_after(self):
+        """Test outbox triggers are read by (created_at, id) after the cursor up to the settle time"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[])
+
+        repository = make_repository(handler)
+        until = datetime(2024, 2, 1, 10, 0, tzinfo=timezone.utc)
+        await repository.list_triggers_after('2024-02-01T09:00:00+00:00', 'trigger-uuid', 100, until)
+
+        params = requests[0].url.params
+        assert params['created_at'] == 'lte.2024-02-01T10:00:00+00:00'
+        assert params['or'] == (
+            '(created_at.gt."2024-02-01T09:00:00+00:00",'
+            'and(created_at.eq."2024-02-01T09:00:00+00:00",id.gt."trigger-uuid"))'
+        )
+        assert params['order'] == 'created_at.asc,id.asc'
+        assert params['limit'] == '100'
+        await repository.close()
+
+    @pytest.mark.asyncio
+    async def test_participant_count_and_page(self):
+        """Test the participant count is read from the counts row and names are read one page at a time"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            if request.url.path.endswith('/event_participant_counts'):
+                return httpx.Response(200, json=[{'participant_count': 5000}])
+            return httpx.Response(200, json=[{'users': {'name': 'Test User'}}])
+
+        repository = make_repository(handler)
+        count = await repository.count_participants('event-uuid')
+        names = await repository.list_participant_names('event-uuid', limit=20, offset=40)
+
+        # 参加者数はトリガーで更新される人数の行を読む（participantsは集計しない）
+        assert count == 5000
+        assert requests[0].url.params['select'] == 'participant_count'
+        assert requests[0].url.params['event_id'] == 'eq.event-uuid'
+        assert names == ['Test User']
+        assert requests[1].url.params['order'] == 'registered_at.asc,id.asc'
+        assert requests[1].headers['range'] == '40-59'
+        await repository.close()
@@ -0,0 +1,152 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+from database.cache import event_key
+from database.search import (
+    EventSearchIndex,
+    MAX_SEARCH_LIMIT,
+    DEFAULT_INDEX_TTL_SECONDS,
+    event_search_index,
+    search_upcoming_events
+)
+
+def make_event(event_id, name, description='', location='', hours=1, status='scheduled'):
+    """Create an event row starting the given number of hours from now"""
+    return {
+        'id': f'uuid-{event_id}',
+        'event_id': event_id,
+        'name': name,
+        'description': description,
+        'location': location,
+        'status': status,
+        'start_date': (datetime.now(timezone.utc) + timedelta(hours=hours)).isoformat()
+    }
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestEventSearchIndex:
+    def test_japanese_substring_match(self):
+        """Test Japanese text matches by substring without word segmentation"""
+        index = EventSearchIndex()
+        index.build([
+            make_event('1', '東京もくもく会', location='渋谷'),
+            make_event('2', '大阪勉強会', location='梅田'),
+        ])
+
+        assert [e['event_id'] for e in index.search('もくもく')] == ['1']
+        assert [e['event_id'] for e in index.search('勉強')] == ['2']
+        assert {e['event_id'] for e in index.search('会')} == {'1', '2'}
+        assert index.search('名古屋') == []
+
+    def test_ranking_and_limit(self):
+        """Test name matches rank above location and description matches, then by start date"""
+        index = EventSearchIndex()
+        index.build([
+            make_event('desc', 'Meetup', description='Python入門', hours=1),
+            make_event('name-late', 'Python Night', hours=5),
+            make_event('name-early', 'python勉強会', hours=2),
+            make_event('location', 'Meetup', location='Python Hall', hours=1),
+        ])
+
+        results = index.search('ＰＹＴＨＯＮ')
+
+        assert [e['event_id'] for e in results] == ['name-early', 'name-late', 'location', 'desc']
+        assert len(index.search('python', limit=2)) == 2
+        assert len(index.search('python', limit=1000)) <= MAX_SEARCH_LIMIT
+
+    def test_all_terms_must_match(self):
+        """Test every whitespace separated term must match"""
+        index = EventSearchIndex()
+        index.build([
+            make_event('1', 'Python勉強会', location='東京'),
+            make_event('2', 'Python勉強会', location='大阪'),
+        ])
+
+        assert [e['event_id'] for e in index.search('python 東京')] == ['1']
+        assert index.search('   ') == []
+
+    def test_started_and_cancelled_events_are_excluded(self):
+        """Test only scheduled events that have not started are returned"""
+        index = EventSearchIndex()
+        index.build([
+            make_event('started', 'Python', hours=-1),
+            make_event('cancelled', 'Python', status='cancelled'),
+            make_event('upcoming', 'Python'),
+        ])
+
+        assert [e['event_id'] for e in index.search('python')] == ['upcoming']
+
+    def test_replace_and_remove(self):
+        """Test re-adding an event replaces its postings and removing it drops them"""
+        index = EventSearchIndex()
+        index.add(make_event('1', 'Python'))
+        index.add(make_event('1', 'Rust'))
+
+        assert index.search('python') == []
+        assert [e['event_id'] for e in index.search('rust')] == ['1']
+
+        index.remove('1')
+        assert index.search('rust') == []
+        assert len(index) == 0
+        assert not index._postings
+
+    @pytest.mark.asyncio
+    async def test_load_pages_with_keyset_cursor(self, mock_repository):
+        """Test the index loads every upcoming event in keyset pages"""
+        events = [make_event(str(i), f'Event {i}', hours=i + 1) for i in range(5)]
+        mock_repository.list_upcoming_events.side_effect = [events[:2], events[2:4], events[4:]]
+        index = EventSearchIndex()
+
+        await index.load(mock_repository, batch_size=2)
+
+        assert len(index) == 5
+        assert index.ready
+        assert mock_repository.list_upcoming_events.call_args_list[1].kwargs['after'] == event_key(events[1])
+
+    def test_update_follows_event_status(self):
+        """Test changes from the Discord listeners add scheduled events and drop the rest"""
+        index = EventSearchIndex()
+        index.update('1', make_event('1', 'Python'))
+        assert len(index) == 1
+
+        index.update('1', make_event('1', 'Python', status='cancelled'))
+        assert len(index) == 0
+        index.update('2', None)
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestSearchUpcomingEvents:
+    @pytest.mark.asyncio
+    async def test_answers_from_memory(self, mock_repository):
+        """Test searches are answered from the index after a single load"""
+        mock_repository.list_upcoming_events.return_value = [make_event('1', 'もくもく会')]
+
+        first = await search_upcoming_events(mock_repository, 'もくもく')
+        second = await search_upcoming_events(mock_repository, 'もくもく')
+
+        assert [e['event_id'] for e in first] == [e['event_id'] for e in second] == ['1']
+        mock_repository.list_upcoming_events.assert_called_once()
+        mock_repository.search_events.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_live_index_is_not_reloaded(self, mock_repository):
+        """Test an index kept current by the Discord listeners is never reloaded"""
+        event_search_index.build([make_event('1', 'Python')])
+        event_search_index.live = True
+        event_search_index.ttl_seconds = 0
+
+        results = await search_upcoming_events(mock_repository, 'python')
+
+        assert len(results) == 1
+        mock_repository.list_upcoming_events.assert_not_called()
+        event_search_index.ttl_seconds = DEFAULT_INDEX_TTL_SECONDS
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_database(self, mock_repository):
+        """Test the database search function is used when the index cannot be loaded"""
+        mock_repository.list_upcoming_events.side_effect = Exception("connection error")
+        mock_repository.search_events.return_value = [make_event('1', 'Python')]
+
+        results = await search_upcoming_events(mock_repository, 'python', limit=3)
+
+        assert len(results) == 1
+        mock_repository.search_events.assert_called_once_with('python', limit=3)
@@ -0,0 +1,131 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock
+from datetime import datetime, timezone, timedelta
+from discord_bot.sync import EventSyncBuffer, scheduled_event_data
+
+def make_scheduled_event(event_id, name='Test Event'):
+    """Create a mock Discord scheduled event"""
+    event = MagicMock()
+    event.id = event_id
+    event.name = name
+    event.description = 'Test Description'
+    event.location = 'Test Location'
+    event.start_time = datetime.now(timezone.utc) + timedelta(days=1)
+    event.end_time = None
+    event.creator_id = 42
+    return event
+
+def echo_upsert(rows):
+    """Return upserted rows with internal IDs like PostgREST does"""
+    return [dict(row, id=f"uuid-{row['event_id']}") for row in rows]
+
+@pytest.mark.unit
+@pytest.mark.discord
+class TestEventSyncBuffer:
+    @pytest.mark.asyncio
+    async def test_changes_to_same_event_are_coalesced(self, mock_repository):
+        """Test repeated changes to one event become one row and one trigger"""
+        mock_repository.upsert_events.side_effect = echo_upsert
+        synced = []
+        buffer = EventSyncBuffer(lambda: mock_repository, synced.extend, flush_delay=60)
+
+        event = make_scheduled_event(1)
+        buffer.add(scheduled_event_data(event, 'scheduled'), ('event_created', 'created'))
+        for i in range(5):
+            event.name = f'Renamed {i}'
+            buffer.add(scheduled_event_data(event, 'scheduled'), ('event_updated', f'updated {i}'))
+        buffer.add(scheduled_event_data(make_scheduled_event(2), 'scheduled'), ('event_updated', 'updated'))
+        await buffer.close()
+
+        rows = mock_repository.upsert_events.call_args[0][0]
+        assert [row['event_id'] for row in rows] == ['1', '2']
+        assert rows[0]['name'] == 'Renamed 4'
+        assert rows[0]['created_by'] == '42'
+        triggers = mock_repository.create_triggers.call_args[0][0]
+        assert triggers == [
+            {'event_id': 'uuid-1', 'trigger_condition': 'event_created', 'message_content': 'updated 4'},
+            {'event_id': 'uuid-2', 'trigger_condition': 'event_updated', 'message_content': 'updated'}
+        ]
+        assert [row['event_id'] for row in synced] == ['1', '2']
+        assert buffer.stats() == {
+            'pending': 0, 'received': 7, 'written_events': 2, 'written_triggers': 2, 'flushes': 1
+        }
+
+    @pytest.mark.asyncio
+    async def test_cancel_before_sync_sends_no_trigger(self, mock_repository):
+        """Test an event created and cancelled within one window is written without notifying"""
+        mock_repository.upsert_events.side_effect = echo_upsert
+        buffer = EventSyncBuffer(lambda: mock_repository, flush_delay=60)
+
+        event = make_scheduled_event(1)
+        buffer.add(scheduled_event_data(event, 'scheduled'), ('event_created', 'created'))
+        buffer.add(scheduled_event_data(event, 'cancelled'), ('event_cancelled', 'cancelled'))
+        await buffer.close()
+
+        assert mock_repository.upsert_events.call_args[0][0][0]['status'] == 'cancelled'
+        mock_repository.create_triggers.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_flushes_after_delay_and_when_full(self, mock_repository):
+        """Test writes happen after the delay, or immediately once max_pending is reached"""
+        mock_repository.upsert_events.side_effect = echo_upsert
+        buffer = EventSyncBuffer(lambda: mock_repository, flush_delay=0.01, max_pending=3)
+
+        buffer.add(scheduled_event_data(make_scheduled_event(1), 'scheduled'))
+        await asyncio.sleep(0.05)
+        assert mock_repository.upsert_events.call_count == 1
+
+        buffer.flush_delay = 60
+        for i in range(3):
+            buffer.add(scheduled_event_data(make_scheduled_event(10 + i), 'scheduled'))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert mock_repository.upsert_events.call_count == 2
+        assert buffer.pending == 0
+        await buffer.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_write_is_requeued(self, mock_repository):
+        """Test changes are kept when the upsert fails and newer changes win on retry"""
+        mock_repository.upsert_events.side_effect = [Exception("connection error"), echo_upsert]
+        buffer = EventSyncBuffer(lambda: mock_repository, flush_delay=60)
+
+        event = make_scheduled_event(1)
+        buffer.add(scheduled_event_data(event, 'scheduled'), ('event_created', 'created'))
+        with pytest.raises(Exception):
+            await buffer.flush()
+        assert buffer.pending == 1
+
+        mock_repository.upsert_events.side_effect = echo_upsert
+        event.name = 'Renamed'
+        buffer.add(scheduled_event_data(event, 'scheduled'), ('event_updated', 'updated'))
+        await buffer.close()
+
+        assert mock_repository.upsert_events.call_args[0][0][0]['name'] == 'Renamed'
+        triggers = mock_repository.create_triggers.call_args[0][0]
+        assert triggers[0]['trigger_condition'] == 'event_created'
+
+    @pytest.mark.asyncio
+    async def test_failed_trigger_insert_is_retried(self, mock_repository):
+        """Test triggers are requeued with their changes when create_triggers fails once"""
+        mock_repository.upsert_events.side_effect = echo_upsert
+        mock_repository.create_triggers.side_effect = [Exception("connection error"), None]
+        synced = []
+        buffer = EventSyncBuffer(lambda: mock_repository, synced.extend, flush_delay=60)
+
+        buffer.add(scheduled_event_data(make_scheduled_event(1), 'scheduled'), ('event_created', 'created'))
+        buffer.add(scheduled_event_data(make_scheduled_event(2), 'scheduled'))
+        with pytest.raises(Exception):
+            await buffer.flush()
+        # イベントは書き込み済みとして反映し、トリガーのある変更だけを戻す
+        assert [row['event_id'] for row in synced] == ['1', '2']
+        assert buffer.pending == 1
+
+        await buffer.close()
+
+        assert [row['event_id'] for row in mock_repository.upsert_events.call_args[0][0]] == ['1']
+        assert mock_repository.create_triggers.call_args[0][0] == [
+            {'event_id': 'uuid-1', 'trigger_condition': 'event_created', 'message_content': 'created'}
+        ]
+        assert buffer.stats()['written_triggers'] == 1
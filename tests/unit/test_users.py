@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from datetime import datetime, timezone, timedelta
+from linebot.models import FollowEvent, UnfollowEvent, SourceUser
+from line_bot.users import LineUserCache, CachedUser
+
+@pytest.mark.unit
+@pytest.mark.line
+class TestLineUserCache:
+    def test_set_merges_and_evicts(self):
+        """Test partial entries are merged and the least recently used user is evicted"""
+        cache = LineUserCache(max_users=2)
+        cache.set('line-1', display_name='User 1')
+        cache.set('line-1', user_uuid='uuid-1')
+        cache.set('line-2', user_uuid='uuid-2')
+
+        assert cache.get('line-1') == CachedUser('uuid-1', 'User 1')
+
+        # line-1を参照したので、追加時にはline-2が削除される
+        cache.set('line-3', user_uuid='uuid-3')
+        assert cache.get('line-2') is None
+        assert cache.get('line-1') is not None
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_entries_expire(self):
+        """Test expired entries are dropped and not merged into new ones"""
+        cache = LineUserCache(ttl_seconds=60)
+        with patch('line_bot.users.time.monotonic', return_value=0):
+            cache.set('line-1', user_uuid='uuid-1', display_name='User 1')
+        with patch('line_bot.users.time.monotonic', return_value=61):
+            cache.set('line-1', display_name='Renamed')
+            assert cache.get('line-1') == CachedUser(None, 'Renamed')
+
+
+@pytest.mark.unit
+@pytest.mark.line
+class TestLineUserLookups:
+    @pytest.fixture
+    def mock_line_bot_api(self):
+        """Set up LINE Bot API mock"""
+        with patch('line_bot.app.line_bot_api') as mock:
+            mock.reply_message = AsyncMock()
+            mock.get_profile = AsyncMock(return_value=MagicMock(display_name="Test User"))
+            return mock
+
+    @pytest.fixture
+    def joined_event(self, event_data):
+        """Join result for an upcoming event"""
+        future_time = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+        return {
+            'status': 'joined',
+            'event': dict(event_data, start_date=future_time),
+            'participant_count': 1,
+            'user_id': 'test-user-uuid'
+        }
+
+    @pytest.mark.asyncio
+    async def test_repeat_interactions_pass_cached_user(self, mock_line_bot_api, mock_repository, event_data, joined_event):
+        """Test the user ID returned by the first join is passed on later joins and cancels"""
+        mock_repository.join_event.return_value = joined_event
+        mock_repository.cancel_participation.return_value = dict(joined_event, status='cancelled')
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import handle_event_join, handle_event_cancel
+            await handle_event_join("token-1", event_data['event_id'], "test-user")
+            await handle_event_join("token-2", event_data['event_id'], "test-user")
+            await handle_event_cancel("token-3", event_data['event_id'], "test-user")
+
+        assert mock_repository.join_event.call_args_list[0][1] == {'user_uuid': None}
+        assert mock_repository.join_event.call_args_list[1][1] == {'user_uuid': 'test-user-uuid'}
+        mock_repository.cancel_participation.assert_called_once_with(
+            event_data['event_id'], "test-user", user_uuid='test-user-uuid'
+        )
+        mock_line_bot_api.get_profile.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_follow_prefetches_profile(self, mock_line_bot_api, mock_repository, event_data, joined_event):
+        """Test the profile fetched on follow is used by the first join and dropped on unfollow"""
+        from line_bot.users import line_user_cache
+        mock_repository.join_event.return_value = joined_event
+
+        with patch('line_bot.app.repository', mock_repository), \
+             patch('line_bot.app.line_bot_api', mock_line_bot_api):
+            from line_bot.app import dispatch_event, handle_event_join
+            await dispatch_event(FollowEvent(reply_token="token-1", source=SourceUser(user_id="test-user")))
+            mock_line_bot_api.get_profile.assert_called_once_with("test-user")
+
+            # 参加時にはプロフィールを取得せず、表示名を最初の呼び出しで渡す
+            await handle_event_join("token-2", event_data['event_id'], "test-user")
+            assert mock_repository.join_event.call_args[0] == (event_data['event_id'], "test-user", "Test User")
+            mock_line_bot_api.get_profile.assert_called_once()
+
+            await dispatch_event(UnfollowEvent(source=SourceUser(user_id="test-user")))
+
+        assert line_user_cache.get("test-user") is None